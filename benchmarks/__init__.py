@@ -0,0 +1,6 @@
+"""
+Micro-benchmarks for performance sensitive code.
+
+These are not run when unit tests are run. Each module is a script meant to
+be run with C{python3 -m benchmarks.<module>} from the top of the tree.
+"""
@@ -0,0 +1,205 @@
+"""
+Compare the all-in-one mode of the client with the default split mode.
+
+In split mode the broker, monitor and manager run in a process each and talk
+over AMP, while in all-in-one mode they share a single process and call each
+other directly. This measures, for both modes:
+
+  - the time it takes for all the services to publish their sockets;
+  - the total resident memory of their processes once started;
+  - the latency of a call from a client to the broker, with a message as
+    argument, over AMP and with a L{LocalRemoteObject} respectively.
+
+The services are started with a configuration pointing to an unreachable
+server, from the root of the source tree::
+
+    python3 -m benchmarks.allinone_benchmark
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+
+from landscape.client.amp import LocalRemoteObject, remote
+from landscape.client.reactor import LandscapeReactor
+from landscape.client.watchdog import bootstrap_list
+from landscape.lib.amp import MethodCallClientFactory, MethodCallServerFactory
+
+SPLIT = ["landscape-broker", "landscape-monitor", "landscape-manager"]
+ALL_IN_ONE = ["landscape-all-in-one"]
+SOCKETS = ["broker.sock", "monitor.sock", "manager.sock"]
+
+CONFIG = """\
+[client]
+url = http://localhost:1/message-system
+ping_url = http://localhost:1/ping
+computer_title = benchmark
+account_name = benchmark
+data_path = {directory}/data
+log_dir = {directory}/log
+"""
+
+# A message of the size of the ones most monitor plugins send.
+MESSAGE = {
+    "type": "memory-info",
+    "memory-info": [(i * 60, 1000000 - i, 2000000 - i) for i in range(30)],
+}
+
+
+def get_rss(pid):
+    """Return the resident memory of the given process, in kB."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def start(programs, timeout=60):
+    """
+    Start the given programs and return the seconds it took for all the
+    sockets to appear, and the total resident memory of the processes in MB.
+    """
+    directory = tempfile.mkdtemp()
+    config = os.path.join(directory, "client.conf")
+    with open(config, "w") as fh:
+        fh.write(CONFIG.format(directory=directory))
+    # Create the directories like the watchdog does before spawning them.
+    bootstrap_list.bootstrap(
+        data_path=os.path.join(directory, "data"),
+        log_dir=os.path.join(directory, "log"),
+    )
+    sockets = os.path.join(directory, "data", "sockets")
+    processes = []
+    try:
+        started = time.perf_counter()
+        for program in programs:
+            processes.append(
+                subprocess.Popen(
+                    [
+                        sys.executable,
+                        os.path.join("scripts", program),
+                        "-c",
+                        config,
+                        "--quiet",
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                ),
+            )
+        while not all(os.path.exists(os.path.join(sockets, name)) for name in SOCKETS):
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"{', '.join(programs)} didn't start")
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        # Let the clients register with the broker and load their plugins.
+        time.sleep(2)
+        rss = sum(get_rss(process.pid) for process in processes) / 1000
+        return elapsed, rss
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(directory)
+
+
+class Broker:
+    """A stand-in for the L{BrokerServer}, which stores the messages."""
+
+    name = "broker"
+
+    def __init__(self):
+        self.messages = []
+
+    @remote
+    def send_message(self, message, session_id, urgent=False):
+        self.messages.append(message)
+        return len(self.messages)
+
+
+@inlineCallbacks
+def measure_latency(reactor, calls):
+    """
+    Return the median latency in microseconds of C{calls} sequential calls
+    to C{send_message}, over AMP and with a L{LocalRemoteObject}.
+    """
+    broker = Broker()
+    # Create the wrapper first, as it cancels the calls scheduled so far.
+    local = LocalRemoteObject(broker, LandscapeReactor())
+    directory = tempfile.mkdtemp()
+    socket = os.path.join(directory, "broker.sock")
+    port = reactor.listenUNIX(
+        socket,
+        MethodCallServerFactory(broker, ["send_message"]),
+    )
+    client = MethodCallClientFactory(reactor)
+    connector = reactor.connectUNIX(socket, client)
+    results = {}
+    try:
+        remotes = [
+            ("split", (yield client.getRemoteObject())),
+            ("all-in-one", local),
+        ]
+        for mode, remote_broker in remotes:
+            latencies = []
+            for _ in range(calls):
+                start = time.perf_counter()
+                yield remote_broker.send_message(MESSAGE, "session", urgent=False)
+                latencies.append(time.perf_counter() - start)
+            results[mode] = statistics.median(latencies) * 1000000
+    finally:
+        client.stopTrying()
+        connector.disconnect()
+        yield port.stopListening()
+        shutil.rmtree(directory)
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Compare the all-in-one mode with the split mode.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Start the services this many times, keeping the best startup "
+        "time. Default is 3.",
+    )
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=1000,
+        help="The number of calls to measure the latency of. Default is 1000.",
+    )
+    options = parser.parse_args(args)
+
+    startup = {}
+    for mode, programs in [("split", SPLIT), ("all-in-one", ALL_IN_ONE)]:
+        runs = [start(programs) for _ in range(options.repeat)]
+        startup[mode] = (min(run[0] for run in runs), min(run[1] for run in runs))
+
+    def benchmark(reactor):
+        deferred = measure_latency(reactor, options.calls)
+
+        def report(latency):
+            print(f"{'mode':<12}{'startup (s)':>14}{'RSS (MB)':>12}{'call (us)':>12}")
+            for mode, (elapsed, rss) in startup.items():
+                print(f"{mode:<12}{elapsed:>14.2f}{rss:>12.1f}{latency[mode]:>12.0f}")
+
+        return deferred.addCallback(report)
+
+    react(benchmark)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,102 @@
+"""
+Benchmark remote method calls with large arguments over L{landscape.lib.amp}.
+
+Arguments longer than C{MAX_VALUE_LENGTH} are sent in chunks, like the
+package messages the package reporter sends through the broker. This
+measures the throughput of a call taking such an argument, between a client
+and a server listening on a UNIX socket in the same process::
+
+    python3 -m benchmarks.amp_benchmark
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+
+from landscape.lib.amp import MethodCallClientFactory, MethodCallServerFactory
+
+MB = 1000 * 1000
+
+
+class Receiver:
+    """The object exposed by the server."""
+
+    def receive(self, data):
+        return len(data)
+
+
+@inlineCallbacks
+def run(reactor, sizes, repeat):
+    """
+    Return a C{dict} mapping each of the given sizes, in MB, to the best
+    throughput in MB/s of C{repeat} calls with an argument of that size.
+    """
+    directory = tempfile.mkdtemp()
+    socket = os.path.join(directory, "benchmark.sock")
+    port = reactor.listenUNIX(
+        socket,
+        MethodCallServerFactory(Receiver(), ["receive"]),
+    )
+    client = MethodCallClientFactory(reactor)
+    connector = reactor.connectUNIX(socket, client)
+    try:
+        remote = yield client.getRemoteObject()
+        results = {}
+        for size in sizes:
+            data = b"x" * (size * MB)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                length = yield remote.receive(data)
+                elapsed = time.perf_counter() - start
+                assert length == len(data)
+                if best is None or elapsed < best:
+                    best = elapsed
+            results[size] = round(size / best, 1)
+    finally:
+        client.stopTrying()
+        connector.disconnect()
+        yield port.stopListening()
+        os.rmdir(directory)
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of AMP calls with large arguments.",
+    )
+    parser.add_argument(
+        "--size",
+        action="append",
+        type=int,
+        help="The size in MB of the argument. Can be given more than once. "
+        "Default is 1, 5, 10 and 50.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Make each call this many times, keeping the best. Default is 3.",
+    )
+    options = parser.parse_args(args)
+
+    def benchmark(reactor):
+        deferred = run(reactor, options.size or [1, 5, 10, 50], options.repeat)
+
+        def report(results):
+            print(f"{'size (MB)':<12}{'MB/s':>10}")
+            for size, throughput in sorted(results.items()):
+                print(f"{size:<12}{throughput:>10.1f}")
+
+        return deferred.addCallback(report)
+
+    react(benchmark)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
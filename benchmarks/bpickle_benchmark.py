@@ -0,0 +1,274 @@
+"""
+Benchmark L{landscape.lib.bpickle} on representative payloads.
+
+The throughput of C{dumps} and C{loads} and the peak memory they allocate are
+measured for each corpus and compared with the baseline stored next to this
+module. A measurement worse than the baseline by more than the threshold is
+reported as a regression and makes the script exit with a non-zero status.
+
+Throughput depends on the machine, so record a new baseline with C{--save}
+before judging a change, then run the benchmark again with the change::
+
+    python3 -m benchmarks.bpickle_benchmark --save
+    python3 -m benchmarks.bpickle_benchmark
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from landscape.lib import bpickle
+
+BASELINE_FILENAME = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "bpickle_baseline.json",
+)
+
+
+def make_packages_message(count=20000):
+    """
+    Return a C{packages} message listing C{count} package ids, both as
+    single ids and as ranges, like the package reporter sends them.
+    """
+    installed = []
+    package_id = 1
+    for index in range(count):
+        if index % 4 == 0:
+            installed.append((package_id, package_id + 3))
+            package_id += 4
+        else:
+            installed.append(package_id)
+            package_id += 2
+    return {
+        "type": "packages",
+        "installed": installed,
+        "available": [package_id + i for i in range(count // 10)],
+        "not-locked": list(range(100)),
+    }
+
+
+def make_active_process_info_message(count=5000):
+    """Return an C{active-process-info} message adding C{count} processes."""
+    processes = []
+    for pid in range(1, count + 1):
+        processes.append(
+            {
+                "pid": pid,
+                "name": f"process-{pid}",
+                "state": b"S" if pid % 7 else b"R",
+                "sleep-average": 0,
+                "uid": pid % 1000,
+                "gid": pid % 100,
+                "vm-size": 4096 * pid,
+                "start-time": 1700000000 + pid,
+                "percent-cpu": pid % 100 / 3.0,
+            },
+        )
+    return {
+        "type": "active-process-info",
+        "kill-all-processes": True,
+        "add-processes": processes,
+    }
+
+
+def make_persist_tree(users=2000, processes=5000):
+    """
+    Return a tree shaped like the monitor persist on a busy host, with user
+    and group snapshots, known processes and per-plugin state.
+    """
+    return {
+        "users": {
+            "users": {
+                f"user{uid}": {
+                    "username": f"user{uid}",
+                    "name": f"User Number {uid}",
+                    "uid": uid,
+                    "primary-gid": uid,
+                    "home-phone": None,
+                    "enabled": bool(uid % 2),
+                }
+                for uid in range(users)
+            },
+            "groups": {
+                f"group{gid}": {
+                    "name": f"group{gid}",
+                    "gid": gid,
+                    "members": [f"user{uid}" for uid in range(gid, gid + 5)],
+                }
+                for gid in range(users // 2)
+            },
+        },
+        "active-process-info": {
+            "processes": {pid: 1700000000 + pid for pid in range(processes)},
+            "boot-time": 1700000000,
+        },
+        "memory-info": {"last-date": 1700000000.5, "accumulate": []},
+        "message-store": {"sequence": 12345, "pending_offset": 2},
+    }
+
+
+CORPORA = {
+    "packages": make_packages_message,
+    "active-process-info": make_active_process_info_message,
+    "persist-tree": make_persist_tree,
+}
+
+
+def measure_throughput(function, argument, size, repeat):
+    """
+    Return the throughput in MB/s of the fastest of C{repeat} calls to
+    C{function}, for C{size} bytes of serialized data. Like C{timeit}, the
+    garbage collector is disabled while timing.
+    """
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(argument)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return round(size / best / 1e6, 1)
+
+
+def measure_peak_memory(function, argument):
+    """Return the peak memory in KiB allocated by calling C{function}."""
+    tracemalloc.start()
+    try:
+        function(argument)
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run(corpora, repeat):
+    """
+    Benchmark the given corpora and return a C{dict} mapping their names to
+    their results.
+    """
+    results = {}
+    for name in corpora:
+        obj = CORPORA[name]()
+        data = bpickle.dumps(obj)
+        size = len(data)
+        results[name] = {
+            "size": size,
+            "dumps-mbps": measure_throughput(bpickle.dumps, obj, size, repeat),
+            "loads-mbps": measure_throughput(bpickle.loads, data, size, repeat),
+            "dumps-peak-kib": measure_peak_memory(bpickle.dumps, obj),
+            "loads-peak-kib": measure_peak_memory(bpickle.loads, data),
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Return a description of each result worse than its baseline by more
+    than C{threshold}, a fraction of the baseline value.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for key, value in sorted(result.items()):
+            if key not in expected or key == "size":
+                continue
+            if key.endswith("-mbps"):
+                limit = expected[key] * (1 - threshold)
+                regressed = value < limit
+            else:
+                limit = expected[key] * (1 + threshold)
+                regressed = value > limit
+            if regressed:
+                regressions.append(
+                    f"{name} {key}: {value:.1f} (baseline {expected[key]:.1f})",
+                )
+    return regressions
+
+
+def format_results(results):
+    """Return a table of the given results."""
+    keys = ["size", "dumps-mbps", "loads-mbps", "dumps-peak-kib", "loads-peak-kib"]
+    lines = ["{:<20}".format("corpus") + "".join(f"{key:>16}" for key in keys)]
+    for name, result in sorted(results.items()):
+        lines.append(
+            f"{name:<20}"
+            + "".join(
+                f"{result[key]:>16.1f}" if key != "size" else f"{result[key]:>16}"
+                for key in keys
+            ),
+        )
+    return "\n".join(lines)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Benchmark bpickle and compare with a stored baseline.",
+    )
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=sorted(CORPORA),
+        help="Benchmark only this corpus. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=10,
+        help="Run each measurement this many times, keeping the best. Default is 10.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="The fraction by which a result may be worse than the baseline "
+        "before it's reported as a regression. Default is 0.2.",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_FILENAME,
+        help="The file holding the baseline results.",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing.",
+    )
+    options = parser.parse_args(args)
+
+    results = run(options.corpus or sorted(CORPORA), options.repeat)
+    print(format_results(results))
+
+    if options.save:
+        with open(options.baseline, "w") as fd:
+            json.dump(results, fd, indent=4, sort_keys=True)
+            fd.write("\n")
+        print(f"Saved baseline to {options.baseline}")
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print(f"No baseline at {options.baseline}, run with --save first.")
+        return 0
+    with open(options.baseline) as fd:
+        baseline = json.load(fd)
+    regressions = compare(results, baseline, options.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
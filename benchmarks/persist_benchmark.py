@@ -0,0 +1,107 @@
+"""
+Benchmark the L{landscape.lib.persist.Persist} accessors.
+
+The monitor plugins read and write their state through a L{RootedPersist}
+with a handful of constant keys, many times per hour. This measures the cost
+of one call for each of these access patterns::
+
+    python3 -m benchmarks.persist_benchmark
+"""
+
+import argparse
+import gc
+import sys
+import time
+
+from landscape.lib.persist import Persist
+
+# The roots of the monitor plugins, and the ones of the other state kept in
+# the monitor persist.
+ROOTS = [
+    "active-process-info",
+    "cpu-usage",
+    "cpu-frequency",
+    "computer-info",
+    "load-average",
+    "memory-info",
+    "mount-info",
+    "network-activity",
+    "network-device",
+    "processor-info",
+    "swift-usage",
+    "temperature",
+    "users",
+    "ubuntu-pro-info",
+    "update-manager",
+    "snap-services",
+]
+
+# (name, method, path, argument) tuples, where the argument is the value
+# given to the method, if any.
+PATTERNS = [
+    ("get data", "get", "data", None),
+    ("set data", "set", "data", {"release": "24.04", "code-name": "noble"}),
+    ("get tuple path", "get", ("mount-info", "/home"), None),
+    ("get accumulate", "get", "accumulate.memory-free", None),
+    ("set accumulate", "set", "accumulate.memory-free", (1700000000, 42)),
+    ("get missing", "get", "last-cpu-usage", None),
+    ("has", "has", "data", None),
+    ("get list item", "get", "devices[0]", None),
+]
+
+
+def make_persist():
+    """Return a persist filled like the monitor one, and its plugin roots."""
+    persist = Persist()
+    for root in ROOTS:
+        persist.set((root, "data"), {"key": root, "values": list(range(5))})
+        persist.set((root, "accumulate", "memory-free"), (1700000000, 0))
+        persist.set((root, "devices"), ["sda", "sdb"])
+    persist.set(("mount-info", "mount-info", "/home"), {"device": "/dev/sda2"})
+    return persist, [persist.root_at(root) for root in ROOTS]
+
+
+def measure(rooted, method, path, argument, calls):
+    """Return the cost in microseconds of one call, the best of 5 runs."""
+    functions = [getattr(persist, method) for persist in rooted]
+    arguments = (path,) if argument is None else (path, argument)
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(calls // len(functions)):
+                for function in functions:
+                    function(*arguments)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / (calls // len(functions) * len(functions)) * 1e6
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Measure the cost of the Persist accessors.",
+    )
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=20000,
+        help="The number of calls timed for each access pattern. Default is 20000.",
+    )
+    options = parser.parse_args(args)
+
+    persist, rooted = make_persist()
+    print(f"{'pattern':<20}{'us/call':>10}")
+    for name, method, path, argument in PATTERNS:
+        cost = measure(rooted, method, path, argument, options.calls)
+        print(f"{name:<20}{cost:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
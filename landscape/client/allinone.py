@@ -0,0 +1,221 @@
+"""Run the broker, monitor and manager services in a single process.
+
+By default the watchdog spawns a process for each of the broker, monitor and
+manager services, which talk to each other over AMP. In all-in-one mode they
+share a single process and reactor instead, and call each other's methods
+directly through L{LocalComponentConnector}s, saving the memory of two
+Python interpreters and the cost of serializing messages over sockets.
+
+The services still publish their components over AMP, so that the package
+reporter, C{landscape-config} and the watchdog can talk to them as usual.
+
+The process runs as root when the manager is run, while the broker and the
+monitor run as the C{landscape} user in their own processes. The files of
+the broker and the monitor are given back to that user when the process
+starts and exits, so that the client can still be switched back to separate
+processes.
+"""
+
+import glob
+import grp
+import os
+import pwd
+import signal
+from functools import partial
+
+from twisted.application.app import startApplication
+from twisted.application.service import Application, MultiService
+from twisted.internet.error import ReactorNotRunning
+
+from landscape.client.amp import LocalComponentConnector
+from landscape.client.broker.amp import LocalBrokerConnector
+from landscape.client.broker.config import BrokerConfiguration
+from landscape.client.broker.service import BrokerService
+from landscape.client.deployment import convert_arg_to_bool, init_logging
+from landscape.client.environment import GROUP, USER
+from landscape.client.manager.config import ManagerConfiguration
+from landscape.client.manager.service import ManagerService
+from landscape.client.monitor.config import MonitorConfiguration
+from landscape.client.monitor.service import MonitorService
+from landscape.client.reactor import LandscapeReactor
+from landscape.lib.logging import LoggingAttributeError
+
+
+class SharedReactor(LandscapeReactor):
+    """A L{LandscapeReactor} wrapping the Twisted reactor of other services.
+
+    Each service keeps its own wrapper, so that the events fired by one of
+    them are not seen by the others, just like in separate processes.
+    Unlike L{LandscapeReactor}, it doesn't cancel the calls scheduled by the
+    services created before it, and it tolerates being stopped by several
+    services.
+    """
+
+    def stop(self):
+        try:
+            super().stop()
+        except ReactorNotRunning:
+            pass
+
+    def _cleanup(self):
+        pass
+
+
+class AllInOneBrokerService(BrokerService):
+    reactor_factory = SharedReactor
+
+
+class AllInOneMonitorService(MonitorService):
+    reactor_factory = SharedReactor
+
+
+class AllInOneManagerService(ManagerService):
+    reactor_factory = SharedReactor
+
+
+class AllInOneConfiguration(BrokerConfiguration):
+    """Specialized configuration for the all-in-one Landscape client."""
+
+    def make_parser(self):
+        """
+        Specialize L{Configuration.make_parser}, adding the C{monitor_only}
+        option.
+        """
+        parser = super().make_parser()
+        parser.add_argument(
+            "--monitor-only",
+            type=convert_arg_to_bool,
+            nargs="?",
+            const=True,
+            default=False,
+            help="Don't run the manager service.",
+        )
+        return parser
+
+
+class AllInOneService(MultiService):
+    """Run the broker, monitor and manager services in the same process.
+
+    The monitor and manager connect to the broker with L{LocalBrokerConnector}s
+    and the broker connects back to them with L{LocalComponentConnector}s.
+
+    @cvar service_name: C{all-in-one}
+    @ivar broker_service: The L{BrokerService}.
+    @ivar client_services: The L{MonitorService} and, unless running in
+        monitor-only mode, the L{ManagerService}.
+
+    @param config: The L{BrokerConfiguration} of the broker service.
+    @param monitor_config: The L{MonitorConfiguration} of the monitor service.
+    @param manager_config: The L{ManagerConfiguration} of the manager service,
+        or C{None} to not run it.
+    """
+
+    service_name = "all-in-one"
+    broker_service_factory = AllInOneBrokerService
+    monitor_service_factory = AllInOneMonitorService
+    manager_service_factory = AllInOneManagerService
+
+    def __init__(self, config, monitor_config, manager_config=None):
+        super().__init__()
+        self.config = config
+        self.broker_service = self.broker_service_factory(config)
+        self.reactor = self.broker_service.reactor
+        broker = self.broker_service.broker
+
+        monitor_service = self.monitor_service_factory(monitor_config)
+        clients = [(monitor_service, monitor_service.monitor)]
+        if manager_config is not None:
+            manager_service = self.manager_service_factory(manager_config)
+            clients.append((manager_service, manager_service.manager))
+
+        self.broker_service.setServiceParent(self)
+        self.client_services = []
+        for service, component in clients:
+            service.broker_connector_factory = partial(LocalBrokerConnector, broker)
+            broker.connectors_registry[component.name] = partial(
+                LocalComponentConnector,
+                component,
+            )
+            # Only the broker reactor is run, forward its events.
+            for event_type in ("run", "stop"):
+                self.reactor.call_on(
+                    event_type,
+                    partial(service.reactor.fire, event_type),
+                )
+            service.setServiceParent(self)
+            self.client_services.append(service)
+        self._monitor_service = monitor_service
+
+    def startService(self):  # noqa: N802
+        # Fix the files left behind if we were killed.
+        self.restore_ownership()
+        super().startService()
+
+    def get_unprivileged_paths(self):
+        """
+        Return the files and directories of the broker and the monitor,
+        which run as L{USER} when not in all-in-one mode.
+        """
+        config = self.config
+        paths = []
+        for pattern in [
+            self.broker_service.persist_filename + "*",
+            self._monitor_service.persist_filename + "*",
+            config.message_store_path,
+            config.message_store_path + ".migrating",
+            config.message_store_path + ".unmigrating",
+            config.message_store_database_path + "*",
+            config.exchange_store_path + "*",
+            os.path.join(config.sockets_path, "broker.sock"),
+            os.path.join(config.sockets_path, "monitor.sock"),
+        ]:
+            paths.extend(glob.glob(pattern))
+        return paths
+
+    def restore_ownership(self):
+        """
+        Give the files of the broker and the monitor back to L{USER} and
+        L{GROUP}, if running as root.
+        """
+        if os.getuid() != 0:
+            return
+        uid = pwd.getpwnam(USER).pw_uid
+        gid = grp.getgrnam(GROUP).gr_gid
+        for path in self.get_unprivileged_paths():
+            os.lchown(path, uid, gid)
+            for root, directories, files in os.walk(path):
+                for name in directories + files:
+                    os.lchown(os.path.join(root, name), uid, gid)
+
+
+def run(args):
+    """Run the all-in-one client, given some command line arguments."""
+    config = AllInOneConfiguration()
+    config.load(args)
+    if config.clones > 0:
+        raise SystemExit("Clones are not supported in all-in-one mode.")
+    try:
+        init_logging(config, AllInOneService.service_name)
+    except LoggingAttributeError:
+        return
+
+    # The monitor and manager configurations don't know about the options
+    # specific to this mode.
+    args = [arg for arg in args if not arg.startswith("--monitor-only")]
+    monitor_config = MonitorConfiguration()
+    monitor_config.load(args)
+    manager_config = None
+    if not config.monitor_only:
+        manager_config = ManagerConfiguration()
+        manager_config.load(args)
+
+    application = Application(f"landscape-{AllInOneService.service_name}")
+    service = AllInOneService(config, monitor_config, manager_config)
+    service.setServiceParent(application)
+
+    startApplication(application, False)
+    if config.ignore_sigint:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    service.reactor.run()
+    service.restore_ownership()
@@ -13,9 +13,13 @@ and have them respond to standard requests like "ping" or "exit".
 
 import logging
 import os
+from copy import deepcopy
+
+from twisted.internet.defer import Deferred, fail, maybeDeferred, succeed
 
 from landscape.lib.amp import (
     MethodCallClientFactory,
+    MethodCallError,
     MethodCallServerFactory,
     RemoteObject,
 )
@@ -31,20 +35,27 @@ class ComponentPublisher:
         implementing the methods listed in the C{methods} class variable.
     @param reactor: The L{LandscapeReactor} used to listen to the socket.
     @param config: The L{Configuration} object used to build the socket path.
+    @param stats: Optionally, the L{MethodCallStats} accounting for the calls
+        received by the component.
     """
 
     factory = MethodCallServerFactory
 
-    def __init__(self, component, reactor, config):
+    def __init__(self, component, reactor, config, stats=None):
         self._reactor = reactor
         self._config = config
         self._component = component
+        self._stats = stats
         self._port = None
         self.methods = get_remote_methods(type(component)).keys()
 
     def start(self):
         """Start accepting connections."""
-        factory = MethodCallServerFactory(self._component, self.methods)
+        factory = MethodCallServerFactory(
+            self._component,
+            self.methods,
+            stats=self._stats,
+        )
         socket_path = _get_socket_path(self._component, self._config)
         self._port = self._reactor.listen_unix(socket_path, factory)
 
@@ -85,12 +96,20 @@ class ComponentConnector:
     @cvar factory: The factory class to use for building protocols.
     @cvar remote: The L{RemoteObject} class or sub-class used for building
         remote objects.
+    @cvar batch_calls: Whether the remote object built by this connector
+        sends the calls made in the same reactor iteration, but the first
+        one, together, see L{MethodCallClientFactory.batchCalls}.
 
     @param reactor: A L{LandscapeReactor} object.
     @param config: A L{LandscapeConfiguration}.
     @param retry_on_reconnect: If C{True} the remote object built by this
         connector will retry L{MethodCall}s that failed due to lost
         connections.
+    @param caller: The name of the connecting component, if any, which is
+        sent along with the calls so the remote component can account for
+        them.
+    @param stats: Optionally, the L{MethodCallStats} accounting for the calls
+        made to the remote component.
 
     @see: L{MethodCallClientFactory}.
     """
@@ -98,11 +117,21 @@ class ComponentConnector:
     factory = MethodCallClientFactory
     component = None  # Must be defined by sub-classes
     remote = RemoteObject
-
-    def __init__(self, reactor, config, retry_on_reconnect=False):
+    batch_calls = False
+
+    def __init__(
+        self,
+        reactor,
+        config,
+        retry_on_reconnect=False,
+        caller=None,
+        stats=None,
+    ):
         self._reactor = reactor
         self._config = config
         self._retry_on_reconnect = retry_on_reconnect
+        self._caller = caller
+        self._stats = stats
         self._connector = None
 
     def connect(self, max_retries=None, factor=None, quiet=False):
@@ -122,8 +151,12 @@ class ComponentConnector:
         factory = self.factory(self._reactor._reactor)
         factory.initialDelay = factory.delay = 0.05
         factory.retryOnReconnect = self._retry_on_reconnect
+        factory.batchCalls = self.batch_calls
         factory.remote = self.remote
         factory.maxRetries = max_retries
+        factory.peer = self.component.name
+        factory.caller = self._caller
+        factory.stats = self._stats
         if factor:
             factory.factor = factor
 
@@ -156,5 +189,142 @@ class ComponentConnector:
             self._connector = None
 
 
+class LocalRemoteObject:
+    """Call the remote methods of a component living in the same process.
+
+    This looks like a L{RemoteObject}, but the methods of the component are
+    called directly instead of being sent over AMP. As with L{MethodCall}s,
+    each method is called in a later reactor iteration and gets a copy of
+    the arguments, and the caller gets a copy of its result.
+
+    @param component: The component to call methods on.
+    @param reactor: The L{LandscapeReactor} used to schedule the calls.
+    @param caller: The name of the calling component, if any.
+    @param stats: Optionally, the L{MethodCallStats} accounting for the calls
+        made to the component.
+    @param received_stats: Optionally, the L{MethodCallStats} accounting for
+        the calls received by the component.
+    """
+
+    def __init__(
+        self,
+        component,
+        reactor,
+        caller=None,
+        stats=None,
+        received_stats=None,
+    ):
+        self._component = component
+        self._reactor = reactor
+        self._caller = caller
+        self._stats = stats
+        self._received_stats = received_stats
+        self._methods = get_remote_methods(type(component))
+
+    def __getattr__(self, method):
+        """Return a function calling the given C{method} of the component."""
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call_method(*args, **kwargs):
+            if method not in self._methods:
+                return fail(MethodCallError(f"Forbidden method '{method}'"))
+            deferred = Deferred()
+            self._reactor.call_later(
+                0,
+                self._call_method,
+                method,
+                deepcopy(args),
+                deepcopy(kwargs),
+                deferred,
+            )
+            return deferred
+
+        return call_method
+
+    def _call_method(self, method, args, kwargs, deferred):
+        start = self._reactor.time()
+
+        def handle_result(result):
+            record(False)
+            return deepcopy(result)
+
+        def handle_failure(failure):
+            record(True)
+            raise MethodCallError(failure.value)
+
+        def record(failed):
+            duration = self._reactor.time() - start
+            if self._stats is not None:
+                self._stats.record(
+                    self._component.name,
+                    method,
+                    duration,
+                    0,
+                    0,
+                    failed,
+                )
+            if self._received_stats is not None:
+                self._received_stats.record(
+                    self._caller,
+                    method,
+                    duration,
+                    0,
+                    0,
+                    failed,
+                )
+
+        result = maybeDeferred(getattr(self._component, method), *args, **kwargs)
+        result.addCallbacks(handle_result, handle_failure)
+        result.chainDeferred(deferred)
+
+
+class LocalComponentConnector:
+    """Connect to a Landscape component living in the same process.
+
+    This has the same interface as L{ComponentConnector}, but the connection
+    is always established right away, and results in a L{LocalRemoteObject}.
+
+    @cvar remote: The L{LocalRemoteObject} class or sub-class used for
+        building remote objects.
+
+    @param component: The component to connect to.
+    @see: L{ComponentConnector} for the other parameters.
+    """
+
+    remote = LocalRemoteObject
+
+    def __init__(
+        self,
+        component,
+        reactor,
+        config,
+        retry_on_reconnect=False,
+        caller=None,
+        stats=None,
+    ):
+        self.component = component
+        self._reactor = reactor
+        self._config = config
+        self._caller = caller
+        self._stats = stats
+        self._received_stats = None
+
+    def connect(self, max_retries=None, factor=None, quiet=False):
+        """Return a L{Deferred} resulting in a L{LocalRemoteObject}."""
+        return succeed(
+            self.remote(
+                self.component,
+                self._reactor,
+                caller=self._caller,
+                stats=self._stats,
+                received_stats=self._received_stats,
+            ),
+        )
+
+    def disconnect(self):
+        """There's nothing to disconnect from, this is a no-op."""
+
+
 def _get_socket_path(component, config):
     return os.path.join(config.sockets_path, component.name + ".sock")
@@ -1,6 +1,11 @@
 from twisted.internet.defer import execute, maybeDeferred, succeed
 
-from landscape.client.amp import ComponentConnector, get_remote_methods
+from landscape.client.amp import (
+    ComponentConnector,
+    LocalComponentConnector,
+    LocalRemoteObject,
+    get_remote_methods,
+)
 from landscape.client.broker.client import BrokerClient
 from landscape.client.broker.server import BrokerServer
 from landscape.client.manager.manager import Manager
@@ -8,7 +13,9 @@ from landscape.client.monitor.monitor import Monitor
 from landscape.lib.amp import MethodCallArgument, RemoteObject
 
 
-class RemoteBroker(RemoteObject):
+class BrokerCallsMixin:
+    """Helpers built on top of the L{BrokerServer} remote methods."""
+
     def call_if_accepted(self, type, callable, *args):
         """Call C{callable} if C{type} is an accepted message type."""
         deferred_types = self.get_accepted_message_types()
@@ -32,6 +39,14 @@ class RemoteBroker(RemoteObject):
         return result.addCallback(lambda args: handlers[args[0]](**args[1]))
 
 
+class RemoteBroker(BrokerCallsMixin, RemoteObject):
+    """A L{RemoteObject} for the L{BrokerServer}."""
+
+
+class LocalRemoteBroker(BrokerCallsMixin, LocalRemoteObject):
+    """A L{LocalRemoteObject} for a L{BrokerServer} in the same process."""
+
+
 class FakeRemoteBroker:
     """Looks like L{RemoteBroker}, but actually talks to local objects."""
 
@@ -84,10 +99,29 @@ class FakeRemoteBroker:
 
 
 class RemoteBrokerConnector(ComponentConnector):
-    """Helper to create connections with the L{BrokerServer}."""
+    """Helper to create connections with the L{BrokerServer}.
+
+    The monitor and manager plugins make many small calls to the broker in
+    the same reactor iteration, which get sent together after the first.
+    """
 
     remote = RemoteBroker
     component = BrokerServer
+    batch_calls = True
+
+
+class LocalBrokerConnector(LocalComponentConnector):
+    """Helper to connect to a L{BrokerServer} running in the same process.
+
+    The calls made through it are accounted in the broker's
+    C{received_calls}, as if they had been received over AMP.
+    """
+
+    remote = LocalRemoteBroker
+
+    def __init__(self, broker, reactor, config, *args, **kwargs):
+        super().__init__(broker, reactor, config, *args, **kwargs)
+        self._received_stats = broker.received_calls
 
 
 class RemoteClientConnector(ComponentConnector):
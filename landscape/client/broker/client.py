@@ -1,10 +1,11 @@
 import random
 import sys
 import traceback
-from logging import debug, error, exception, info
+from logging import debug, error, exception, info, warning
 from typing import TYPE_CHECKING
 
 from twisted.internet.defer import maybeDeferred, succeed
+from twisted.python.reflect import namedClass
 
 from landscape.client.amp import remote
 from landscape.lib.format import format_object
@@ -154,6 +155,51 @@ class BrokerClientPlugin:
         return failure
 
 
+class LazyPlugin:
+    """Stand in for a L{BrokerClientPlugin} until the server wants its data.
+
+    The module of the plugin, along with the third-party libraries it may
+    pull in, is imported only when the server accepts the type of message
+    the plugin sends. The plugin is then added to the client, and sends its
+    first message in its next run or exchange.
+
+    @param class_name: The fully qualified name of the plugin class.
+    @param message_type: The type of message the plugin sends.
+    @ivar plugin: The plugin, once loaded.
+    """
+
+    def __init__(self, class_name, message_type):
+        self.class_name = class_name
+        self.message_type = message_type
+        self.plugin = None
+        self._loaded = False
+
+    def register(self, client):
+        self.client = client
+        client.reactor.call_on(
+            ("message-type-acceptance-changed", self.message_type),
+            self._acceptance_changed,
+        )
+        return client.broker.call_if_accepted(self.message_type, self.load)
+
+    def _acceptance_changed(self, acceptance):
+        if acceptance:
+            self.load()
+
+    def load(self):
+        """Import the plugin and add it to the client, if not done yet."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            plugin = namedClass(self.class_name)()
+        except Exception as exc:
+            warning(f"Unable to load plugin '{self.class_name}': {exc}")
+            return
+        self.plugin = plugin
+        self.client.add(plugin)
+
+
 class BrokerClient:
     """Basic plugin registry for clients that have to deal with the broker.
 
@@ -2,7 +2,7 @@
 
 import os
 
-from landscape.client.deployment import Configuration
+from landscape.client.deployment import Configuration, convert_arg_to_bool
 
 
 class BrokerConfiguration(Configuration):
@@ -30,6 +30,12 @@ class BrokerConfiguration(Configuration):
               - C{computer_title}
               - C{exchange_interval} (C{15*60})
               - C{urgent_exchange_interval} (C{1*60})
+              - C{max_exchange_interval} (C{0})
+              - C{max_payload_bytes} (C{5*1024*1024})
+              - C{drain_threshold} (C{0})
+              - C{message_store_backend} (C{"directory"})
+              - C{compress_messages} (C{False})
+              - C{stream_requests} (C{False})
               - C{http_proxy}
               - C{https_proxy}
               - C{hostagent_uid}
@@ -68,6 +74,40 @@ class BrokerConfiguration(Configuration):
             metavar="INTERVAL",
             help="The number of seconds between urgent server exchanges.",
         )
+        parser.add_argument(
+            "--max-exchange-interval",
+            default=0,
+            type=int,
+            metavar="INTERVAL",
+            help="The maximum number of seconds between server exchanges "
+            "when there's nothing to exchange. Defaults to 0, which always "
+            "uses the exchange interval. Replaced by the maximum the server "
+            "allows, if any, when it sets the exchange interval.",
+        )
+        parser.add_argument(
+            "--max-payload-bytes",
+            default=5 * 1024 * 1024,
+            type=int,
+            metavar="BYTES",
+            help="The maximum size of the messages sent in a single "
+            "exchange, 0 for no limit.",
+        )
+        parser.add_argument(
+            "--drain-threshold",
+            default=0,
+            type=int,
+            metavar="COUNT",
+            help="The number of pending messages above which exchanges are "
+            "run back-to-back until the backlog is drained, 0 to disable.",
+        )
+        parser.add_argument(
+            "--method-call-stats-interval",
+            default=0,
+            type=int,
+            metavar="INTERVAL",
+            help="The number of seconds between summaries of the remote "
+            "method calls of the broker written to the log, 0 to disable.",
+        )
         parser.add_argument(
             "--ping-interval",
             default=30,
@@ -75,6 +115,31 @@ class BrokerConfiguration(Configuration):
             metavar="INTERVAL",
             help="The number of seconds between pings.",
         )
+        parser.add_argument(
+            "--message-store-backend",
+            default="directory",
+            choices=["directory", "sqlite"],
+            help="How queued messages are stored: one file per message "
+            "in a directory hierarchy, or rows of a SQLite database. "
+            "Queued messages are migrated when switching backends.",
+        )
+        parser.add_argument(
+            "--compress-messages",
+            type=convert_arg_to_bool,
+            nargs="?",
+            const=True,
+            default=False,
+            help="Compress queued messages on disk.",
+        )
+        parser.add_argument(
+            "--stream-requests",
+            type=convert_arg_to_bool,
+            nargs="?",
+            const=True,
+            default=False,
+            help="Send exchange requests as they're serialized, with "
+            "chunked transfer encoding.",
+        )
         parser.add_argument(
             "--http-proxy",
             metavar="URL",
@@ -119,6 +184,11 @@ class BrokerConfiguration(Configuration):
         """Get the path to the message store."""
         return os.path.join(self.data_path, "messages")
 
+    @property
+    def message_store_database_path(self):
+        """Get the path to the database of the SQLite message store."""
+        return os.path.join(self.data_path, "messages.database")
+
     def load(self, args):
         """
         Load options from command line arguments and a config file.
@@ -353,9 +353,14 @@ from landscape.lib.backoff import ExponentialBackoff
 from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.format import format_delta
 from landscape.lib.hashlib import md5
+from landscape.lib.histogram import RollingHistogram
 from landscape.lib.message import RESYNC, got_next_expected
 from landscape.lib.versioning import is_version_higher, sort_versions
 
+# The number of idle exchanges in a row after which the exchange interval
+# starts growing.
+IDLE_EXCHANGES = 3
+
 
 class MessageExchange:
     """Schedule and handle message exchanges with the server.
@@ -395,7 +400,12 @@ class MessageExchange:
             and `urgent_exchange_interval` parameters, respectively holding
             the time interval between subsequent exchanges of non-urgent
             messages, and the time interval between subsequent exchanges
-            of urgent messages.
+            of urgent messages, and the `max_payload_bytes` one, limiting
+            the serialized size of the messages sent in each exchange. Its
+            `drain_threshold` parameter is the number of pending messages
+            above which exchanges are run back-to-back, and the
+            `max_exchange_interval` one is the longest interval between
+            exchanges when there's nothing to exchange.
         """
         self._reactor = reactor
         self._message_store = store
@@ -405,9 +415,15 @@ class MessageExchange:
         self._exchange_interval = config.exchange_interval
         self._urgent_exchange_interval = config.urgent_exchange_interval
         self._max_messages = max_messages
+        self._max_payload_bytes = config.max_payload_bytes or None
+        self._drain_threshold = config.drain_threshold
+        self._draining = False
         self._max_log_text_bytes = 100000  # 100KB
         self._notification_id = None
         self._exchange_id = None
+        self._exchange_time = None
+        self._idle_exchanges = 0
+        self._idle_interval = None
         self._exchanging = False
         self._urgent_exchange = False
         self._client_accepted_types = set()
@@ -417,6 +433,7 @@ class MessageExchange:
         self._stopped = False
         self._backoff_counter = ExponentialBackoff(300, 7200)  # 5 to 120 min
         self._exchange_state = {}
+        self._stats = {}
 
         self.register_message("accepted-types", self._handle_accepted_types)
         self.register_message("resynchronize", self._handle_resynchronize)
@@ -469,13 +486,50 @@ class MessageExchange:
 
         @param message: Same as in L{MessageStore.add}.
         """
+        if not self._prepare_message(message):
+            return None
+        message_id = self._message_store.add(message)
+        if urgent:
+            self.schedule_exchange(urgent=True)
+        else:
+            self._adapt_exchange_schedule()
+        return message_id
+
+    def send_many(self, messages, urgent=False):
+        """Include several messages to be sent in an exchange.
+
+        This behaves like calling L{send} for each message, but the
+        messages are added to the message store in a single batch.
+
+        @param messages: A sequence of messages, as in L{MessageStore.add}.
+        @return: A C{list} with the identifier of each message, C{None} for
+            the messages that were discarded.
+        """
+        prepared = [self._prepare_message(message) for message in messages]
+        message_ids = iter(
+            self._message_store.add_many(
+                [message for message, ok in zip(messages, prepared) if ok],
+            ),
+        )
+        if urgent:
+            self.schedule_exchange(urgent=True)
+        else:
+            self._adapt_exchange_schedule()
+        return [next(message_ids) if ok else None for ok in prepared]
+
+    def _prepare_message(self, message):
+        """Get C{message} ready to be stored.
+
+        @return: C{False} if the message is obsolete and must be discarded,
+            C{True} otherwise.
+        """
         if self._message_is_obsolete(message):
             logging.info(
                 "Response message with operation-id "
                 f"{message.get('operation-id')} was discarded "
                 "because the client's secure ID has changed in the meantime",
             )
-            return None
+            return False
 
         # These fields sometimes have really long output we need to trim
         self.truncate_message_field("err", message)
@@ -483,10 +537,7 @@ class MessageExchange:
 
         if "timestamp" not in message:
             message["timestamp"] = int(self._reactor.time())
-        message_id = self._message_store.add(message)
-        if urgent:
-            self.schedule_exchange(urgent=True)
-        return message_id
+        return True
 
     def start(self):
         """Start scheduling exchanges. The first one will be urgent."""
@@ -498,6 +549,7 @@ class MessageExchange:
             # Cancel the next scheduled exchange
             self._reactor.cancel_call(self._exchange_id)
             self._exchange_id = None
+            self._exchange_time = None
         if self._notification_id is not None:
             # Cancel the next scheduled notification of an impending exchange
             self._reactor.cancel_call(self._notification_id)
@@ -547,6 +599,15 @@ class MessageExchange:
             logging.info(
                 f"Exchange interval set to {self._config.exchange_interval:d} seconds.",
             )
+            # Idle exchanges may only be spaced out further than the server
+            # asked if it allows it.
+            self._config.max_exchange_interval = message.get("max-exchange", 0)
+            self._idle_interval = None
+            if self._config.max_exchange_interval:
+                logging.info(
+                    "Maximum exchange interval set to "
+                    f"{self._config.max_exchange_interval:d} seconds.",
+                )
         if "urgent-exchange" in message:
             self._config.urgent_exchange_interval = message["urgent-exchange"]
             logging.info(
@@ -573,7 +634,10 @@ class MessageExchange:
 
         self._reactor.fire("pre-exchange")
 
+        start_time = time.time()
         payload = self._make_payload()
+        self._record_stat("build", time.time() - start_time)
+        self._record_stat("messages-sent", len(payload["messages"]))
 
         start_time = time.time()
         if self._urgent_exchange:
@@ -588,12 +652,18 @@ class MessageExchange:
         deferred = Deferred()
 
         def exchange_completed():
-            self.schedule_exchange(force=True)
+            if self._draining:
+                self._schedule_drain_exchange()
+            else:
+                self.schedule_exchange(force=True)
             self._reactor.fire("exchange-done")
             logging.info(
                 "Message exchange completed in %s.",
                 format_delta(time.time() - start_time),
             )
+            ratio = self._message_store.get_compression_ratio()
+            if ratio is not None:
+                logging.debug("Message store compression ratio: %.1f.", ratio)
             deferred.callback(None)
 
         def handle_result(result):
@@ -602,12 +672,16 @@ class MessageExchange:
                 if self._urgent_exchange:
                     logging.info("Switching to normal exchange mode.")
                     self._urgent_exchange = False
+                for name, value in (result.get("stats") or {}).items():
+                    self._record_stat(name, value)
                 self._handle_result(payload, result)
+                self._record_stat("exchange", time.time() - start_time)
                 self._message_store.record_success(int(self._reactor.time()))
                 self._backoff_counter.decrease()
             else:
                 self._reactor.fire("exchange-failed")
                 logging.info("Message exchange failed.")
+                self._stop_draining()
             exchange_completed()
 
         def handle_failure(error_class, error, traceback):
@@ -650,6 +724,7 @@ class MessageExchange:
 
             self._message_store.record_failure(int(self._reactor.time()))
             logging.info("Message exchange failed.")
+            self._stop_draining()
             exchange_completed()
 
         self._reactor.call_in_thread(
@@ -663,10 +738,119 @@ class MessageExchange:
         )
         return deferred
 
+    def _record_stat(self, name, value):
+        """Add a sample to the rolling histogram of the given statistic."""
+        if name not in self._stats:
+            self._stats[name] = RollingHistogram()
+        self._stats[name].add(value)
+
+    def get_stats(self):
+        """Return statistics about the last exchanges.
+
+        Each statistic is summarized as returned by
+        L{RollingHistogram.get_summary}. The C{build}, C{dump}, C{network},
+        C{decode} and C{dispatch} ones are the time in seconds spent in each
+        phase of an exchange, respectively building the payload,
+        serializing it, talking to the server, deserializing the response
+        and handling the messages in it, while C{exchange} covers all of
+        them but the first. The C{bytes-sent}, C{bytes-received}, C{messages-sent} and
+        C{messages-received} ones count what was transferred.
+
+        The C{dump}, C{network}, C{decode} and C{bytes-*} statistics are only
+        available if the transport provides them.
+        """
+        return {name: stat.get_summary() for name, stat in self._stats.items()}
+
     def is_urgent(self):
         """Return bool showing whether there is an urgent exchange scheduled"""
         return self._urgent_exchange
 
+    def is_draining(self):
+        """Return bool showing whether exchanges are run back-to-back."""
+        return self._draining
+
+    def _stop_draining(self):
+        if self._draining:
+            logging.info("Leaving backlog drain mode.")
+            self._draining = False
+
+    def _schedule_drain_exchange(self):
+        """Schedule the next exchange as soon as possible.
+
+        The server can still slow us down by making the backoff delay grow.
+        """
+        if self._stopped:
+            return
+        if self._exchange_id:
+            self._reactor.cancel_call(self._exchange_id)
+        if self._notification_id is not None:
+            self._reactor.cancel_call(self._notification_id)
+            self._notification_id = None
+        interval = self._backoff_counter.get_random_delay()
+        if interval:
+            logging.warning(
+                f"Server is busy. Backing off client for {interval} seconds",
+            )
+        self._exchange_id = self._reactor.call_later(interval, self.exchange)
+        self._exchange_time = None
+
+    def _get_exchange_interval(self):
+        """Return the number of seconds until the next regular exchange.
+
+        The exchange interval is shortened as pending messages pile up,
+        reaching the urgent exchange interval when they fill a payload,
+        either by number or by size. After L{IDLE_EXCHANGES} exchanges in a
+        row with nothing to send or receive, the interval is doubled at each
+        further idle exchange, up to the maximum exchange interval. Once the
+        server set the exchange interval, the maximum is the one it set
+        along with it, if any.
+        """
+        urgent_interval = self._config.urgent_exchange_interval
+        max_interval = max(
+            self._config.exchange_interval,
+            self._config.max_exchange_interval,
+        )
+        interval = min(
+            self._idle_interval or self._config.exchange_interval,
+            max_interval,
+        )
+        pending = self._message_store.count_pending_messages()
+        if pending and interval > urgent_interval:
+            fill = pending / self._max_messages
+            if self._max_payload_bytes:
+                size = self._message_store.get_pending_messages_size()
+                fill = max(fill, size / self._max_payload_bytes)
+            interval -= (interval - urgent_interval) * min(fill, 1)
+        return int(interval)
+
+    def _adapt_exchange_schedule(self):
+        """Bring the next regular exchange forward if messages piled up."""
+        self._idle_exchanges = 0
+        self._idle_interval = None
+        if self._exchange_time is None or self._urgent_exchange:
+            return
+        now = self._reactor.time()
+        if self._exchange_time - now <= self._config.urgent_exchange_interval:
+            # More messages can't bring the exchange any closer.
+            return
+        if now + self._get_exchange_interval() < self._exchange_time:
+            self.schedule_exchange(force=True)
+
+    def _update_idle_exchanges(self, idle):
+        """Keep track of the exchanges that had nothing to exchange."""
+        if not idle:
+            self._idle_exchanges = 0
+            self._idle_interval = None
+            return
+        self._idle_exchanges += 1
+        if self._idle_exchanges >= IDLE_EXCHANGES:
+            max_interval = max(
+                self._config.exchange_interval,
+                self._config.max_exchange_interval,
+            )
+            interval = self._idle_interval or self._config.exchange_interval
+            self._idle_interval = min(interval * 2, max_interval)
+
     def schedule_exchange(self, urgent=False, force=False):
         """Schedule an exchange to happen.
 
@@ -682,6 +866,9 @@ class MessageExchange:
         """
         if self._stopped:
             return
+        if self._draining and not force and self._exchange_id is not None:
+            # The next exchange will happen as soon as possible anyway.
+            return
         # The 'not self._exchanging' check below is currently untested.
         # It's a bit tricky to test as it is preventing rehooking 'exchange'
         # while there's a background thread doing the exchange itself.
@@ -696,7 +883,7 @@ class MessageExchange:
             if self._urgent_exchange:
                 interval = self._config.urgent_exchange_interval
             else:
-                interval = self._config.exchange_interval
+                interval = self._get_exchange_interval()
             backoff_delay = self._backoff_counter.get_random_delay()
             if backoff_delay:
                 logging.warning(
@@ -716,6 +903,7 @@ class MessageExchange:
                 interval,
                 self.exchange,
             )
+            self._exchange_time = self._reactor.time() + interval
 
     def _get_exchange_token(self):
         """Get the token given us by the server at the last exchange.
@@ -745,11 +933,15 @@ class MessageExchange:
 
         The payload will contain all pending messages eligible for
         delivery, up to a maximum of C{max_messages} as passed to
-        the L{__init__} method.
+        the L{__init__} method, and up to C{max_payload_bytes} bytes
+        of serialized messages as set in the configuration.
         """
         store = self._message_store
         accepted_types_digest = self._hash_types(store.get_accepted_types())
-        messages = store.get_pending_messages(self._max_messages)
+        messages = store.get_pending_messages(
+            self._max_messages,
+            max_bytes=self._max_payload_bytes,
+        )
         total_messages = store.count_pending_messages()
         if messages:
             # Each message is tagged with the API that the client was
@@ -883,17 +1075,29 @@ class MessageExchange:
 
         message_store.commit()
 
+        # Saving the whole persist after each message would rewrite it as many
+        # times as there are messages, so the server sequence is journaled
+        # instead and everything is saved once at the end. The persist is
+        # still saved after the messages whose handlers changed it.
+        messages = result.get("messages", ())
         sequence = message_store.get_server_sequence()
-        for message in result.get("messages", ()):
-            # The wire format of the 'type' field is bytes, but our handlers
-            # actually expect it to be a string. Some unit tests set it to
-            # a regular string (since there is no difference between strings
-            # and bytes in Python 2), so we check the type before converting.
-            message["type"] = maybe_bytes(message["type"])
-            self.handle_message(message)
-            sequence += 1
-            message_store.set_server_sequence(sequence)
-            message_store.commit()
+        start_time = time.time()
+        try:
+            for message in messages:
+                # The wire format of the 'type' field is bytes, but our
+                # handlers actually expect it to be a string. Some unit tests
+                # set it to a regular string (since there is no difference
+                # between strings and bytes in Python 2), so we check the type
+                # before converting.
+                message["type"] = maybe_bytes(message["type"])
+                self.handle_message(message)
+                sequence += 1
+                message_store.journal_server_sequence(sequence)
+        finally:
+            if messages:
+                message_store.commit()
+        self._record_stat("dispatch", time.time() - start_time)
+        self._record_stat("messages-received", len(messages))
 
         if message_store.get_pending_messages(1):
             count = message_store.count_pending_messages()
@@ -905,7 +1109,23 @@ class MessageExchange:
             # otherwise have more messages even after transferring
             # what we could.
             if next_expected != old_sequence:
-                self.schedule_exchange(urgent=True)
+                if self._drain_threshold and count >= self._drain_threshold:
+                    # There's a backlog, e.g. after an outage. Don't wait for
+                    # the urgent exchange interval to send the rest of it.
+                    if not self._draining:
+                        logging.info("Entering backlog drain mode.")
+                        self._draining = True
+                else:
+                    self._stop_draining()
+                    self.schedule_exchange(urgent=True)
+            else:
+                self._stop_draining()
+            self._update_idle_exchanges(False)
+        else:
+            self._stop_draining()
+            self._update_idle_exchanges(
+                not payload["messages"] and not messages,
+            )
 
     def register_message(self, type, handler):
         """Register a handler for the given message type.
@@ -112,6 +112,9 @@ class Pinger:
         to hit when pinging, and 'ping_interval' how frequently to ping.
         Changes in the configuration object will take effect from the next
         scheduled ping.
+    @param get_page: Optionally, the function the L{PingClient} should use to
+        perform requests, e.g. L{landscape.lib.fetch.CurlSession.fetch} to
+        share connections with the message exchange.
     """
 
     def __init__(
@@ -121,6 +124,7 @@ class Pinger:
         exchanger,
         config,
         ping_client_factory=PingClient,
+        get_page=None,
     ):
         self._config = config
         self._identity = identity
@@ -128,6 +132,7 @@ class Pinger:
         self._exchanger = exchanger
         self._call_id = None
         self._ping_client = None
+        self._get_page = get_page
         self.ping_client_factory = ping_client_factory
         reactor.call_on("message", self._handle_set_intervals)
 
@@ -139,9 +144,13 @@ class Pinger:
 
     def start(self):
         """Start pinging."""
+        kwargs = {}
+        if self._get_page is not None:
+            kwargs["get_page"] = self._get_page
         self._ping_client = self.ping_client_factory(
             self._reactor,
             cainfo=self._config.ssl_public_key,
+            **kwargs,
         )
         self._schedule()
 
@@ -49,6 +49,7 @@ from twisted.internet.defer import Deferred
 
 from landscape.client.amp import remote
 from landscape.client.manager.manager import FAILED
+from landscape.lib.amp import MethodCallStats
 from landscape.lib.twisted_util import gather_results
 
 
@@ -80,6 +81,11 @@ class BrokerServer:
     @param exchange: The L{MessageExchange} to send messages with.
     @param registration: The {RegistrationHandler}.
     @param message_store: The broker's L{MessageStore}.
+
+    @ivar received_calls: The L{MethodCallStats} of the remote calls received
+        from the broker clients.
+    @ivar sent_calls: The L{MethodCallStats} of the remote calls made to the
+        registered broker clients.
     """
 
     name = "broker"
@@ -104,6 +110,8 @@ class BrokerServer:
         self._registered_clients = {}
         self._connectors = {}
         self._pinger = pinger
+        self.received_calls = MethodCallStats()
+        self.sent_calls = MethodCallStats()
 
         reactor.call_on("message", self.broadcast_message)
         reactor.call_on("impending-exchange", self.impending_exchange)
@@ -168,7 +176,12 @@ class BrokerServer:
             if old_connector is not None:
                 old_connector.disconnect()
         connector_class = self.connectors_registry.get(name)
-        connector = connector_class(self._reactor, self._config)
+        connector = connector_class(
+            self._reactor,
+            self._config,
+            caller=self.name,
+            stats=self.sent_calls,
+        )
 
         def register(remote_client):
             self._registered_clients[name] = remote_client
@@ -241,11 +254,37 @@ class BrokerServer:
         if self._message_store.is_valid_session_id(session_id):
             return self._exchanger.send(message, urgent=urgent)
 
+    @remote
+    def send_messages(self, messages, session_id, urgent=False):
+        """Queue several C{messages} for delivery at once.
+
+        @param messages: A C{list} of message C{dict}s, as in L{send_message}.
+        @param session_id: A session ID, as in L{send_message}.
+        @param urgent: If C{True}, exchange urgently, otherwise exchange
+            during the next regularly scheduled exchange.
+        @return: A C{list} with the message identifier of each message, or
+            C{None} if the session ID is no longer valid.
+        """
+        if session_id is None:
+            raise RuntimeError(
+                "Session ID must be set before attempting to send a message",
+            )
+        if self._message_store.is_valid_session_id(session_id):
+            return self._exchanger.send_many(messages, urgent=urgent)
+
     @remote
     def is_message_pending(self, message_id):
         """Indicate if a message with given C{message_id} is pending."""
         return self._message_store.is_pending(message_id)
 
+    @remote
+    def are_messages_pending(self, message_ids):
+        """Indicate which of the messages with given C{message_ids} are pending.
+
+        @return: A list of bools, one for each of the given C{message_ids}.
+        """
+        return self._message_store.are_pending(message_ids)
+
     @remote
     def stop_clients(self):
         """Tell all the clients to exit."""
@@ -282,6 +321,44 @@ class BrokerServer:
         """Return the uuid of the Landscape server we're pointing at."""
         return self._message_store.get_server_uuid()
 
+    @remote
+    def get_exchange_stats(self):
+        """Return statistics about the last message exchanges.
+
+        @see: L{MessageExchange.get_stats}
+        """
+        return self._exchanger.get_stats()
+
+    @remote
+    def get_method_call_stats(self):
+        """Return statistics about the remote method calls of the broker.
+
+        @return: A C{dict} with the C{received} summary of the calls made by
+            the broker clients, and the C{sent} one of the calls made to
+            them, see L{MethodCallStats.get_summary}.
+        """
+        return {
+            "received": self.received_calls.get_summary(),
+            "sent": self.sent_calls.get_summary(),
+        }
+
+    def log_method_call_stats(self):
+        """Log a summary of the remote method calls of the broker."""
+        stats = self.get_method_call_stats()
+        for direction, preposition in [("received", "from"), ("sent", "to")]:
+            for peer, methods in sorted(stats[direction].items()):
+                for method, method_stats in sorted(methods.items()):
+                    duration = method_stats["duration"]
+                    logging.info(
+                        f"Remote calls {direction} {preposition} {peer}: "
+                        f"{method} called {method_stats['calls']} times, "
+                        f"{method_stats['failures']} failed, "
+                        f"{method_stats['arguments-bytes']} bytes of "
+                        f"arguments, {method_stats['result-bytes']} bytes "
+                        f"of results, p50 {duration['p50']:.4f}s, "
+                        f"p99 {duration['p99']:.4f}s",
+                    )
+
     @remote
     def register_client_accepted_message_type(self, type):
         """Register a new message type which can be accepted by this client.
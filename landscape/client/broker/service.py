@@ -10,7 +10,10 @@ from landscape.client.broker.exchangestore import ExchangeStore
 from landscape.client.broker.ping import Pinger
 from landscape.client.broker.registration import Identity, RegistrationHandler
 from landscape.client.broker.server import BrokerServer
-from landscape.client.broker.store import get_default_message_store
+from landscape.client.broker.store import (
+    SQLiteMessageStore,
+    get_default_message_store,
+)
 from landscape.client.broker.transport import HTTPTransport
 from landscape.client.environment import DIRECTORY_MODE, FILE_MODE
 from landscape.client.service import LandscapeService, run_landscape_service
@@ -58,11 +61,23 @@ class BrokerService(LandscapeService):
             self.reactor,
             config.url,
             config.ssl_public_key,
+            stream_requests=config.stream_requests,
         )
-        self.message_store = get_default_message_store(
-            self.persist,
-            config.message_store_path,
-        )
+        if config.message_store_backend == "sqlite":
+            self.message_store = get_default_message_store(
+                self.persist,
+                config.message_store_database_path,
+                directory=config.message_store_path,
+                compress=config.compress_messages,
+                store_class=SQLiteMessageStore,
+            )
+        else:
+            self.message_store = get_default_message_store(
+                self.persist,
+                config.message_store_path,
+                compress=config.compress_messages,
+                database=config.message_store_database_path,
+            )
         self.identity = Identity(self.config, self.persist)
         exchange_store = ExchangeStore(self.config.exchange_store_path)
         self.exchanger = MessageExchange(
@@ -78,6 +93,7 @@ class BrokerService(LandscapeService):
             self.identity,
             self.exchanger,
             config,
+            get_page=getattr(self.transport.session, "fetch", None),
         )
         self.registration = RegistrationHandler(
             config,
@@ -99,6 +115,7 @@ class BrokerService(LandscapeService):
             self.broker,
             self.reactor,
             self.config,
+            stats=self.broker.received_calls,
         )
 
     def startService(self):  # noqa: N802
@@ -117,6 +134,11 @@ class BrokerService(LandscapeService):
         self.publisher.start()
         self.exchanger.start()
         self.pinger.start()
+        if self._config.method_call_stats_interval:
+            self.reactor.call_every(
+                self._config.method_call_stats_interval,
+                self.broker.log_method_call_stats,
+            )
 
     def stopService(self):  # noqa: N802
         """Stop the broker."""
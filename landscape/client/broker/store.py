@@ -88,26 +88,36 @@ of already-sent messages. In that case there is now way we can recover the
 lost messages, and we'll just send the oldest one that we have.
 
 See L{MessageStore} for details about how messages are stored on the file
-system and L{landscape.lib.message.got_next_expected} to check how the
-strategy for updating the pending offset and the sequence is implemented.
+system, L{SQLiteMessageStore} for the alternative backend keeping them in a
+SQLite database, and L{landscape.lib.message.got_next_expected} to check how
+the strategy for updating the pending offset and the sequence is implemented.
 """
 
 import itertools
 import logging
 import os
 import shutil
+import sqlite3
 import traceback
 import uuid
+import zlib
+from collections import OrderedDict
 
 from landscape import DEFAULT_SERVER_API
 from landscape.client.environment import DIRECTORY_MODE, FILE_MODE
 from landscape.lib import bpickle
-from landscape.lib.fs import create_binary_file, read_binary_file
+from landscape.lib.fs import create_binary_file, read_binary_file, touch_file
+from landscape.lib.schema import InvalidError
+from landscape.lib.store import with_cursor
 from landscape.lib.versioning import is_version_higher, sort_versions
 
 HELD = "h"
 BROKEN = "b"
 
+# Header byte of compressed messages.  It's not a valid bpickle type code,
+# so messages stored uncompressed can still be told apart and read back.
+COMPRESSED = b"z"
+
 
 class MessageStore:
     """A message store which stores its messages in a file system hierarchy.
@@ -122,9 +132,32 @@ class MessageStore:
     incremented when successfully receiving messages from the server, in the
     very same way described above but with the roles inverted.
 
+    Messages are stored one per file, in numbered directories holding up to
+    C{directory_size} files each. The flags of a message are appended to its
+    file name, e.g. C{0/12_h} is a held message. To avoid listing and
+    sorting the hierarchy on every operation, the store keeps an in-memory
+    index of the messages, built once at startup and kept up to date as
+    messages are added, flagged and deleted. This means the store must be
+    the only writer of its directory.
+
+    Messages can optionally be compressed with zlib before being written,
+    see L{compress_message_data}.  Compressed and uncompressed messages can
+    live side by side in the same store.
+
+    Saving the persist rewrites all of it, so when many messages are
+    received from the server at once the server sequence is recorded in a
+    small journal file next to the persist file instead, see
+    L{journal_server_sequence}. The journal is cleared by L{commit} and
+    replayed when the store is created.
+
     @param persist: a L{Persist} used to save state parameters like the
         accepted message types, sequence, server uuid etc.
     @param directory: base of the file system hierarchy
+    @param compress: Whether to compress new messages.
+    @param database: Optionally, the file name of a L{SQLiteMessageStore}
+        database. When switching back from that backend, the messages
+        queued in the database are moved into the hierarchy, preserving
+        their order, flags and identifiers, and the database is removed.
     """
 
     # The initial message API version that we use to communicate with the
@@ -134,6 +167,19 @@ class MessageStore:
     # in case the server supports it.
     _api = DEFAULT_SERVER_API
 
+    # The server sequence recorded in the journal but not yet in the persist.
+    _journaled_server_sequence = None
+
+    # The size and identifier of each indexed message, by index key.
+    _metadata = None
+
+    # The identifier of the next message to be stored.
+    _next_message_id = 1
+
+    # The name of the backend, saved in the persist to notice when the
+    # store is created with another one than the last time.
+    backend = "directory"
+
     def __init__(
         self,
         persist,
@@ -141,22 +187,306 @@ class MessageStore:
         directory_size=1000,
         max_dirs=4,
         max_size_mb=400,
+        compress=False,
+        database=None,
     ):
         self._directory = directory
+        self._database = database
         self._directory_size = directory_size
         self._max_dirs = max_dirs  # Maximum number of directories in store
         self._max_size_mb = max_size_mb  # Maximum size of message store
+        self._compress = compress
+        self._raw_size_added = 0
+        self._stored_size_added = 0
         self._schemas = {}
         self._original_persist = persist
         self._persist = persist.root_at("message-store")
+        self._replay_journal()
+        self._check_backend()
         message_dir = self._message_dir()
         if not os.path.isdir(message_dir):
             os.makedirs(message_dir)
         os.chmod(message_dir, mode=DIRECTORY_MODE)
+        self._build_index()
+
+    def _build_index(self):
+        """Scan the file system hierarchy and index the stored messages.
+
+        The index maps C{(directory number, file number)} keys to the flags
+        of each message, in the order in which messages are walked. The size
+        and the identifier of each message are kept as well, along with a
+        map from identifiers back to keys. We also keep track of how many
+        messages and bytes each directory holds and of how many messages are
+        neither held nor broken, so that counting pending messages, looking
+        up a message or checking the size limit doesn't need to walk
+        anything.
+
+        Message identifiers are handed out in increasing order and saved in
+        the persist by L{commit}. Messages without a saved identifier get a
+        new one, except in a store which predates them, where the inode
+        number which used to be the identifier is kept.
+        """
+        message_ids = {
+            (dirnum, filenum): message_id
+            for dirnum, filenum, message_id in self._persist.get(
+                "message-ids",
+                (),
+            )
+        }
+        legacy = self._persist.get("next-message-id") is None
+        if self._metadata is not None:
+            legacy = False
+            message_ids.update(
+                (key, message_id)
+                for key, (size, message_id) in self._metadata.items()
+            )
+        self._next_message_id = max(
+            self._next_message_id,
+            self._persist.get("next-message-id", 1),
+        )
+        self._index = OrderedDict()
+        self._metadata = {}
+        self._keys = {}
+        self._dir_counts = {}
+        self._dir_sizes = {}
+        self._unflagged_count = 0
+        self._unflagged_size = 0
+        self._total_size = 0
+        self._pending_boundary = None
+        for dirname in self._get_sorted_filenames():
+            self._dir_counts[int(dirname)] = 0
+            self._dir_sizes[int(dirname)] = 0
+        for filename in self._scan_messages():
+            stat = os.stat(filename)
+            message_id = message_ids.get(self._get_key(filename))
+            if message_id is None or message_id in self._keys:
+                if legacy:
+                    message_id = stat.st_ino
+                else:
+                    message_id = self._new_message_id()
+            self._index_add(filename, stat.st_size, message_id)
+        if self._keys:
+            self._next_message_id = max(
+                self._next_message_id,
+                max(self._keys) + 1,
+            )
+
+    def _new_message_id(self):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    def _get_key(self, path):
+        dirname, basename = os.path.split(path)
+        return int(os.path.basename(dirname)), int(basename.split("_")[0])
+
+    def _index_add(self, path, size, message_id):
+        key = self._get_key(path)
+        flags = self._get_flags(path)
+        self._index[key] = flags
+        self._metadata[key] = (size, message_id)
+        self._keys[message_id] = key
+        self._dir_counts[key[0]] = self._dir_counts.get(key[0], 0) + 1
+        self._dir_sizes[key[0]] = self._dir_sizes.get(key[0], 0) + size
+        self._total_size += size
+        if not flags:
+            self._unflagged_count += 1
+            self._unflagged_size += size
+        self._invalidate_pending_boundary(key)
+
+    def _index_remove(self, path):
+        key = self._get_key(path)
+        flags = self._index.pop(key)
+        size, message_id = self._metadata.pop(key)
+        del self._keys[message_id]
+        self._dir_counts[key[0]] -= 1
+        self._dir_sizes[key[0]] -= size
+        self._total_size -= size
+        if not flags:
+            self._unflagged_count -= 1
+            self._unflagged_size -= size
+        self._invalidate_pending_boundary(key)
+        return size, message_id
+
+    def _invalidate_pending_boundary(self, key):
+        """Forget the cached pending boundary if a change to C{key} may move it.
+
+        Messages coming after the first pending one don't count to find it,
+        so adding, flagging or removing them leaves it in place. New messages
+        always come last, but one of them may be the first pending message if
+        there was none.
+        """
+        if self._pending_boundary is not None and (
+            self._pending_boundary[1] is None or key <= self._pending_boundary[1]
+        ):
+            self._pending_boundary = None
 
     def commit(self):
-        """Persist metadata to disk."""
+        """Persist metadata to disk, clearing the server sequence journal."""
+        if self._journaled_server_sequence is not None:
+            self.set_server_sequence(self._journaled_server_sequence)
+        if self._metadata is not None:
+            message_ids = [
+                (dirnum, filenum, message_id)
+                for (dirnum, filenum), (size, message_id) in self._metadata.items()
+            ]
+            self._persist.set("message-ids", message_ids)
+            self._persist.set("next-message-id", self._next_message_id)
         self._original_persist.save()
+        journal_filename = self._get_journal_filename()
+        if journal_filename is not None and os.path.exists(journal_filename):
+            os.unlink(journal_filename)
+
+    def _get_journal_filename(self):
+        """Return the name of the server sequence journal file, if any.
+
+        There's no journal if the persist doesn't have a file to save to.
+        """
+        filename = self._original_persist.filename
+        if filename is None:
+            return None
+        return os.path.expanduser(filename) + ".sequence-journal"
+
+    def _replay_journal(self):
+        """Recover the server sequence from a leftover journal.
+
+        The first line of the journal is the server sequence that was saved
+        when the journal was started, and the following lines are the values
+        it was set to afterwards. The last of them is only restored if the
+        saved persist still holds the starting value, otherwise the persist
+        was saved again after the journal was written and is more recent.
+        A trailing partial line, if any, is ignored.
+        """
+        journal_filename = self._get_journal_filename()
+        if journal_filename is None or not os.path.exists(journal_filename):
+            return
+        with open(journal_filename) as fd:
+            lines = fd.read().split("\n")[:-1]
+        try:
+            sequences = [int(line) for line in lines]
+        except ValueError:
+            logging.warning(f"Ignoring broken journal {journal_filename}.")
+            sequences = []
+        if len(sequences) > 1 and sequences[0] == self.get_server_sequence():
+            logging.info(
+                f"Recovered server sequence {sequences[-1]:d} from journal.",
+            )
+            self.set_server_sequence(sequences[-1])
+        self.commit()
+
+    def _check_backend(self):
+        """Record the backend in the persist, handling a change of backend.
+
+        The persist is shared by all backends, but its pending offset counts
+        messages of the backend which last used it.
+        """
+        previous = self._persist.get("backend")
+        self._persist.set("backend", self.backend)
+        if previous is not None and previous != self.backend:
+            self._switch_backend(previous)
+            # Don't switch again if we're stopped before the next commit.
+            if self._original_persist.filename is not None:
+                self.commit()
+
+    def _switch_backend(self, previous):
+        """Take over the messages of the C{previous} backend, if possible.
+
+        The messages of a database are migrated in order and with their
+        flags, so the pending offset still applies to them. Otherwise we
+        start afresh and the messages of the C{previous} backend are lost.
+        """
+        if self._database is not None and self._migrate_database():
+            return
+        logging.warning(
+            "Message store backend changed from %s to %s, the messages "
+            "queued with %s won't be sent.",
+            previous,
+            self.backend,
+            previous,
+        )
+        self.set_pending_offset(0)
+
+    def _migrate_database(self):
+        """Move the messages of a L{SQLiteMessageStore} database into files.
+
+        The messages are written to a hierarchy next to ours, which replaces
+        ours once complete, and the database is renamed aside meanwhile to
+        tell that it was migrated. An interrupted migration is resumed on
+        the next run, as the backend only switches once this returns.
+
+        @return: C{True} if the messages were migrated, C{False} if they
+            weren't because our hierarchy already holds some.
+        """
+        migrating = self._directory.rstrip(os.sep) + ".unmigrating"
+        migrated = self._database + ".migrated"
+        if os.path.exists(self._database):
+            if os.path.isdir(self._directory) and any(self._scan_messages()):
+                return False
+            if os.path.isdir(migrating):
+                shutil.rmtree(migrating)
+            os.makedirs(migrating, mode=DIRECTORY_MODE)
+            count = self._write_database_messages(migrating)
+            os.rename(self._database, migrated)
+            logging.info(
+                "Migrated %d messages from %s to %s.",
+                count,
+                self._database,
+                self._directory,
+            )
+        if os.path.isdir(migrating):
+            if os.path.isdir(self._directory):
+                shutil.rmtree(self._directory)
+            os.rename(migrating, self._directory)
+        if os.path.exists(migrated):
+            os.unlink(migrated)
+        return True
+
+    def _write_database_messages(self, directory):
+        """Write the messages of the database as files in C{directory}.
+
+        Their identifiers are saved in the persist, to be picked up when
+        the hierarchy is indexed.
+
+        @return: The number of messages written.
+        """
+        db = sqlite3.connect(self._database)
+        try:
+            cursor = db.cursor()
+            try:
+                cursor.execute(
+                    "SELECT id, flags, data FROM message ORDER BY position",
+                )
+                rows = cursor.fetchall()
+            except sqlite3.OperationalError:
+                # The database was created but never used.
+                rows = []
+            cursor.close()
+        finally:
+            db.close()
+        message_ids = []
+        for i, (message_id, flags, data) in enumerate(rows):
+            dirnum, filenum = divmod(i, self._directory_size)
+            if not filenum:
+                os.mkdir(os.path.join(directory, str(dirnum)), DIRECTORY_MODE)
+            basename = str(filenum)
+            if flags:
+                basename += "_" + flags
+            create_binary_file(
+                os.path.join(directory, str(dirnum), basename),
+                data,
+                mode=FILE_MODE,
+            )
+            message_ids.append((dirnum, filenum, message_id))
+        self._persist.set("message-ids", message_ids)
+        if message_ids:
+            self._persist.set(
+                "next-message-id",
+                max(
+                    self._persist.get("next-message-id", 1),
+                    max(message_id for _, _, message_id in message_ids) + 1,
+                ),
+            )
+        return len(rows)
 
     def set_accepted_types(self, types):
         """Specify the types of messages that the server will expect from us.
@@ -199,6 +529,8 @@ class MessageStore:
         @return: the sequence number of the message that we will ask the server
             to send to us on the next exchange.
         """
+        if self._journaled_server_sequence is not None:
+            return self._journaled_server_sequence
         return self._persist.get("server_sequence", 0)
 
     def set_server_sequence(self, number):
@@ -207,8 +539,36 @@ class MessageStore:
         Set the sequence number of the message that we will ask the server to
         send to us on the next exchange.
         """
+        self._journaled_server_sequence = None
         self._persist.set("server_sequence", number)
 
+    def journal_server_sequence(self, number):
+        """Set the current server sequence and record it in the journal.
+
+        This is a cheap alternative to calling L{commit} after every message
+        received from the server: only a line is appended to the journal,
+        and if we're stopped before the next L{commit} the server sequence
+        is recovered from it. The messages that were handled before are not
+        asked again to the server then, while the one being handled may be.
+
+        The persist is only left alone as long as it has no other unsaved
+        changes, otherwise the handled messages wouldn't be asked again
+        while their effects would be lost, so the store is committed then.
+        This is also the case if the persist has no file to save to.
+        """
+        journal_filename = self._get_journal_filename()
+        if journal_filename is None or self._original_persist.is_dirty():
+            self.set_server_sequence(number)
+            self.commit()
+            return
+        lines = []
+        if not os.path.exists(journal_filename):
+            lines.append(f"{self.get_server_sequence():d}\n")
+        lines.append(f"{number:d}\n")
+        with open(journal_filename, "a") as fd:
+            fd.writelines(lines)
+        self._journaled_server_sequence = number
+
     def get_server_uuid(self):
         """Return the currently set server UUID."""
         uuid = self._persist.get("server_uuid")
@@ -265,101 +625,200 @@ class MessageStore:
 
     def count_pending_messages(self):
         """Return the number of pending messages."""
-        return sum(1 for x in self._walk_pending_messages())
-
-    def get_pending_messages(self, max=None):
-        """Get any pending messages that aren't being held, up to max."""
+        return max(0, self._unflagged_count - self.get_pending_offset())
+
+    def get_pending_messages(self, max=None, max_bytes=None):
+        """Get any pending messages that aren't being held, up to max.
+
+        @param max: The maximum number of messages to return.
+        @param max_bytes: The maximum total serialized size of the returned
+            messages.  The first pending message is always returned, even
+            if it's bigger than that, so that it can't block the queue.
+            Messages are never stored bigger than their serialized data, so
+            their indexed size is checked first, and only the messages that
+            may still fit are read.
+        """
         accepted_types = self.get_accepted_types()
         server_api = self.get_server_api()
         messages = []
+        total_bytes = 0
         for filename in self._walk_pending_messages():
             if max is not None and len(messages) >= max:
                 break
+            if max_bytes is not None and messages:
+                size = self._metadata[self._get_key(filename)][0]
+                if total_bytes + size > max_bytes:
+                    break
             data = read_binary_file(self._message_dir(filename))
             try:
-                # don't reinterpret messages that are meant to be sent out
-                message = bpickle.loads(data, as_is=True)
+                data = decompress_message_data(data)
+                if max_bytes is not None and messages:
+                    if total_bytes + len(data) > max_bytes:
+                        break
+                message = self._load_message(data)
             except ValueError as e:
                 logging.exception(e)
                 self._add_flags(filename, BROKEN)
             else:
-                if "type" not in message:
-                    # Special case to decode keys for messages which were
-                    # serialized by py27 prior to py3 upgrade, and having
-                    # implicit byte message keys. Message may still get
-                    # rejected by the server, but it won't block the client
-                    # broker. (lp: #1718689)
-                    message = {
-                        (k if isinstance(k, str) else k.decode("ascii")): v
-                        for k, v in message.items()
-                    }
-                    message["type"] = message["type"].decode("ascii")
-
                 unknown_type = message["type"] not in accepted_types
                 unknown_api = not is_version_higher(server_api, message["api"])
                 if unknown_type or unknown_api:
                     self._add_flags(filename, HELD)
                 else:
                     messages.append(message)
+                    total_bytes += len(data)
         return messages
 
+    def _load_message(self, data):
+        """Decode the bpickled C{data} of a stored message.
+
+        @param data: The serialized message, already decompressed with
+            L{decompress_message_data}.
+        @raise ValueError: If C{data} is not a valid bpickle.
+        """
+        # don't reinterpret messages that are meant to be sent out
+        message = bpickle.loads(data, as_is=True)
+        if "type" not in message:
+            # Special case to decode keys for messages which were
+            # serialized by py27 prior to py3 upgrade, and having
+            # implicit byte message keys. Message may still get
+            # rejected by the server, but it won't block the client
+            # broker. (lp: #1718689)
+            message = {
+                (k if isinstance(k, str) else k.decode("ascii")): v
+                for k, v in message.items()
+            }
+            message["type"] = message["type"].decode("ascii")
+        return message
+
     def get_messages_total_size(self):
-        """Get total size of messages directory"""
-        sizes = []
-        for dirname in os.listdir(self._directory):
-            dirpath = os.path.join(self._directory, dirname)
-            dirsize = sum(file.stat().st_size for file in os.scandir(dirpath))
-            sizes.append(dirsize)
-        return sum(sizes)
+        """Get total size of the stored messages.
+
+        The size is accounted for as messages are added and deleted, so this
+        doesn't touch the file system.
+        """
+        return self._total_size
+
+    def get_pending_messages_size(self):
+        """Get the total size of the pending messages which aren't held.
+
+        Like L{get_messages_total_size}, this is the size the messages take
+        in the store, which is smaller than their serialized size if they
+        are compressed.
+        """
+        if self._get_pending_boundary() is None:
+            return 0
+        return self._unflagged_size - self._pending_boundary[2]
 
     def delete_messages_over_limit(self):
         """
         Delete messages dirs if there's any over the max, which happens if
         messages are queued up but not able to be sent
         """
-
-        cur_dirs = os.listdir(self._directory)
-        cur_dirs.sort(key=int)  # Since you could have 0, .., 9, 10
+        cur_dirs = sorted(self._dir_counts)
         num_dirs = len(cur_dirs)
 
         num_dirs_to_delete = max(0, num_dirs - self._max_dirs)  # No negatives
         dirs_to_delete = cur_dirs[:num_dirs_to_delete]  # Chop off beginning
 
-        for dirname in dirs_to_delete:
-            dirpath = os.path.join(self._directory, dirname)
-            try:
-                logging.debug(f"Trimming message store: {dirpath}")
-                shutil.rmtree(dirpath)
-            except Exception:  # We want to continue like normal if any error
-                logging.warning(traceback.format_exc())
-                logging.warning("Unable to delete message directory!")
-                logging.warning(dirpath)
+        for dirnum in dirs_to_delete:
+            self._delete_directory(dirnum)
 
         # Something is wrong if after deleting a bunch of files, we are still
-        # using too much space. Rather then look around for big files, we just
-        # start over.
-        num_bytes = self.get_messages_total_size()
-        num_mb = num_bytes / 1e6
-        if num_mb > self._max_size_mb:
-            logging.warning("Messages too large! Clearing all messages!")
-            self.delete_all_messages()
+        # using too much space, so evict whole directories, starting from the
+        # ones we don't need anymore, until we fit the limit again.
+        if self._total_size / 1e6 > self._max_size_mb:
+            logging.warning("Messages too large! Evicting oldest messages!")
+            self._evict_messages()
+
+    def _evict_messages(self):
+        """Delete message directories until the store fits C{max_size_mb}.
+
+        Directories holding only already delivered or broken messages go
+        first, then the oldest directories whatever they hold.
+        """
+        max_bytes = self._max_size_mb * 1e6
+        delivered_dirs = self._get_delivered_directories()
+        other_dirs = sorted(set(self._dir_counts) - set(delivered_dirs))
+        for dirnum in delivered_dirs + other_dirs:
+            if self._total_size <= max_bytes:
+                break
+            self._delete_directory(dirnum)
+
+    def _get_delivered_directories(self):
+        """Return the directories with no pending messages, oldest first."""
+        pending_offset = self.get_pending_offset()
+        pending_dirs = set()
+        offset = 0
+        for (dirnum, filenum), flags in self._index.items():
+            if not flags:
+                if offset >= pending_offset:
+                    pending_dirs.add(dirnum)
+                offset += 1
+            elif BROKEN not in flags:
+                pending_dirs.add(dirnum)
+        return sorted(set(self._dir_counts) - pending_dirs)
+
+    def _delete_directory(self, dirnum):
+        """Delete a message directory and all the messages it holds."""
+        dirpath = self._message_dir(str(dirnum))
+        try:
+            logging.debug(f"Trimming message store: {dirpath}")
+            shutil.rmtree(dirpath)
+        except Exception:  # We want to continue like normal if any error
+            logging.warning(traceback.format_exc())
+            logging.warning("Unable to delete message directory!")
+            logging.warning(dirpath)
+        else:
+            self._unindex_directory(dirnum)
+
+    def _unindex_directory(self, dirnum):
+        """Drop from the index all messages of a deleted directory.
+
+        The non-held messages of a deleted directory are either the oldest
+        ones or already delivered ones, so the pending offset is moved back
+        by their number to keep pointing to the same next message, if it's
+        still around.
+        """
+        keys = [key for key in self._index if key[0] == dirnum]
+        unflagged = 0
+        for key in keys:
+            size, message_id = self._metadata.pop(key)
+            del self._keys[message_id]
+            if not self._index.pop(key):
+                unflagged += 1
+                self._unflagged_size -= size
+        self._pending_boundary = None
+        self._unflagged_count -= unflagged
+        self._total_size -= self._dir_sizes.pop(dirnum)
+        del self._dir_counts[dirnum]
+        if unflagged:
+            pending_offset = self.get_pending_offset()
+            self.set_pending_offset(pending_offset - min(unflagged, pending_offset))
 
     def delete_old_messages(self):
         """Delete messages which are unlikely to be needed in the future."""
-        for fn in itertools.islice(
-            self._walk_messages(exclude=HELD + BROKEN),
-            self.get_pending_offset(),
-        ):
+        filenames = list(
+            itertools.islice(
+                self._walk_messages(exclude=HELD + BROKEN),
+                self.get_pending_offset(),
+            ),
+        )
+        for fn in filenames:
             os.unlink(fn)
-            containing_dir = os.path.split(fn)[0]
-            if not os.listdir(containing_dir):
-                os.rmdir(containing_dir)
+            self._index_remove(fn)
+            dirnum = self._get_key(fn)[0]
+            if not self._dir_counts[dirnum]:
+                os.rmdir(os.path.split(fn)[0])
+                del self._dir_counts[dirnum]
+                del self._dir_sizes[dirnum]
 
     def delete_all_messages(self):
         """Remove ALL stored messages."""
         self.set_pending_offset(0)
-        for filename in self._walk_messages():
+        for filename in list(self._walk_messages()):
             os.unlink(filename)
+            self._index_remove(filename)
 
     def add_schema(self, schema):
         """Add a schema to be applied to messages of the given type.
@@ -376,17 +835,49 @@ class MessageStore:
 
         @param message_id: Identifier returned by the L{add()} method.
         """
-        i = 0
+        key = self._keys.get(message_id)
+        if key is None:
+            return False
+        flags = self._index[key]
+        if BROKEN in flags:
+            return False
+        if HELD in flags:
+            return True
+        boundary = self._get_pending_boundary()
+        return boundary is not None and key >= boundary
+
+    def are_pending(self, message_ids):
+        """Return a list of bools telling which of C{message_ids} are pending.
+
+        @param message_ids: A sequence of identifiers returned by L{add()}.
+        """
+        return [self.is_pending(message_id) for message_id in message_ids]
+
+    def _get_pending_boundary(self):
+        """Return the key of the first pending message, or C{None}.
+
+        Messages are walked in key order, so a message which is neither held
+        nor broken is pending if its key is not lower than this one. The
+        result is cached until it may be moved by a change to the index, see
+        L{_invalidate_pending_boundary}, or the pending offset changes,
+        along with the size of the delivered messages before it.
+        """
         pending_offset = self.get_pending_offset()
-        for filename in self._walk_messages(exclude=BROKEN):
-            flags = self._get_flags(filename)
-            if (HELD in flags or i >= pending_offset) and os.stat(
-                filename,
-            ).st_ino == message_id:
-                return True
-            if BROKEN not in flags and HELD not in flags:
-                i += 1
-        return False
+        if self._pending_boundary is None or (
+            self._pending_boundary[0] != pending_offset
+        ):
+            boundary = None
+            offset = 0
+            delivered_size = 0
+            for key, flags in self._index.items():
+                if not flags:
+                    if offset == pending_offset:
+                        boundary = key
+                        break
+                    offset += 1
+                    delivered_size += self._metadata[key][0]
+            self._pending_boundary = (pending_offset, boundary, delivered_size)
+        return self._pending_boundary[1]
 
     def record_success(self, timestamp):
         """Record a successful exchange."""
@@ -431,6 +922,71 @@ class MessageStore:
 
         self.delete_messages_over_limit()
 
+        message = self._coerce_message(message)
+        message_data = self._dump_message(message)
+        return self._store_message(message, message_data)
+
+    def add_many(self, messages):
+        """Queue several messages for delivery at once.
+
+        This is equivalent to calling L{add} for each message, except that
+        the size limits are only enforced once and the whole batch is
+        written in one go.  A message failing its schema is logged and
+        dropped, without affecting the other messages of the batch.
+
+        @param messages: A sequence of C{dict}s, as accepted by L{add}.
+
+        @return: A C{list} with the identifier of each added message, in
+            the same order as C{messages}, or C{None} for the messages which
+            were rejected.
+        """
+        for message in messages:
+            assert "type" in message
+        if self._persist.get("blackhole-messages"):
+            logging.debug(f"Dropped {len(messages)} messages, awaiting resync.")
+            return [None] * len(messages)
+        if not messages:
+            return []
+
+        self.delete_messages_over_limit()
+
+        batch = []
+        valid = []
+        for message in messages:
+            try:
+                message = self._coerce_message(message)
+            except InvalidError as error:
+                logging.warning(f"Dropped invalid {message['type']} message: {error}")
+                valid.append(False)
+            else:
+                batch.append((message, self._dump_message(message)))
+                valid.append(True)
+        message_ids = iter(self._store_messages(batch) if batch else [])
+        return [next(message_ids) if ok else None for ok in valid]
+
+    def _dump_message(self, message):
+        """Serialize C{message}, compressing it if compression is enabled."""
+        message_data = bpickle.dumps(message)
+        if not self._compress:
+            return message_data
+        stored_data = compress_message_data(message_data)
+        self._raw_size_added += len(message_data)
+        self._stored_size_added += len(stored_data)
+        return stored_data
+
+    def get_compression_ratio(self):
+        """Get the compression ratio achieved on the messages added so far.
+
+        @return: The ratio between the serialized and the stored size of the
+            messages added since the store was created, or C{None} if
+            compression is disabled or no message was added yet.
+        """
+        if not self._stored_size_added:
+            return None
+        return self._raw_size_added / self._stored_size_added
+
+    def _coerce_message(self, message):
+        """Tag C{message} with the current server API and apply its schema."""
         server_api = self.get_server_api()
 
         if "api" not in message:
@@ -443,46 +999,60 @@ class MessageStore:
             if is_version_higher(server_api, api):
                 schema = schemas[api]
                 break
-        message = schema.coerce(message)
+        return schema.coerce(message)
 
-        message_data = bpickle.dumps(message)
+    def _store_messages(self, batch):
+        """Store a list of C{(message, message_data)} pairs.
 
+        @return: The identifiers of the stored messages.
+        """
+        return [
+            self._store_message(message, message_data)
+            for message, message_data in batch
+        ]
+
+    def _store_message(self, message, message_data):
+        """Write the already serialized C{message} to the file system.
+
+        @return: The identifier of the stored message.
+        """
         filename = self._get_next_message_filename()
         temp_path = filename + ".tmp"
         create_binary_file(temp_path, message_data, mode=FILE_MODE)
         os.rename(temp_path, filename)
 
+        # The identifier follows the message when it's held and unheld.
+        message_id = self._new_message_id()
+        self._index_add(filename, len(message_data), message_id)
+
         if not self.accepts(message["type"]):
             filename = self._set_flags(filename, HELD)
 
-        # For now we use the inode as the message id, as it will work
-        # correctly even faced with holding/unholding.  It will break
-        # if the store is copied over for some reason, but this shouldn't
-        # present an issue given the current uses.  In the future we
-        # should have a nice transactional storage (e.g. sqlite) which
-        # will offer a more strong primary key.
-        message_id = os.stat(filename).st_ino
-
         return message_id
 
     def _get_next_message_filename(self):
-        message_dirs = self._get_sorted_filenames()
-        if message_dirs:
-            newest_dir = message_dirs[-1]
+        if self._dir_counts:
+            newest_dir = max(self._dir_counts)
         else:
             os.makedirs(self._message_dir("0"), mode=DIRECTORY_MODE)
-            newest_dir = "0"
-
-        message_filenames = self._get_sorted_filenames(newest_dir)
-        if not message_filenames:
-            filename = self._message_dir(newest_dir, "0")
-        elif len(message_filenames) < self._directory_size:
-            filename = str(int(message_filenames[-1].split("_")[0]) + 1)
-            filename = self._message_dir(newest_dir, filename)
+            self._dir_counts[0] = 0
+            self._dir_sizes[0] = 0
+            newest_dir = 0
+
+        count = self._dir_counts[newest_dir]
+        if not count:
+            filename = self._message_dir(str(newest_dir), "0")
+        elif count < self._directory_size:
+            # Messages are always appended, so the last indexed message is
+            # the newest one of the newest directory.
+            last_key = next(reversed(self._index))
+            filename = self._message_dir(str(newest_dir), str(last_key[1] + 1))
         else:
-            newest_dir = self._message_dir(str(int(newest_dir) + 1))
-            os.makedirs(newest_dir, mode=DIRECTORY_MODE)
-            filename = os.path.join(newest_dir, "0")
+            newest_dir += 1
+            os.makedirs(self._message_dir(str(newest_dir)), mode=DIRECTORY_MODE)
+            self._dir_counts[newest_dir] = 0
+            self._dir_sizes[newest_dir] = 0
+            filename = self._message_dir(str(newest_dir), "0")
 
         return filename
 
@@ -498,16 +1068,25 @@ class MessageStore:
     def _walk_messages(self, exclude=None):
         if exclude:
             exclude = set(exclude)
+        for (dirnum, filenum), flags in self._index.items():
+            if not exclude or not exclude & set(flags):
+                basename = str(filenum)
+                if flags:
+                    basename += "_" + flags
+                yield self._message_dir(str(dirnum), basename)
+
+    def _scan_messages(self):
+        """Walk the files in the file system hierarchy, in order."""
         message_dirs = self._get_sorted_filenames()
         for message_dir in message_dirs:
             for filename in self._get_sorted_filenames(message_dir):
-                flags = set(self._get_flags(filename))
-                if not exclude or not exclude & flags:
-                    yield self._message_dir(message_dir, filename)
+                yield self._message_dir(message_dir, filename)
 
     def _get_sorted_filenames(self, dir=""):
         message_files = [
-            x for x in os.listdir(self._message_dir(dir)) if not x.endswith(".tmp")
+            x
+            for x in os.listdir(self._message_dir(dir))
+            if x.split("_")[0].isdigit() and not x.endswith(".tmp")
         ]
         message_files.sort(key=lambda x: int(x.split("_")[0]))
         return message_files
@@ -523,10 +1102,12 @@ class MessageStore:
         offset = 0
         pending_offset = self.get_pending_offset()
         accepted_types = self.get_accepted_types()
-        for old_filename in self._walk_messages():
+        for old_filename in list(self._walk_messages()):
             flags = self._get_flags(old_filename)
             try:
-                message = bpickle.loads(read_binary_file(old_filename))
+                message = bpickle.loads(
+                    decompress_message_data(read_binary_file(old_filename)),
+                )
             except ValueError as e:
                 logging.exception(e)
                 if HELD not in flags:
@@ -537,6 +1118,8 @@ class MessageStore:
                     if accepted:
                         new_filename = self._get_next_message_filename()
                         os.rename(old_filename, new_filename)
+                        size, message_id = self._index_remove(old_filename)
+                        self._index_add(new_filename, size, message_id)
                         self._set_flags(new_filename, set(flags) - set(HELD))
                 else:
                     if not accepted and offset >= pending_offset:
@@ -555,6 +1138,14 @@ class MessageStore:
         if flags:
             new_path += "_" + "".join(sorted(set(flags)))
         os.rename(path, new_path)
+        key = self._get_key(path)
+        old_flags = self._index[key]
+        new_flags = self._get_flags(new_path)
+        self._index[key] = new_flags
+        self._invalidate_pending_boundary(key)
+        unflagged = (not new_flags) - (not old_flags)
+        self._unflagged_count += unflagged
+        self._unflagged_size += unflagged * self._metadata[key][0]
         return new_path
 
     def _add_flags(self, path, flags):
@@ -604,13 +1195,591 @@ class MessageStore:
         self._persist.set("session-ids", new_session_ids)
 
 
-def get_default_message_store(*args, **kwargs):
+class SQLiteMessageStore(MessageStore):
+    """A message store which keeps its messages in a SQLite database.
+
+    Each message is a row of the C{message} table, whose schema is defined
+    in L{ensure_message_schema}. Beside the serialized message, every row
+    records the message type and API, the HELD/BROKEN flags and the
+    position of the message in the queue, so that walking, counting and
+    flagging messages are indexed queries instead of directory scans.
+
+    The C{id} of a row is never reused and it's the message identifier
+    returned by L{add}. Unholding a message moves it to the end of the queue
+    by giving it a new position, but it keeps its identifier.
+
+    @param persist: a L{Persist} used to save state parameters like the
+        accepted message types, sequence, server uuid etc.
+    @param filename: The name of the file that contains the sqlite database.
+    @param directory: Optionally, the base of a L{MessageStore} file system
+        hierarchy. Any message found there is moved into the database,
+        preserving its order and flags, and the files are removed.
+    @param max_messages: The maximum number of messages to keep, the oldest
+        ones are dropped when the limit is exceeded.
+    @param max_size_mb: The maximum size of the stored messages.
+    @param compress: Whether to compress new messages.
+    """
+
+    _db = None
+    # The total size of the pending messages, or None if unknown, and the
+    # number of new messages that won't be pending as the pending offset is
+    # past the last message.
+    _pending_size = None
+    _pending_skip = 0
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        persist,
+        filename,
+        directory=None,
+        max_messages=4000,
+        max_size_mb=400,
+        compress=False,
+    ):
+        self._filename = filename
+        self._max_messages = max_messages
+        self._max_size_mb = max_size_mb
+        self._compress = compress
+        self._raw_size_added = 0
+        self._stored_size_added = 0
+        self._schemas = {}
+        self._original_persist = persist
+        self._persist = persist.root_at("message-store")
+        self._replay_journal()
+        touch_file(self._filename, mode=FILE_MODE)
+        self._check_backend()
+        if directory is not None:
+            self._migrate_directory(directory)
+        self._total_size, self._message_count = self._sum_messages()
+
+    def _ensure_schema(self):
+        ensure_message_schema(self._db)
+
+    def _switch_backend(self, previous):
+        """Drop the messages left from an earlier use of this backend.
+
+        The pending offset counts the messages of the directory backend,
+        which are migrated into the then empty database.
+        """
+        dropped = self._drop_all_rows()
+        if dropped:
+            logging.warning(
+                "Message store backend changed from %s to %s, dropped %d "
+                "messages left in %s.",
+                previous,
+                self.backend,
+                dropped,
+                self._filename,
+            )
+
+    @with_cursor
+    def _drop_all_rows(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM message")
+        count = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM message")
+        cursor.execute("DELETE FROM migration")
+        return count
+
+    def _migrate_directory(self, directory):
+        """Move the messages of a L{MessageStore} hierarchy into the database.
+
+        The hierarchy is first renamed aside, then its messages are appended
+        to the queue in a single transaction which also records that the
+        renamed hierarchy was migrated, and finally it's removed. An
+        interrupted migration is resumed on the next run: the messages are
+        inserted again only if the transaction didn't commit.
+        """
+        migrating = directory.rstrip(os.sep) + ".migrating"
+        if not os.path.isdir(migrating):
+            self._forget_migration()
+            self._directory = directory
+            if not os.path.isdir(directory) or not any(self._scan_messages()):
+                return
+            os.rename(directory, migrating)
+        self._directory = migrating
+        filenames = list(self._scan_messages())
+        if not self._is_migrated():
+            self._insert_legacy_messages(filenames)
+            logging.info(
+                "Migrated %d messages from %s to %s.",
+                len(filenames),
+                directory,
+                self._filename,
+            )
+        shutil.rmtree(migrating)
+        self._forget_migration()
+
+    @with_cursor
+    def _is_migrated(self, cursor):
+        cursor.execute("SELECT COUNT(*) FROM migration")
+        return cursor.fetchone()[0] > 0
+
+    @with_cursor
+    def _forget_migration(self, cursor):
+        cursor.execute("DELETE FROM migration")
+
+    @with_cursor
+    def _insert_legacy_messages(self, cursor, filenames):
+        cursor.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM message")
+        start = cursor.fetchone()[0]
+        for position, filename in enumerate(filenames, start):
+            flags = self._get_flags(filename)
+            data = read_binary_file(filename)
+            message_type, api = "", None
+            try:
+                message = self._load_message(decompress_message_data(data))
+            except ValueError as e:
+                logging.exception(e)
+                flags += BROKEN
+            else:
+                message_type, api = message["type"], message.get("api")
+            cursor.execute(
+                "INSERT INTO message (position, type, api, flags, size, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    position,
+                    message_type,
+                    api,
+                    "".join(sorted(set(flags))),
+                    len(data),
+                    data,
+                ),
+            )
+        cursor.execute("INSERT INTO migration DEFAULT VALUES")
+
+    def count_pending_messages(self):
+        """Return the number of pending messages."""
+        count = self._count_messages(flags="")
+        return max(0, count - self.get_pending_offset())
+
+    @with_cursor
+    def _count_messages(self, cursor, flags):
+        cursor.execute("SELECT COUNT(*) FROM message WHERE flags=?", (flags,))
+        return cursor.fetchone()[0]
+
+    def get_pending_messages(self, max=None, max_bytes=None):
+        """Get any pending messages that aren't being held, up to max.
+
+        @param max: The maximum number of messages to return.
+        @param max_bytes: The maximum total serialized size of the returned
+            messages, see L{MessageStore.get_pending_messages}.
+        """
+        accepted_types = self.get_accepted_types()
+        server_api = self.get_server_api()
+        messages = []
+        flagged = []
+        flagged_size = 0
+        total_bytes = 0
+        for id, size, data in self._iter_pending_rows():
+            if max is not None and len(messages) >= max:
+                break
+            if max_bytes is not None and messages:
+                if total_bytes + size > max_bytes:
+                    break
+            try:
+                data = decompress_message_data(data)
+                if max_bytes is not None and messages:
+                    if total_bytes + len(data) > max_bytes:
+                        break
+                message = self._load_message(data)
+            except ValueError as e:
+                logging.exception(e)
+                flagged.append((BROKEN, id))
+                flagged_size += size
+            else:
+                unknown_type = message["type"] not in accepted_types
+                unknown_api = not is_version_higher(server_api, message["api"])
+                if unknown_type or unknown_api:
+                    flagged.append((HELD, id))
+                    flagged_size += size
+                else:
+                    messages.append(message)
+                    total_bytes += len(data)
+        if flagged:
+            self._set_row_flags(flagged)
+            if self._pending_size is not None:
+                self._pending_size -= flagged_size
+        return messages
+
+    def _iter_pending_rows(self, batch_size=100):
+        """Yield C{(id, size, data)} for the messages past the pending offset."""
+        offset = self.get_pending_offset()
+        while True:
+            rows = self._get_rows(offset, batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            offset += batch_size
+
+    @with_cursor
+    def _get_rows(self, cursor, offset, limit):
+        cursor.execute(
+            "SELECT id, size, data FROM message WHERE flags='' "
+            "ORDER BY position LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return cursor.fetchall()
+
+    @with_cursor
+    def _set_row_flags(self, cursor, flagged):
+        cursor.executemany("UPDATE message SET flags=? WHERE id=?", flagged)
+
+    @with_cursor
+    def _sum_messages(self, cursor):
+        """Return the total size and the number of the stored messages."""
+        cursor.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM message")
+        return cursor.fetchone()
+
+    def get_messages_total_size(self):
+        """Get total size of the stored messages."""
+        return self._total_size
+
+    def set_pending_offset(self, val):
+        """Set the current pending offset, see L{MessageStore}."""
+        super().set_pending_offset(val)
+        self._pending_size = None
+
+    def get_pending_messages_size(self):
+        """Get the total size of the pending messages which aren't held.
+
+        It's only summed up again after the pending offset changed or
+        messages were held or deleted, new messages are just added to it.
+        """
+        if self._pending_size is None:
+            self._pending_size, self._pending_skip = self._sum_pending_sizes()
+        return self._pending_size
+
+    @with_cursor
+    def _sum_pending_sizes(self, cursor):
+        """
+        Return the total size of the pending messages and the number of
+        messages missing for the pending offset to point to one.
+        """
+        pending_offset = self.get_pending_offset()
+        cursor.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT size FROM message "
+            "WHERE flags='' ORDER BY position LIMIT -1 OFFSET ?)",
+            (pending_offset,),
+        )
+        size = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM message WHERE flags=''")
+        return size, max(0, pending_offset - cursor.fetchone()[0])
+
+    def delete_messages_over_limit(self):
+        """
+        Delete the oldest messages if there are more than C{max_messages},
+        which happens if messages are queued up but not able to be sent.
+        """
+        self._delete_oldest_messages(self._max_messages)
+
+        # As for the file system store, if we're still using too much space
+        # we evict messages, starting from the ones we don't need anymore.
+        if self._total_size / 1e6 > self._max_size_mb:
+            logging.warning("Messages too large! Evicting oldest messages!")
+            self._evict_messages()
+
+    @with_cursor
+    def _delete_oldest_messages(self, cursor, keep):
+        # The messages are counted as they're added and deleted, so there's
+        # no need to query the database until there are too many of them.
+        if self._message_count <= keep:
+            return
+        cursor.execute(
+            "SELECT position FROM message ORDER BY position DESC LIMIT 1 OFFSET ?",
+            (keep,),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute(
+                "SELECT id, flags, size FROM message WHERE position<=?",
+                row,
+            )
+            self._delete_rows(cursor, cursor.fetchall())
+            logging.debug("Trimmed messages from the store.")
+
+    @with_cursor
+    def _evict_messages(self, cursor):
+        """Delete messages until the store fits C{max_size_mb}.
+
+        Already delivered and broken messages go first, then the oldest
+        messages whatever they are.
+        """
+        max_bytes = self._max_size_mb * 1e6
+        pending_offset = self.get_pending_offset()
+        cursor.execute("SELECT id, flags, size FROM message ORDER BY position")
+        delivered = []
+        others = []
+        offset = 0
+        for row in cursor.fetchall():
+            flags = row[1]
+            if not flags:
+                if offset < pending_offset:
+                    delivered.append(row)
+                else:
+                    others.append(row)
+                offset += 1
+            elif BROKEN in flags:
+                delivered.append(row)
+            else:
+                others.append(row)
+        excess = self._total_size - max_bytes
+        evicted = []
+        for row in delivered + others:
+            if excess <= 0:
+                break
+            evicted.append(row)
+            excess -= row[2]
+        self._delete_rows(cursor, evicted)
+
+    def _delete_rows(self, cursor, rows):
+        """Delete the given C{(id, flags, size)} rows.
+
+        The non-held messages being deleted are either the oldest ones or
+        already delivered ones, so the pending offset is moved back by their
+        number to keep pointing to the same next message.
+        """
+        cursor.executemany(
+            "DELETE FROM message WHERE id=?",
+            [(id,) for id, flags, size in rows],
+        )
+        self._total_size -= sum(size for id, flags, size in rows)
+        self._message_count -= len(rows)
+        unflagged = sum(1 for id, flags, size in rows if not flags)
+        if unflagged:
+            pending_offset = self.get_pending_offset()
+            self.set_pending_offset(pending_offset - min(unflagged, pending_offset))
+        self._pending_size = None
+
+    @with_cursor
+    def delete_old_messages(self, cursor):
+        """Delete messages which are unlikely to be needed in the future."""
+        cursor.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM message WHERE id IN "
+            "(SELECT id FROM message WHERE flags='' "
+            " ORDER BY position LIMIT ?)",
+            (self.get_pending_offset(),),
+        )
+        self._total_size -= cursor.fetchone()[0]
+        cursor.execute(
+            "DELETE FROM message WHERE id IN "
+            "(SELECT id FROM message WHERE flags='' "
+            " ORDER BY position LIMIT ?)",
+            (self.get_pending_offset(),),
+        )
+        self._message_count -= cursor.rowcount
+        self._pending_size = None
+
+    def delete_all_messages(self):
+        """Remove ALL stored messages."""
+        self.set_pending_offset(0)
+        self._delete_all_rows()
+        self._total_size = 0
+        self._message_count = 0
+        self._pending_size = 0
+        self._pending_skip = 0
+
+    @with_cursor
+    def _delete_all_rows(self, cursor):
+        cursor.execute("DELETE FROM message")
+
+    def is_pending(self, message_id):
+        """Return bool indicating if C{message_id} still hasn't been delivered.
+
+        @param message_id: Identifier returned by the L{add()} method.
+        """
+        return self.are_pending([message_id])[0]
+
+    @with_cursor
+    def are_pending(self, cursor, message_ids):
+        """Return a list of bools telling which of C{message_ids} are pending.
+
+        The position of the first pending message is looked up once, then a
+        message which is neither held nor broken is pending if its position
+        is not lower than that.
+
+        @param message_ids: A sequence of identifiers returned by L{add()}.
+        """
+        cursor.execute(
+            "SELECT position FROM message WHERE flags='' "
+            "ORDER BY position LIMIT 1 OFFSET ?",
+            (self.get_pending_offset(),),
+        )
+        row = cursor.fetchone()
+        boundary = row[0] if row is not None else None
+        rows = {}
+        message_ids = list(message_ids)
+        # Stay well below SQLite's limit on the number of host parameters.
+        for i in range(0, len(message_ids), 500):
+            chunk = message_ids[i : i + 500]
+            cursor.execute(
+                "SELECT id, position, flags FROM message WHERE id IN "
+                f"({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for id, position, flags in cursor.fetchall():
+                rows[id] = (position, flags)
+        pending = []
+        for message_id in message_ids:
+            if message_id not in rows:
+                pending.append(False)
+                continue
+            position, flags = rows[message_id]
+            if BROKEN in flags:
+                pending.append(False)
+            elif HELD in flags:
+                pending.append(True)
+            else:
+                pending.append(boundary is not None and position >= boundary)
+        return pending
+
+    def _store_message(self, message, message_data):
+        return self._store_messages([(message, message_data)])[0]
+
+    @with_cursor
+    def _store_messages(self, cursor, batch):
+        """Insert all the messages in C{batch} in a single transaction."""
+        accepted_types = self.get_accepted_types()
+        message_ids = []
+        total_size = 0
+        pending_size = 0
+        for message, message_data in batch:
+            flags = "" if message["type"] in accepted_types else HELD
+            if not flags:
+                if self._pending_skip:
+                    self._pending_skip -= 1
+                else:
+                    pending_size += len(message_data)
+            cursor.execute(
+                "INSERT INTO message (position, type, api, flags, size, data) "
+                "VALUES ((SELECT COALESCE(MAX(position), -1) + 1 "
+                "FROM message), ?, ?, ?, ?, ?)",
+                (
+                    message["type"],
+                    message["api"],
+                    flags,
+                    len(message_data),
+                    message_data,
+                ),
+            )
+            message_ids.append(cursor.lastrowid)
+            total_size += len(message_data)
+        self._total_size += total_size
+        self._message_count += len(message_ids)
+        if self._pending_size is not None:
+            # New messages come last, so they're pending unless held.
+            self._pending_size += pending_size
+        return message_ids
+
+    @with_cursor
+    def _reprocess_holding(self, cursor):
+        """
+        Unhold accepted messages left behind, and hold unaccepted
+        pending messages.
+        """
+        self._pending_size = None
+        offset = 0
+        pending_offset = self.get_pending_offset()
+        accepted_types = self.get_accepted_types()
+        cursor.execute(
+            "SELECT id, type, flags FROM message "
+            "WHERE flags NOT LIKE '%b%' ORDER BY position",
+        )
+        for id, message_type, flags in cursor.fetchall():
+            accepted = message_type in accepted_types
+            if HELD in flags:
+                if accepted:
+                    cursor.execute(
+                        "UPDATE message SET flags=?, position="
+                        "(SELECT MAX(position) + 1 FROM message) WHERE id=?",
+                        (flags.replace(HELD, ""), id),
+                    )
+            else:
+                if not accepted and offset >= pending_offset:
+                    cursor.execute(
+                        "UPDATE message SET flags=? WHERE id=?",
+                        (flags + HELD, id),
+                    )
+                offset += 1
+
+
+def ensure_message_schema(db):
+    """Create all tables needed by a L{SQLiteMessageStore}.
+
+    @param db: A connection to a SQLite database.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            "CREATE TABLE message"
+            " (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "  position INTEGER NOT NULL, type TEXT NOT NULL, api BLOB,"
+            "  flags TEXT NOT NULL DEFAULT '', size INTEGER NOT NULL,"
+            "  data BLOB NOT NULL)",
+        )
+        cursor.execute(
+            "CREATE INDEX message_position_idx ON message(position)",
+        )
+        cursor.execute(
+            "CREATE INDEX message_flags_position_idx ON message(flags, position)",
+        )
+    except (sqlite3.OperationalError, sqlite3.DatabaseError):
+        cursor.close()
+        db.rollback()
+    else:
+        cursor.close()
+        db.commit()
+    # The migration table was added after the message one, so it's created
+    # on its own for databases which already have the latter.
+    cursor = db.cursor()
+    try:
+        cursor.execute("CREATE TABLE migration (id INTEGER PRIMARY KEY)")
+    except (sqlite3.OperationalError, sqlite3.DatabaseError):
+        cursor.close()
+        db.rollback()
+    else:
+        cursor.close()
+        db.commit()
+
+
+def compress_message_data(data):
+    """Compress the serialized message C{data}.
+
+    @return: The compressed data, prefixed with the L{COMPRESSED} header, or
+        C{data} itself if compressing it wouldn't make it any smaller.
+    """
+    compressed = COMPRESSED + zlib.compress(data)
+    if len(compressed) < len(data):
+        return compressed
+    return data
+
+
+def decompress_message_data(data):
+    """Reverse L{compress_message_data}.
+
+    Data without the L{COMPRESSED} header is returned unchanged.
+
+    @raise ValueError: If the compressed C{data} is corrupted.
+    """
+    if data[:1] != COMPRESSED:
+        return data
+    try:
+        return zlib.decompress(data[1:])
+    except zlib.error as e:
+        raise ValueError(f"Can't decompress message: {e}")
+
+
+def get_default_message_store(*args, store_class=MessageStore, **kwargs):
     """
     Get a L{MessageStore} object with all Landscape message schemas added.
+
+    @param store_class: The L{MessageStore} implementation to instantiate,
+        all other arguments are passed to it.
     """
     from landscape.message_schemas.server_bound import message_schemas
 
-    store = MessageStore(*args, **kwargs)
+    store = store_class(*args, **kwargs)
     for schema in message_schemas:
         store.add_schema(schema)
     return store
@@ -17,6 +17,13 @@ class RemoteBrokerTest(LandscapeTest):
         result = self.remote.ping()
         return self.assertSuccess(result, True)
 
+    def test_batch_calls(self):
+        """
+        The calls made to the L{RemoteBroker} are sent in L{MethodCallBatch}
+        commands.
+        """
+        self.assertTrue(self.remote._factory.batchCalls)
+
     def test_register_client(self):
         """
         The L{RemoteBroker.register_client} method forwards a registration
@@ -59,6 +66,21 @@ class RemoteBrokerTest(LandscapeTest):
         self.assertTrue(isinstance(message_id, int))
         self.assertTrue(self.exchanger.is_urgent())
 
+    def test_send_messages(self):
+        """
+        The L{RemoteBroker.send_messages} method calls the C{send_messages}
+        method of the remote L{BrokerServer} instance and returns its result
+        with a L{Deferred}.
+        """
+        messages = [{"type": "test"}, {"type": "test"}]
+        self.mstore.set_accepted_types(["test"])
+        session_id = self.successResultOf(self.remote.get_session_id())
+        message_ids = self.successResultOf(
+            self.remote.send_messages(messages, session_id),
+        )
+        self.assertEqual([True, True], self.mstore.are_pending(message_ids))
+        self.assertMessages(self.mstore.get_pending_messages(), messages)
+
     def test_is_message_pending(self):
         """
         The L{RemoteBroker.is_message_pending} method calls the
@@ -68,6 +90,15 @@ class RemoteBrokerTest(LandscapeTest):
         result = self.remote.is_message_pending(1234)
         return self.assertSuccess(result, False)
 
+    def test_are_messages_pending(self):
+        """
+        The L{RemoteBroker.are_messages_pending} method calls the
+        C{are_messages_pending} method of the remote L{BrokerServer} instance
+        and returns its result with a L{Deferred}.
+        """
+        result = self.remote.are_messages_pending([1234, 5678])
+        return self.assertSuccess(result, [False, False])
+
     def test_stop_clients(self):
         """
         The L{RemoteBroker.stop_clients} method calls the C{stop_clients}
@@ -3,7 +3,11 @@ from unittest import mock
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 
-from landscape.client.broker.client import BrokerClientPlugin, HandlerNotFoundError
+from landscape.client.broker.client import (
+    BrokerClientPlugin,
+    HandlerNotFoundError,
+    LazyPlugin,
+)
 from landscape.client.broker.tests.helpers import BrokerClientHelper
 from landscape.client.tests.helpers import DEFAULT_ACCEPTED_TYPES, LandscapeTest
 from landscape.lib.twisted_util import gather_results
@@ -442,3 +446,53 @@ class BrokerClientTest(LandscapeTest):
         self.client.exit()
         self.client.reactor.advance(0.1)
         self.client.reactor.stop.assert_called_once_with()
+
+
+class LazyPluginTest(LandscapeTest):
+    helpers = [BrokerClientHelper]
+
+    def setUp(self):
+        super().setUp()
+        self.plugin = LazyPlugin(
+            "landscape.client.broker.client.BrokerClientPlugin",
+            "test",
+        )
+
+    def test_load_if_accepted(self):
+        """
+        If the message type of the plugin is already accepted, the plugin is
+        loaded and added to the client when registered.
+        """
+        self.mstore.set_accepted_types(["test"])
+        self.client.add(self.plugin)
+        self.assertIsInstance(self.plugin.plugin, BrokerClientPlugin)
+        self.assertIs(self.client, self.plugin.plugin.client)
+        self.assertEqual(
+            [self.plugin, self.plugin.plugin],
+            self.client.get_plugins(),
+        )
+
+    def test_load_when_accepted(self):
+        """
+        The plugin is loaded only once its message type gets accepted, and
+        only once.
+        """
+        self.client.add(self.plugin)
+        self.assertIsNone(self.plugin.plugin)
+        event_type = "message-type-acceptance-changed"
+        self.client.fire_event(event_type, "test", False)
+        self.assertIsNone(self.plugin.plugin)
+        self.client.fire_event(event_type, "test", True)
+        self.assertIsInstance(self.plugin.plugin, BrokerClientPlugin)
+        self.client.fire_event(event_type, "test", True)
+        self.assertEqual(2, len(self.client.get_plugins()))
+
+    def test_load_error(self):
+        """If the plugin can't be loaded, a warning is logged."""
+        plugin = LazyPlugin("landscape.client.broker.DoesNotExist", "test")
+        self.mstore.set_accepted_types(["test"])
+        with self.assertLogs(level="WARN") as cm:
+            self.client.add(plugin)
+        self.assertIsNone(plugin.plugin)
+        self.assertIn("Unable to load plugin", cm.output[0])
+        self.assertIn("DoesNotExist", cm.output[0])
@@ -74,6 +74,99 @@ class ConfigurationTests(LandscapeTest):
         configuration = BrokerConfiguration()
         self.assertEqual(60, configuration.urgent_exchange_interval)
         self.assertEqual(900, configuration.exchange_interval)
+        self.assertEqual(0, configuration.max_exchange_interval)
+
+    def test_default_message_store_backend(self):
+        """Messages are stored in a directory hierarchy by default."""
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertEqual("directory", configuration.message_store_backend)
+
+    def test_max_payload_bytes_handling(self):
+        """
+        The 'max_payload_bytes' value specified in the configuration file is
+        converted to an integer, and defaults to 5MB.
+        """
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertEqual(5 * 1024 * 1024, configuration.max_payload_bytes)
+
+        filename = self.makeFile("[client]\nmax_payload_bytes = 1024\n")
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+        self.assertEqual(1024, configuration.max_payload_bytes)
+
+    def test_drain_threshold_handling(self):
+        """
+        The 'drain_threshold' value specified in the configuration file is
+        passed through, and it defaults to 0, disabling the drain mode.
+        """
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertEqual(0, configuration.drain_threshold)
+
+        filename = self.makeFile("[client]\ndrain_threshold = 1000\n")
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+        self.assertEqual(1000, configuration.drain_threshold)
+
+    def test_method_call_stats_interval_handling(self):
+        """
+        The periodic logging of the remote method call statistics is disabled
+        by default, and can be enabled in the configuration file.
+        """
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertEqual(0, configuration.method_call_stats_interval)
+
+        filename = self.makeFile("[client]\nmethod_call_stats_interval = 3600\n")
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+        self.assertEqual(3600, configuration.method_call_stats_interval)
+
+    def test_compress_messages_handling(self):
+        """
+        Message compression is disabled by default, and can be enabled in the
+        configuration file.
+        """
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertFalse(configuration.compress_messages)
+
+        filename = self.makeFile("[client]\ncompress_messages = true\n")
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+        self.assertTrue(configuration.compress_messages)
+
+    def test_stream_requests_handling(self):
+        """
+        Streaming exchange requests is disabled by default, and can be
+        enabled in the configuration file.
+        """
+        configuration = BrokerConfiguration()
+        configuration.load(["--url", "whatever"])
+        self.assertFalse(configuration.stream_requests)
+
+        filename = self.makeFile("[client]\nstream_requests = true\n")
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+        self.assertTrue(configuration.stream_requests)
+
+    def test_message_store_backend_handling(self):
+        """
+        The 'message_store_backend' value specified in the configuration file
+        selects the message store implementation.
+        """
+        filename = self.makeFile("[client]\nmessage_store_backend = sqlite\n")
+
+        configuration = BrokerConfiguration()
+        configuration.load(["--config", filename, "--url", "whatever"])
+
+        self.assertEqual("sqlite", configuration.message_store_backend)
+        self.assertEqual(
+            os.path.join(configuration.data_path, "messages.database"),
+            configuration.message_store_database_path,
+        )
 
     def test_intervals_are_ints(self):
         """
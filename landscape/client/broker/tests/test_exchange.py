@@ -1,15 +1,22 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
 from landscape import CLIENT_API
 from landscape.client.broker.config import BrokerConfiguration
-from landscape.client.broker.exchange import MessageExchange, get_accepted_types_diff
+from landscape.client.broker.exchange import (
+    IDLE_EXCHANGES,
+    MessageExchange,
+    get_accepted_types_diff,
+)
 from landscape.client.broker.ping import Pinger
 from landscape.client.broker.registration import RegistrationHandler
 from landscape.client.broker.server import BrokerServer
 from landscape.client.broker.store import MessageStore
 from landscape.client.broker.tests.helpers import ExchangeHelper
-from landscape.client.broker.transport import FakeTransport
+from landscape.client.broker.transport import FakeTransport, HTTPTransport
 from landscape.client.tests.helpers import DEFAULT_ACCEPTED_TYPES, LandscapeTest
+from landscape.lib import bpickle
 from landscape.lib.fetch import HTTPCodeError, PyCurlError
 from landscape.lib.hashlib import md5
 from landscape.lib.persist import Persist
@@ -158,6 +165,34 @@ class MessageExchangeTest(LandscapeTest):
         self.mstore.add_pending_offset(1)
         self.assertFalse(self.mstore.is_pending(message_id))
 
+    def test_send_many(self):
+        """
+        The send_many method adds all the given messages to the store and
+        returns their ids.
+        """
+        self.mstore.set_accepted_types(["empty", "data"])
+        message_ids = self.exchanger.send_many(
+            [{"type": "empty"}, {"type": "data", "data": 1}],
+        )
+        self.assertEqual([True, True], self.mstore.are_pending(message_ids))
+        self.assertFalse(self.exchanger.is_urgent())
+        self.exchanger.exchange()
+        self.assertEqual(
+            [
+                {"type": "empty", "timestamp": 0, "api": b"3.2"},
+                {"type": "data", "data": 1, "timestamp": 0, "api": b"3.2"},
+            ],
+            self.transport.payloads[0]["messages"],
+        )
+
+    def test_send_many_urgent(self):
+        """
+        Sending messages with the urgent flag schedules an urgent exchange.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger.send_many([{"type": "empty"}], urgent=True)
+        self.assertTrue(self.exchanger.is_urgent())
+
     def test_send_big_message_trimmed_err(self):
         """
         When package reporter sends error, message is trimmed if too long
@@ -317,16 +352,16 @@ class MessageExchangeTest(LandscapeTest):
 
     def test_messages_from_server_commit(self):
         """
-        The Exchange should commit the message store after processing each
-        message.
+        The server sequence is recorded on disk after processing each
+        message, and it can be recovered by a new message store.
         """
         self.transport.responses.append([{"type": "inbound"}] * 3)
         handled = []
         self.message_counter = 0
 
         def handler(message):
-            Persist(filename=self.persist_filename)
-            store = MessageStore(self.persist, self.config.message_store_path)
+            persist = Persist(filename=self.persist_filename)
+            store = MessageStore(persist, self.config.message_store_path)
             self.assertEqual(store.get_server_sequence(), self.message_counter)
             self.message_counter += 1
             handled.append(True)
@@ -335,6 +370,108 @@ class MessageExchangeTest(LandscapeTest):
         self.exchanger.exchange()
         self.assertEqual(handled, [True] * 3, self.logfile.getvalue())
 
+    def test_messages_from_server_coalesce_commits(self):
+        """
+        The persist is saved once before and once after processing the
+        messages from the server, not after each of them. The other save
+        happens when the exchange token is cleared before the exchange.
+        """
+        self.transport.responses.append([{"type": "inbound"}] * 200)
+        self.exchanger.register_message("inbound", lambda message: None)
+        with mock.patch.object(self.persist, "save", wraps=self.persist.save) as save:
+            self.exchanger.exchange()
+        self.assertEqual(3, save.call_count)
+        self.assertEqual(200, self.mstore.get_server_sequence())
+
+    def test_messages_from_server_commit_handler_changes(self):
+        """
+        If the handler of a message from the server changes the persist, it's
+        saved along with the server sequence, so that the message isn't lost
+        if we're stopped before the end of the exchange.
+        """
+        self.transport.responses.append([{"type": "inbound"}] * 3)
+        handled = []
+
+        def handler(message):
+            persist = Persist(filename=self.persist_filename)
+            self.assertEqual(
+                len(handled),
+                persist.get("message-store.server_sequence", 0),
+            )
+            self.assertEqual(len(handled), len(persist.get("handled", [])))
+            self.persist.add("handled", True)
+            handled.append(True)
+
+        self.exchanger.register_message("inbound", handler)
+        self.exchanger.exchange()
+        self.assertEqual(handled, [True] * 3, self.logfile.getvalue())
+
+    def test_get_stats(self):
+        """
+        The exchanger keeps statistics about the phases of the exchanges,
+        including the ones reported by the transport.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger.send({"type": "empty"})
+        self.exchanger.send({"type": "empty"})
+        self.transport.responses.append([{"type": "inbound"}])
+        self.transport.extra["stats"] = {"network": 1.5, "bytes-sent": 100}
+        self.exchanger.exchange()
+        self.exchanger.exchange()
+
+        stats = self.exchanger.get_stats()
+        self.assertEqual(
+            {
+                "build",
+                "network",
+                "bytes-sent",
+                "dispatch",
+                "messages-sent",
+                "messages-received",
+                "exchange",
+            },
+            set(stats),
+        )
+        self.assertEqual(2, stats["exchange"]["count"])
+        self.assertEqual(1.5, stats["network"]["p50"])
+        self.assertEqual(2, stats["messages-sent"]["max"])
+        self.assertEqual(0, stats["messages-sent"]["min"])
+        self.assertEqual(0.5, stats["messages-received"]["mean"])
+
+    def test_get_stats_failed_exchange(self):
+        """
+        Failed exchanges only account for the payload that was built.
+        """
+        self.log_helper.ignore_errors(HTTPCodeError)
+        self.transport.responses.append(HTTPCodeError(503, "busy"))
+        self.exchanger.exchange()
+        self.assertEqual(
+            {"build", "messages-sent"},
+            set(self.exchanger.get_stats()),
+        )
+
+    def test_messages_from_server_commit_on_error(self):
+        """
+        If a message handler fails, the server sequence of the messages that
+        were processed before is saved anyway.
+        """
+        self.log_helper.ignore_errors(ZeroDivisionError)
+        self.transport.responses.append([{"type": "inbound"}] * 3)
+        handled = []
+
+        def handler(message):
+            handled.append(message)
+            if len(handled) == 2:
+                1 / 0
+
+        self.exchanger.register_message("inbound", handler)
+        self.exchanger.exchange()
+        store = MessageStore(
+            Persist(filename=self.persist_filename),
+            self.config.message_store_path,
+        )
+        self.assertEqual(1, store.get_server_sequence())
+
     def test_messages_from_server_causing_urgent_exchanges(self):
         """
         If a message from the server causes an urgent message to be
@@ -932,6 +1069,50 @@ class MessageExchangeTest(LandscapeTest):
         exchanger.exchange()
         self.assertEqual(self.transport.payloads[0]["total-messages"], 2)
 
+    def test_max_payload_bytes(self):
+        """
+        The messages included in a payload are limited by the
+        C{max_payload_bytes} configuration setting, and the remaining ones
+        are sent in the following exchanges.
+        """
+        self.config.max_payload_bytes = 1
+        exchanger = MessageExchange(
+            self.reactor,
+            self.mstore,
+            self.transport,
+            self.identity,
+            self.exchange_store,
+            self.config,
+        )
+        self.mstore.set_accepted_types(["empty"])
+        for i in range(3):
+            self.mstore.add({"type": "empty"})
+        exchanger.exchange()
+        self.assertEqual(1, len(self.transport.payloads[0]["messages"]))
+        self.assertEqual(3, self.transport.payloads[0]["total-messages"])
+        exchanger.exchange()
+        self.assertEqual(1, len(self.transport.payloads[1]["messages"]))
+        self.assertEqual(2, self.transport.payloads[1]["total-messages"])
+
+    def test_max_payload_bytes_disabled(self):
+        """
+        A C{max_payload_bytes} setting of 0 disables the size limit.
+        """
+        self.config.max_payload_bytes = 0
+        exchanger = MessageExchange(
+            self.reactor,
+            self.mstore,
+            self.transport,
+            self.identity,
+            self.exchange_store,
+            self.config,
+        )
+        self.mstore.set_accepted_types(["empty"])
+        for i in range(3):
+            self.mstore.add({"type": "empty"})
+        exchanger.exchange()
+        self.assertEqual(3, len(self.transport.payloads[0]["messages"]))
+
     def test_impending_exchange(self):
         """
         A reactor event is emitted shortly (10 seconds) before an exchange
@@ -1123,6 +1304,182 @@ class MessageExchangeTest(LandscapeTest):
         self.reactor.advance(1)
         self.assertEqual(len(self.transport.payloads), 2)
 
+    def test_exchange_interval_shortened_by_pending_messages(self):
+        """
+        The next regular exchange is brought forward as pending messages
+        fill the payload, proportionally between the regular and the urgent
+        exchange intervals.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger.schedule_exchange()
+        self.exchanger.send_many([{"type": "empty"}] * 50)
+
+        # Half a payload: (900 - 60) / 2 seconds earlier.
+        self.reactor.advance(479)
+        self.assertEqual(0, len(self.transport.payloads))
+        self.reactor.advance(1)
+        self.assertEqual(1, len(self.transport.payloads))
+
+    def test_exchange_interval_shortened_by_pending_bytes(self):
+        """
+        The size of the pending messages is taken into account as well, if
+        the size of a payload is limited.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger._max_payload_bytes = 10
+        self.exchanger.schedule_exchange()
+        self.exchanger.send({"type": "empty"})
+
+        self.reactor.advance(self.config.urgent_exchange_interval)
+        self.assertEqual(1, len(self.transport.payloads))
+
+    def test_exchange_interval_not_shortened_by_delivered_bytes(self):
+        """
+        Only the size of the pending messages is taken into account, not the
+        one of the delivered or held messages left in the store.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        for i in range(10):
+            self.mstore.add({"type": "empty"})
+        self.mstore.add_pending_offset(10)
+        self.mstore.add({"type": "holdme"})
+        size = self.mstore.get_messages_total_size()
+        self.mstore.add({"type": "empty"})
+        size = self.mstore.get_messages_total_size() - size
+        self.exchanger._max_payload_bytes = 2 * size
+        self.exchanger.schedule_exchange()
+
+        # Half a payload: (900 - 60) / 2 seconds earlier.
+        self.reactor.advance(479)
+        self.assertEqual(0, len(self.transport.payloads))
+        self.reactor.advance(1)
+        self.assertEqual(1, len(self.transport.payloads))
+
+    def test_exchange_interval_not_computed_when_due(self):
+        """
+        Once the next exchange is due within the urgent exchange interval,
+        more pending messages can't bring it forward, and the size of the
+        pending messages is not computed anymore.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger._max_payload_bytes = 10
+        self.exchanger.schedule_exchange()
+        self.exchanger.send({"type": "empty"})
+        with mock.patch.object(
+            self.mstore,
+            "get_pending_messages_size",
+        ) as get_pending_messages_size:
+            self.exchanger.send({"type": "empty"})
+        get_pending_messages_size.assert_not_called()
+
+    def test_exchange_interval_not_lengthened_by_pending_messages(self):
+        """
+        Pending messages never delay an exchange which is already scheduled
+        earlier, like an urgent one.
+        """
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger.schedule_exchange(urgent=True)
+        self.exchanger.send({"type": "empty"})
+
+        self.reactor.advance(self.config.urgent_exchange_interval)
+        self.assertEqual(1, len(self.transport.payloads))
+
+    def test_exchange_interval_lengthened_when_idle(self):
+        """
+        After a few exchanges in a row with nothing to send or receive, the
+        exchange interval doubles at each idle exchange, up to the maximum
+        exchange interval.
+        """
+        self.config.max_exchange_interval = 3600
+        self.exchanger.schedule_exchange()
+        for i in range(IDLE_EXCHANGES):
+            self.wait_for_exchange()
+        self.assertEqual(IDLE_EXCHANGES, len(self.transport.payloads))
+
+        for interval in [1800, 3600, 3600]:
+            self.reactor.advance(interval - 1)
+            payloads = len(self.transport.payloads)
+            self.reactor.advance(1)
+            self.assertEqual(payloads + 1, len(self.transport.payloads))
+
+    def test_exchange_interval_reset_by_message(self):
+        """
+        The exchange interval is reset as soon as a message is sent.
+        """
+        self.config.max_exchange_interval = 3600
+        self.mstore.set_accepted_types(["empty"])
+        self.exchanger.schedule_exchange()
+        for i in range(IDLE_EXCHANGES):
+            self.wait_for_exchange()
+
+        # The next exchange would be in 1800 seconds.
+        self.exchanger.send({"type": "empty"})
+        self.reactor.advance(self.config.exchange_interval)
+        self.assertEqual(IDLE_EXCHANGES + 1, len(self.transport.payloads))
+        self.assertEqual(1, len(self.transport.payloads[-1]["messages"]))
+
+    def test_exchange_interval_reset_by_server_message(self):
+        """
+        The exchange interval is reset when the server sends us a message.
+        """
+        self.config.max_exchange_interval = 3600
+        self.exchanger.schedule_exchange()
+        for i in range(IDLE_EXCHANGES):
+            self.wait_for_exchange()
+        self.transport.responses.append([{"type": "inbound"}])
+        self.reactor.advance(2 * self.config.exchange_interval)
+        self.assertEqual(IDLE_EXCHANGES + 1, len(self.transport.payloads))
+
+        self.wait_for_exchange()
+        self.assertEqual(IDLE_EXCHANGES + 2, len(self.transport.payloads))
+
+    def test_exchange_interval_lengthened_up_to_server_maximum(self):
+        """
+        The maximum exchange interval can be set by the server along with
+        the exchange interval.
+        """
+        self.config.max_exchange_interval = 3600
+        self.transport.responses.append(
+            [{"type": "set-intervals", "exchange": 300, "max-exchange": 1200}],
+        )
+        self.exchanger.exchange()
+        self.assertEqual(1200, self.config.max_exchange_interval)
+        for i in range(IDLE_EXCHANGES):
+            self.reactor.advance(300)
+        self.assertEqual(IDLE_EXCHANGES + 1, len(self.transport.payloads))
+
+        for interval in [600, 1200, 1200]:
+            self.reactor.advance(interval - 1)
+            payloads = len(self.transport.payloads)
+            self.reactor.advance(1)
+            self.assertEqual(payloads + 1, len(self.transport.payloads))
+
+    def test_exchange_interval_set_by_server_not_lengthened(self):
+        """
+        A local maximum exchange interval doesn't lengthen the exchange
+        interval past the one set by the server, if it didn't set a maximum.
+        """
+        self.config.max_exchange_interval = 3600
+        self.transport.responses.append(
+            [{"type": "set-intervals", "exchange": 300}],
+        )
+        self.exchanger.exchange()
+        self.assertEqual(0, self.config.max_exchange_interval)
+        for i in range(IDLE_EXCHANGES + 3):
+            payloads = len(self.transport.payloads)
+            self.reactor.advance(300)
+            self.assertEqual(payloads + 1, len(self.transport.payloads))
+
+    def test_exchange_interval_not_lengthened_without_maximum(self):
+        """
+        The exchange interval isn't lengthened if the maximum exchange
+        interval is 0, which is the default.
+        """
+        self.exchanger.schedule_exchange()
+        for i in range(IDLE_EXCHANGES + 2):
+            self.wait_for_exchange()
+        self.assertEqual(IDLE_EXCHANGES + 2, len(self.transport.payloads))
+
     def test_register_message(self):
         """
         The exchanger exposes a mechanism for subscribing to messages
@@ -1335,6 +1692,28 @@ class MessageExchangeTest(LandscapeTest):
         self.assertEqual(len(ids_after), len(ids_before) - 1)
         self.assertNotIn("234567", ids_after)
 
+    def test_obsolete_response_messages_are_discarded_in_batch(self):
+        """
+        Obsolete response messages sent with L{MessageExchange.send_many} are
+        discarded, while the other messages of the batch are kept.
+        """
+        msg = {"type": "type-R", "whatever": 5678, "operation-id": 234567}
+        self.transport.responses.append([msg])
+        self.exchanger.exchange()
+        self.identity.secure_id = "brand-new"
+
+        self.mstore.set_accepted_types(["resynchronize", "empty"])
+        [obsolete_id, message_id] = self.exchanger.send_many(
+            [{"type": "resynchronize", "operation-id": 234567}, {"type": "empty"}],
+        )
+        self.assertIs(None, obsolete_id)
+        self.assertTrue(self.mstore.is_pending(message_id))
+        self.exchanger.exchange()
+        self.assertMessages(
+            self.transport.payloads[1]["messages"],
+            [{"type": "empty"}],
+        )
+
     def test_error_exchanging_causes_failed_exchange(self):
         """
         If a traceback occurs whilst exchanging, the 'exchange-failed'
@@ -1490,6 +1869,106 @@ class MessageExchangeTest(LandscapeTest):
         self.reactor.advance(20)
         self.assertEqual(len(self.transport.payloads), 2)
 
+    def make_draining_exchanger(self, count):
+        """Get an exchanger sending one message per exchange, with C{count}
+        messages pending and a drain threshold of 3."""
+        self.config.drain_threshold = 3
+        exchanger = MessageExchange(
+            self.reactor,
+            self.mstore,
+            self.transport,
+            self.identity,
+            self.exchange_store,
+            self.config,
+            max_messages=1,
+        )
+        self.mstore.set_accepted_types(["empty"])
+        for i in range(count):
+            self.mstore.add({"type": "empty"})
+        return exchanger
+
+    def test_drain_mode(self):
+        """
+        When the pending messages left after an exchange reach the drain
+        threshold, the following exchanges run back-to-back until the
+        backlog goes below the threshold.
+        """
+        exchanger = self.make_draining_exchanger(5)
+        exchanger.exchange()
+        self.assertTrue(exchanger.is_draining())
+        self.reactor.advance(0)
+        self.assertEqual(3, len(self.transport.payloads))
+        self.assertEqual(
+            [5, 4, 3],
+            [payload["total-messages"] for payload in self.transport.payloads],
+        )
+        self.assertFalse(exchanger.is_draining())
+        self.assertIn("Entering backlog drain mode.", self.logfile.getvalue())
+        self.assertIn("Leaving backlog drain mode.", self.logfile.getvalue())
+
+        # Back to normal urgent exchanges.
+        self.reactor.advance(0)
+        self.assertEqual(3, len(self.transport.payloads))
+        self.wait_for_exchange(urgent=True)
+        self.assertEqual(4, len(self.transport.payloads))
+
+    def test_drain_mode_disabled(self):
+        """
+        A C{drain_threshold} of 0 disables the drain mode.
+        """
+        exchanger = self.make_draining_exchanger(5)
+        exchanger._drain_threshold = 0
+        exchanger.exchange()
+        self.assertFalse(exchanger.is_draining())
+        self.reactor.advance(0)
+        self.assertEqual(1, len(self.transport.payloads))
+
+    def test_drain_mode_not_delayed_by_urgent_exchange(self):
+        """
+        Scheduling an urgent exchange while draining doesn't postpone the
+        next exchange.
+        """
+        exchanger = self.make_draining_exchanger(5)
+        exchanger.exchange()
+        exchanger.schedule_exchange(urgent=True)
+        self.reactor.advance(0)
+        self.assertEqual(3, len(self.transport.payloads))
+
+    def test_drain_mode_stops_on_failure(self):
+        """
+        A failed exchange ends the drain mode, and the server errors make
+        the client back off as usual.
+        """
+        self.exchanger._backoff_counter._start_delay = 300
+        self.exchanger._backoff_counter._max_delay = 1000
+        exchanger = self.make_draining_exchanger(5)
+        exchanger._backoff_counter = self.exchanger._backoff_counter
+        exchanger.exchange()
+        self.transport.responses.append(HTTPCodeError(503, ""))
+        self.reactor.advance(0)
+        self.assertEqual(2, len(self.transport.payloads))
+        self.assertFalse(exchanger.is_draining())
+        self.wait_for_exchange(urgent=True)
+        self.assertEqual(2, len(self.transport.payloads))
+
+    def test_drain_mode_honors_backoff(self):
+        """
+        The exchanges run while draining are delayed by the backoff counter.
+        """
+        self.config.urgent_exchange_interval = 1000
+        exchanger = self.make_draining_exchanger(5)
+        exchanger._backoff_counter._start_delay = 300
+        exchanger._backoff_counter.increase()
+        exchanger._backoff_counter.increase()
+        exchanger.exchange()
+        self.assertTrue(exchanger.is_draining())
+        # The successful exchange decreased the backoff delay to 300
+        # seconds, minus up to 25%.
+        self.reactor.advance(224)
+        self.assertEqual(1, len(self.transport.payloads))
+        self.reactor.advance(76)
+        self.assertEqual(3, len(self.transport.payloads))
+
 
 class AcceptedTypesMessageExchangeTest(LandscapeTest):
     helpers = [ExchangeHelper]
@@ -1602,6 +2081,137 @@ class AcceptedTypesMessageExchangeTest(LandscapeTest):
         self.assertEqual(types, sorted(["typefoo"] + DEFAULT_ACCEPTED_TYPES))
 
 
+class FakeExchangeServer(ThreadingHTTPServer):
+    """A minimal local stand-in for the server message system.
+
+    It acknowledges all the messages it receives, and answers with the
+    HTTP status codes queued in C{errors} first, if any. Like many servers,
+    it requires the length of the requests.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeExchangeRequestHandler)
+        self.payloads = []
+        self.errors = []
+        self.next_expected_sequence = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port:d}/message-system"
+
+
+class FakeExchangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # noqa: N802
+        server = self.server
+        if "Content-Length" not in self.headers:
+            self.send_response(411)
+            self.send_header("Content-Length", "0")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            return
+        length = int(self.headers["Content-Length"])
+        payload = bpickle.loads(self.rfile.read(length))
+        server.payloads.append(payload)
+        if server.errors:
+            self.send_response(server.errors.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        server.next_expected_sequence = payload["sequence"] + len(
+            payload["messages"],
+        )
+        body = bpickle.dumps(
+            {
+                "server-api": "3.2",
+                "server-uuid": b"fake-uuid",
+                "messages": [],
+                "next-expected-sequence": server.next_expected_sequence,
+                "next-exchange-token": b"token",
+            },
+        )
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DrainModeIntegrationTest(LandscapeTest):
+    """Drain a backlog against a local fake exchange server."""
+
+    helpers = [ExchangeHelper]
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeExchangeServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.transport = HTTPTransport(None, self.server.url)
+        self.addCleanup(self.transport.session.close)
+        self.config.drain_threshold = 50
+        self.exchanger = MessageExchange(
+            self.reactor,
+            self.mstore,
+            self.transport,
+            self.identity,
+            self.exchange_store,
+            self.config,
+            max_messages=20,
+        )
+        self.identity.secure_id = "secure-id"
+        self.mstore.add_schema(Message("empty", {}))
+        self.mstore.set_accepted_types(["empty"])
+        for i in range(250):
+            self.mstore.add({"type": "empty"})
+
+    def test_drain_backlog(self):
+        """
+        A backlog is sent with back-to-back exchanges until it goes below
+        the drain threshold, the rest is sent with urgent exchanges.
+        """
+        self.exchanger.exchange()
+        self.reactor.advance(0)
+        # 11 exchanges of 20 messages leave 30 of them, below the threshold.
+        self.assertEqual(11, len(self.server.payloads))
+        self.assertEqual(220, self.server.next_expected_sequence)
+        self.assertFalse(self.exchanger.is_draining())
+
+        self.reactor.advance(self.config.urgent_exchange_interval)
+        self.assertEqual(12, len(self.server.payloads))
+        self.assertEqual(240, self.server.next_expected_sequence)
+
+    def test_drain_backlog_server_error(self):
+        """
+        If an exchange fails while the backlog is drained, the client stops
+        draining and waits for the next regular exchange to restart it. That
+        exchange is scheduled after the urgent exchange interval, since the
+        backlog fills more than a payload.
+        """
+        self.log_helper.ignore_errors("Error contacting the server")
+        self.exchanger.exchange()
+        self.server.errors.append(503)
+        self.reactor.advance(0)
+        self.assertEqual(2, len(self.server.payloads))
+        self.assertEqual(20, self.server.next_expected_sequence)
+        self.assertFalse(self.exchanger.is_draining())
+
+        self.reactor.advance(self.config.urgent_exchange_interval - 1)
+        self.assertEqual(2, len(self.server.payloads))
+        # The failed messages are sent again, and the backlog is drained.
+        self.reactor.advance(1)
+        self.assertEqual(12, len(self.server.payloads))
+        self.assertEqual(220, self.server.next_expected_sequence)
+
+
 class GetAcceptedTypesDiffTest(LandscapeTest):
     def test_diff_empty(self):
         self.assertEqual(get_accepted_types_diff([], []), "")
@@ -155,6 +155,21 @@ class PingerTest(LandscapeTest):
         )
         self.assertEqual(pinger.ping_client_factory, PingClient)
 
+    def test_get_page(self):
+        """
+        The C{get_page} argument to L{Pinger} is passed to the ping client,
+        e.g. to share the connections of the message exchange.
+        """
+        pinger = Pinger(
+            self.reactor,
+            self.identity,
+            self.exchanger,
+            self.config,
+            get_page=self.page_getter.get_page,
+        )
+        pinger.start()
+        self.assertEqual(self.page_getter.get_page, pinger._ping_client.get_page)
+
     def test_occasional_ping(self):
         """
         The L{Pinger} should be able to occasionally ask if there are
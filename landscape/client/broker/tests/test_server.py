@@ -15,8 +15,9 @@ class FakeClient:
 
 
 class FakeCreator:
-    def __init__(self, reactor, config):
-        pass
+    def __init__(self, reactor, config, caller=None, stats=None):
+        self.caller = caller
+        self.stats = stats
 
     def connect(self):
         return succeed(FakeClient())
@@ -106,6 +107,52 @@ class BrokerServerTest(LandscapeTest):
             None,
         )
 
+    def test_send_messages(self):
+        """
+        The L{BrokerServer.send_messages} method forwards several messages to
+        the broker's exchanger at once.
+        """
+        messages = [{"type": "test"}, {"type": "test"}]
+        self.mstore.set_accepted_types(["test"])
+        session_id = self.broker.get_session_id()
+        message_ids = self.broker.send_messages(messages, session_id)
+        self.assertEqual(2, len(message_ids))
+        self.assertMessages(self.mstore.get_pending_messages(), messages)
+        self.assertFalse(self.exchanger.is_urgent())
+
+    def test_send_messages_with_urgent(self):
+        """
+        The L{BrokerServer.send_messages} can optionally specify the urgency
+        of the messages.
+        """
+        self.mstore.set_accepted_types(["test"])
+        session_id = self.broker.get_session_id()
+        self.broker.send_messages([{"type": "test"}], session_id, urgent=True)
+        self.assertTrue(self.exchanger.is_urgent())
+
+    def test_send_messages_wont_send_with_invalid_session_id(self):
+        """
+        The L{BrokerServer.send_messages} call silently drops messages with
+        an invalid session id, like L{BrokerServer.send_message}.
+        """
+        self.mstore.set_accepted_types(["test"])
+        self.assertIs(
+            None,
+            self.broker.send_messages([{"type": "test"}], "Not Valid"),
+        )
+        self.assertMessages(self.mstore.get_pending_messages(), [])
+
+    def test_send_messages_with_none_as_session_id_raises(self):
+        """
+        Calling C{send_messages} without a session id raises an error.
+        """
+        self.assertRaises(
+            RuntimeError,
+            self.broker.send_messages,
+            [{"type": "test"}],
+            None,
+        )
+
     def test_send_message_with_old_release_upgrader(self):
         """
         If we receive a message from an old release-upgrader process that
@@ -166,6 +213,19 @@ class BrokerServerTest(LandscapeTest):
         message_id = self.broker.send_message(message, session_id)
         self.assertTrue(self.broker.is_message_pending(message_id))
 
+    def test_are_messages_pending(self):
+        """
+        The L{BrokerServer.are_messages_pending} method indicates which of
+        the messages with the given ids are pending.
+        """
+        self.mstore.set_accepted_types(["test"])
+        session_id = self.broker.get_session_id()
+        message_id = self.broker.send_message({"type": "test"}, session_id)
+        self.assertEqual(
+            [True, False],
+            self.broker.are_messages_pending([message_id, 123]),
+        )
+
     def test_register_client(self):
         """
         The L{BrokerServer.register_client} method can be used to register
@@ -191,6 +251,17 @@ class BrokerServerTest(LandscapeTest):
         result = self.broker.register_client("test")
         return result.addCallback(assert_registered)
 
+    def test_register_client_accounts_calls(self):
+        """
+        The connectors created by L{BrokerServer.register_client} account for
+        the calls made to the clients in L{BrokerServer.sent_calls}.
+        """
+        self.broker.connectors_registry = {"test": FakeCreator}
+        self.successResultOf(self.broker.register_client("test"))
+        connector = self.broker.get_connector("test")
+        self.assertEqual("broker", connector.caller)
+        self.assertIs(self.broker.sent_calls, connector.stats)
+
     def test_register_client_disconnects_existing_connector(self):
         """
         The L{BrokerServer.register_client} method cleans up any existing
@@ -345,6 +416,45 @@ class BrokerServerTest(LandscapeTest):
         self.mstore.set_server_uuid("the-uuid")
         self.assertEqual(self.broker.get_server_uuid(), "the-uuid")
 
+    def test_get_exchange_stats(self):
+        """
+        The L{BrokerServer.get_exchange_stats} method returns statistics
+        about the last message exchanges.
+        """
+        self.exchanger.exchange()
+        stats = self.broker.get_exchange_stats()
+        self.assertEqual(1, stats["exchange"]["count"])
+        self.assertEqual(0, stats["messages-received"]["max"])
+
+    def test_get_method_call_stats(self):
+        """
+        The L{BrokerServer.get_method_call_stats} method returns statistics
+        about the remote calls received and made by the broker.
+        """
+        self.broker.received_calls.record("monitor", "ping", 0.1, 5, 2, False)
+        stats = self.broker.get_method_call_stats()
+        self.assertEqual({}, stats["sent"])
+        self.assertEqual(1, stats["received"]["monitor"]["ping"]["calls"])
+
+    def test_log_method_call_stats(self):
+        """
+        The L{BrokerServer.log_method_call_stats} method logs a line for each
+        method of each peer.
+        """
+        self.broker.received_calls.record("monitor", "ping", 0.1, 5, 2, False)
+        self.broker.sent_calls.record("manager", "fire_event", 0.2, 9, 1, True)
+        self.broker.log_method_call_stats()
+        self.assertIn(
+            "Remote calls received from monitor: ping called 1 times, "
+            "0 failed, 5 bytes of arguments, 2 bytes of results, "
+            "p50 0.1000s, p99 0.1000s",
+            self.logfile.getvalue(),
+        )
+        self.assertIn(
+            "Remote calls sent to manager: fire_event called 1 times, 1 failed",
+            self.logfile.getvalue(),
+        )
+
     def test_register_client_accepted_message_type(self):
         """
         The L{BrokerServer.register_client_accepted_message_type} method can
@@ -4,6 +4,7 @@ from unittest.mock import Mock, patch
 
 from landscape.client.broker.amp import RemoteBrokerConnector
 from landscape.client.broker.service import BrokerService
+from landscape.client.broker.store import SQLiteMessageStore
 from landscape.client.broker.tests.helpers import BrokerConfigurationHelper
 from landscape.client.broker.transport import HTTPTransport
 from landscape.client.tests.helpers import LandscapeTest
@@ -44,6 +45,24 @@ class BrokerServiceTest(LandscapeTest):
         """
         self.assertEqual(self.service.message_store.get_accepted_types(), ())
 
+    def test_sqlite_message_store(self):
+        """
+        If the C{message_store_backend} option is C{sqlite}, the
+        C{message_store} attribute is a L{SQLiteMessageStore}.
+        """
+        self.config.message_store_backend = "sqlite"
+        service = FakeBrokerService(self.config)
+        self.assertIsInstance(service.message_store, SQLiteMessageStore)
+        self.assertTrue(os.path.exists(self.config.message_store_database_path))
+
+    def test_compressed_message_store(self):
+        """
+        The C{compress_messages} option is passed to the message store.
+        """
+        self.config.compress_messages = True
+        service = FakeBrokerService(self.config)
+        self.assertTrue(service.message_store._compress)
+
     def test_identity(self):
         """
         A L{BrokerService} instance has a proper C{identity} attribute.
@@ -89,6 +108,21 @@ class BrokerServiceTest(LandscapeTest):
         self.service.pinger.start.assert_called_with()
         self.service.exchanger.stop.assert_called_with()
 
+    def test_log_method_call_stats(self):
+        """
+        If C{method_call_stats_interval} is set, the broker logs a summary of
+        its remote method calls at that interval.
+        """
+        self.config.method_call_stats_interval = 60
+        service = FakeBrokerService(self.config)
+        service.exchanger.start = Mock()
+        service.pinger.start = Mock()
+        service.broker.log_method_call_stats = Mock()
+        service.startService()
+        self.addCleanup(service.stopService)
+        service.reactor.advance(60)
+        service.broker.log_method_call_stats.assert_called_once_with()
+
     @patch("landscape.client.broker.service.FILE_MODE", 0o666)
     @patch("landscape.client.broker.service.DIRECTORY_MODE", 0o700)
     def test_sets_correct_permissions_on_files_and_dirs(self):
@@ -1,10 +1,17 @@
 import os
+import shutil
 from unittest import mock
 
-from landscape.client.broker.store import MessageStore
+from landscape.client.broker.store import (
+    COMPRESSED,
+    MessageStore,
+    SQLiteMessageStore,
+    decompress_message_data,
+)
 from landscape.client.tests.helpers import LandscapeTest
 from landscape.lib.bpickle import dumps
-from landscape.lib.persist import Persist
+from landscape.lib.fs import read_binary_file
+from landscape.lib.persist import JournalBPickleBackend, Persist
 from landscape.lib.schema import Bytes, Int, InvalidError, Unicode
 from landscape.message_schemas.message import Message
 
@@ -51,6 +58,109 @@ class MessageStoreTest(LandscapeTest):
         store = self.create_store()
         self.assertEqual(store.get_server_sequence(), 3)
 
+    def test_journal_server_sequence(self):
+        """
+        L{MessageStore.journal_server_sequence} sets the server sequence and
+        records it in a journal, that is cleared by the next commit.
+        """
+        journal_filename = self.persist_filename + ".sequence-journal"
+        self.store.set_server_sequence(3)
+        self.store.commit()
+        self.store.journal_server_sequence(4)
+        self.store.journal_server_sequence(5)
+        self.assertEqual(5, self.store.get_server_sequence())
+        with open(journal_filename) as fd:
+            self.assertEqual("3\n4\n5\n", fd.read())
+
+        self.store.commit()
+        self.assertFalse(os.path.exists(journal_filename))
+        self.assertEqual(5, self.create_store().get_server_sequence())
+
+    def test_journal_server_sequence_replay(self):
+        """
+        If the store wasn't committed after journaling the server sequence,
+        a new store recovers it from the journal and saves it.
+        """
+        self.store.set_server_sequence(3)
+        self.store.commit()
+        self.store.journal_server_sequence(4)
+        self.store.journal_server_sequence(5)
+
+        store = self.create_store()
+        self.assertEqual(5, store.get_server_sequence())
+        self.assertFalse(os.path.exists(self.persist_filename + ".sequence-journal"))
+        self.assertIn("Recovered server sequence 5", self.logfile.getvalue())
+        self.assertEqual(5, self.create_store().get_server_sequence())
+
+    def test_journal_server_sequence_replay_saved_later(self):
+        """
+        The journal is ignored if the persist was saved with a different
+        server sequence after it was written.
+        """
+        self.store.journal_server_sequence(4)
+        persist = Persist(filename=self.persist_filename)
+        persist.set("message-store.server_sequence", 9)
+        persist.save()
+
+        store = self.create_store()
+        self.assertEqual(9, store.get_server_sequence())
+        self.assertFalse(os.path.exists(self.persist_filename + ".sequence-journal"))
+
+    def test_journal_server_sequence_replay_partial_line(self):
+        """
+        A partially written line at the end of the journal is ignored.
+        """
+        self.store.journal_server_sequence(1)
+        self.store.journal_server_sequence(2)
+        with open(self.persist_filename + ".sequence-journal", "a") as fd:
+            fd.write("3")
+
+        self.assertEqual(2, self.create_store().get_server_sequence())
+
+    def test_journal_server_sequence_with_journaled_persist(self):
+        """
+        The server sequence journal doesn't clash with the journal of a
+        persist using the L{JournalBPickleBackend}.
+        """
+        backend = JournalBPickleBackend()
+        persist = Persist(filename=self.persist_filename, backend=backend)
+        store = MessageStore(persist, self.temp_dir)
+        store.journal_server_sequence(4)
+        persist.set("key", "value")
+        persist.save()
+        self.assertNotEqual(
+            backend.get_journal_filename(self.persist_filename),
+            store._get_journal_filename(),
+        )
+        persist = Persist(filename=self.persist_filename, backend=backend)
+        self.assertEqual("value", persist.get("key"))
+        store = MessageStore(persist, self.temp_dir)
+        self.assertEqual(4, store.get_server_sequence())
+
+    def test_journal_server_sequence_with_unsaved_changes(self):
+        """
+        If the persist has other unsaved changes, the store is committed
+        instead, so that the server sequence isn't saved ahead of them.
+        """
+        self.store.commit()
+        self.store.set_exchange_token("token")
+        self.store.journal_server_sequence(4)
+        self.assertFalse(os.path.exists(self.persist_filename + ".sequence-journal"))
+        store = self.create_store()
+        self.assertEqual(4, store.get_server_sequence())
+        self.assertEqual("token", store.get_exchange_token())
+
+    def test_journal_server_sequence_without_filename(self):
+        """
+        If the persist has no file to save to, the store is committed right
+        away instead.
+        """
+        store = MessageStore(Persist(), self.temp_dir)
+        with mock.patch.object(store, "commit") as commit:
+            store.journal_server_sequence(4)
+        commit.assert_called_once_with()
+        self.assertEqual(4, store.get_server_sequence())
+
     def test_get_set_server_uuid(self):
         self.assertEqual(self.store.get_server_uuid(), None)
         self.store.set_server_uuid("abcd-efgh")
@@ -187,6 +297,103 @@ class MessageStoreTest(LandscapeTest):
             [{"type": "data", "data": b"c"}],
         )
 
+    def test_messages_over_mb_evicts_delivered_first(self):
+        """
+        When the size limit is exceeded, directories holding only messages
+        that were already delivered are evicted first, and the pending
+        offset is adjusted to keep pointing to the next message to send.
+        """
+        self.store._directory_size = 2
+        self.store._max_size_mb = 0.01
+        self.store.add({"type": "data", "data": b"a" * 3000})
+        self.store.add({"type": "data", "data": b"b" * 3000})
+        self.store.add({"type": "data", "data": b"c" * 3000})
+        self.store.set_pending_offset(2)
+        self.store.add({"type": "data", "data": b"d" * 3000})
+        self.store.add({"type": "data", "data": b"e"})
+        self.assertEqual(0, self.store.get_pending_offset())
+        self.assertEqual(
+            [b"c" * 3000, b"d" * 3000, b"e"],
+            [m["data"] for m in self.store.get_pending_messages()],
+        )
+
+    def test_messages_over_mb_keeps_held_messages(self):
+        """
+        Directories holding held messages are only evicted after the ones
+        holding delivered messages.
+        """
+        self.store._directory_size = 1
+        self.store._max_size_mb = 0.01
+        self.store.add({"type": "unaccepted", "data": b"a" * 4000})
+        self.store.add({"type": "data", "data": b"b" * 4000})
+        self.store.set_pending_offset(1)
+        self.store.add({"type": "data", "data": b"c" * 4000})
+        self.store.add({"type": "data", "data": b"d"})
+        self.store.set_accepted_types(["data", "unaccepted"])
+        self.assertEqual(
+            [b"c" * 4000, b"d", b"a" * 4000],
+            [m["data"] for m in self.store.get_pending_messages()],
+        )
+
+    def test_get_messages_total_size(self):
+        """
+        The total size of the messages is accounted for as messages are
+        added and deleted, without scanning the file system.
+        """
+
+        def scan_size():
+            return sum(
+                os.path.getsize(filename) for filename in self.store._scan_messages()
+            )
+
+        self.store._directory_size = 2
+        for i in range(5):
+            self.store.add(dict(type="data", data=intToBytes(i) * (i + 1)))
+        self.store.add({"type": "unaccepted", "data": b"held"})
+        self.assertEqual(scan_size(), self.store.get_messages_total_size())
+        self.store.set_pending_offset(3)
+        self.store.delete_old_messages()
+        self.assertEqual(scan_size(), self.store.get_messages_total_size())
+        self.store.set_accepted_types(["data", "unaccepted"])
+        self.assertEqual(scan_size(), self.store.get_messages_total_size())
+        store = self.create_store()
+        self.assertEqual(scan_size(), store.get_messages_total_size())
+        store.delete_all_messages()
+        self.assertEqual(0, store.get_messages_total_size())
+
+    def test_get_pending_messages_size(self):
+        """
+        The size of the pending messages doesn't include the delivered and
+        the held messages.
+        """
+        sizes = []
+        for i in range(3):
+            size = self.store.get_messages_total_size()
+            self.store.add(dict(type="data", data=intToBytes(i) * (i + 1) * 100))
+            sizes.append(self.store.get_messages_total_size() - size)
+        self.store.add({"type": "unaccepted", "data": b"held"})
+        self.assertEqual(sum(sizes), self.store.get_pending_messages_size())
+        self.store.set_pending_offset(1)
+        self.assertEqual(sum(sizes[1:]), self.store.get_pending_messages_size())
+        self.store.add(dict(type="data", data=b"x"))
+        self.store.set_pending_offset(4)
+        self.assertEqual(0, self.store.get_pending_messages_size())
+        self.store.set_pending_offset(1)
+        self.store.set_accepted_types([])
+        self.assertEqual(0, self.store.get_pending_messages_size())
+
+    def test_add_does_not_scan_directory(self):
+        """
+        Enforcing the size limit when adding a message doesn't list or stat
+        the message files.
+        """
+        self.store.add({"type": "empty"})
+        with mock.patch("os.listdir") as listdir_mock:
+            with mock.patch("os.scandir") as scandir_mock:
+                self.store.add({"type": "empty"})
+        listdir_mock.assert_not_called()
+        scandir_mock.assert_not_called()
+
     @mock.patch("shutil.rmtree")
     def test_exception_on_message_limit(self, rmtree_mock):
         """
@@ -224,6 +431,72 @@ class MessageStoreTest(LandscapeTest):
         il = [m["data"] for m in self.store.get_pending_messages(5)]
         self.assertEqual(il, [intToBytes(i) for i in [0, 1, 2, 3, 4]])
 
+    def test_max_bytes_pending(self):
+        """
+        The messages returned by L{MessageStore.get_pending_messages} are
+        limited by their total serialized size.
+        """
+        for i in range(5):
+            self.store.add(dict(type="data", data=b"x" * 100))
+        [message] = self.store.get_pending_messages()[:1]
+        size = len(dumps(message))
+        messages = self.store.get_pending_messages(max_bytes=size * 3)
+        self.assertEqual(3, len(messages))
+        messages = self.store.get_pending_messages(max_bytes=size * 3 - 1)
+        self.assertEqual(2, len(messages))
+
+    def test_max_bytes_pending_returns_big_message(self):
+        """
+        A message bigger than C{max_bytes} is returned on its own, so that it
+        doesn't block the queue.
+        """
+        self.store.add(dict(type="data", data=b"x" * 1000))
+        self.store.add(dict(type="data", data=b"y"))
+        messages = self.store.get_pending_messages(max_bytes=10)
+        self.assertEqual([b"x" * 1000], [m["data"] for m in messages])
+        self.store.add_pending_offset(1)
+        messages = self.store.get_pending_messages(max_bytes=10)
+        self.assertEqual([b"y"], [m["data"] for m in messages])
+
+    def test_max_bytes_pending_skips_reading(self):
+        """
+        The message which doesn't fit C{max_bytes} anymore is not read, as
+        the store knows its size.
+        """
+        for i in range(3):
+            self.store.add(dict(type="data", data=b"x" * 1000))
+        with mock.patch(
+            "landscape.client.broker.store.read_binary_file",
+            wraps=read_binary_file,
+        ) as read_mock:
+            messages = self.store.get_pending_messages(max_bytes=2500)
+        self.assertEqual(2, len(messages))
+        self.assertEqual(2, read_mock.call_count)
+
+    def test_get_pending_messages_decompresses_once(self):
+        """
+        Compressed messages are only decompressed once when read.
+        """
+        self.store._compress = True
+        self.store.add(dict(type="data", data=b"x" * 1000))
+        with mock.patch(
+            "landscape.client.broker.store.decompress_message_data",
+            wraps=decompress_message_data,
+        ) as decompress_mock:
+            [message] = self.store.get_pending_messages()
+        self.assertEqual(b"x" * 1000, message["data"])
+        decompress_mock.assert_called_once()
+
+    def test_max_bytes_pending_uses_uncompressed_size(self):
+        """
+        The size limit applies to the uncompressed messages.
+        """
+        self.store._compress = True
+        for i in range(3):
+            self.store.add(dict(type="data", data=b"x" * 1000))
+        messages = self.store.get_pending_messages(max_bytes=2500)
+        self.assertEqual(2, len(messages))
+
     def test_offset(self):
         self.store.set_pending_offset(5)
         for i in range(15):
@@ -455,6 +728,157 @@ class MessageStoreTest(LandscapeTest):
             {"type": "data", "data": 3},
         )
 
+    def test_compression(self):
+        """
+        With compression enabled, messages are stored compressed, prefixed
+        with a header byte, and read back transparently.
+        """
+        self.store._compress = True
+        message = {"type": "data", "data": b"x" * 1000}
+        self.store.add(message)
+        [filename] = self.store._walk_messages()
+        with open(filename, "rb") as fd:
+            data = fd.read()
+        self.assertEqual(COMPRESSED, data[:1])
+        self.assertTrue(len(data) < 1000)
+        self.assertEqual(len(data), self.store.get_messages_total_size())
+        self.assertMessages(self.store.get_pending_messages(), [message])
+        self.assertTrue(self.store.get_compression_ratio() > 10)
+
+    def test_compression_skips_incompressible_messages(self):
+        """
+        Messages that don't get smaller when compressed are stored as is.
+        """
+        self.store._compress = True
+        self.store.add({"type": "empty"})
+        [filename] = self.store._walk_messages()
+        with open(filename, "rb") as fd:
+            self.assertNotEqual(COMPRESSED, fd.read(1))
+        self.assertMessages(self.store.get_pending_messages(), [{"type": "empty"}])
+
+    def test_compression_reads_uncompressed_messages(self):
+        """
+        Messages stored before compression was enabled can still be read,
+        and held ones can be released.
+        """
+        self.store.add({"type": "data", "data": b"a" * 100})
+        self.store.add({"type": "unaccepted", "data": b"b" * 100})
+        self.store.commit()
+        self.store = self.create_store()
+        self.store._compress = True
+        self.store.add({"type": "unaccepted", "data": b"c" * 100})
+        self.store.set_accepted_types(["data", "unaccepted"])
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [
+                {"type": "data", "data": b"a" * 100},
+                {"type": "unaccepted", "data": b"b" * 100},
+                {"type": "unaccepted", "data": b"c" * 100},
+            ],
+        )
+
+    def test_corrupted_compressed_message(self):
+        """
+        A compressed message that can't be decompressed is flagged as broken.
+        """
+        self.log_helper.ignore_errors(ValueError)
+        self.store._compress = True
+        self.store.add({"type": "data", "data": b"x" * 1000})
+        [filename] = self.store._walk_messages()
+        with open(filename, "wb") as fd:
+            fd.write(COMPRESSED + b"garbage")
+        self.assertEqual([], self.store.get_pending_messages())
+        self.assertIn("Can't decompress message", self.logfile.getvalue())
+
+    def test_get_compression_ratio_without_compression(self):
+        """
+        L{MessageStore.get_compression_ratio} returns C{None} if compression
+        is disabled.
+        """
+        self.store.add({"type": "data", "data": b"x" * 1000})
+        self.assertIs(None, self.store.get_compression_ratio())
+
+    def test_add_many(self):
+        """
+        The L{MessageStore.add_many} method adds all the given messages in
+        order and returns their identifiers.
+        """
+        message_ids = self.store.add_many(
+            [
+                {"type": "data", "data": b"1"},
+                {"type": "unaccepted", "data": b"2"},
+                {"type": "data", "data": b"3"},
+            ],
+        )
+        self.assertEqual(3, len(message_ids))
+        self.assertEqual([True, True, True], self.store.are_pending(message_ids))
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [{"type": "data", "data": b"1"}, {"type": "data", "data": b"3"}],
+        )
+        self.store.set_accepted_types(["data", "unaccepted"])
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [
+                {"type": "data", "data": b"1"},
+                {"type": "data", "data": b"3"},
+                {"type": "unaccepted", "data": b"2"},
+            ],
+        )
+
+    def test_add_many_enforces_limits_once(self):
+        """
+        The size limits are only enforced once per batch of messages.
+        """
+        with mock.patch.object(
+            self.store,
+            "delete_messages_over_limit",
+        ) as limit_mock:
+            self.store.add_many([{"type": "empty"}, {"type": "empty"}])
+        limit_mock.assert_called_once_with()
+
+    def test_add_many_coercion(self):
+        """
+        A message which doesn't match its schema is dropped and logged, while
+        the other messages of the batch are still added.
+        """
+        self.log_helper.ignore_errors("Dropped invalid data message")
+        message_ids = self.store.add_many(
+            [
+                {"type": "data", "data": b"1"},
+                {"type": "data", "data": 3},
+                {"type": "data", "data": b"3"},
+            ],
+        )
+        self.assertIsNone(message_ids[1])
+        self.assertEqual(
+            [True, True],
+            self.store.are_pending([message_ids[0], message_ids[2]]),
+        )
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [{"type": "data", "data": b"1"}, {"type": "data", "data": b"3"}],
+        )
+        self.assertIn(
+            "WARNING: Dropped invalid data message: Value of 'data' key",
+            self.logfile.getvalue(),
+        )
+
+    def test_add_many_blackhole(self):
+        """
+        Messages added in batch are dropped while the store awaits a resync.
+        """
+        self.store.record_failure(0)
+        self.store.record_failure((7 * 24 * 60 * 60) + 1)
+        self.assertEqual(
+            [None, None],
+            self.store.add_many([{"type": "empty"}, {"type": "empty"}]),
+        )
+        self.assertIn(
+            "DEBUG: Dropped 2 messages, awaiting resync.",
+            self.logfile.getvalue(),
+        )
+
     def test_coercion_ignores_custom_api(self):
         """
         If a custom 'api' key is specified in the message, it should
@@ -521,6 +945,44 @@ class MessageStoreTest(LandscapeTest):
         self.store.add({"type": "data", "data": b"yay"})
         self.assertEqual(self.store.count_pending_messages(), 2)
 
+    def test_index_is_rebuilt_from_directory(self):
+        """
+        A new L{MessageStore} indexes the messages it finds in its
+        directory, including their flags.
+        """
+        self.store._directory_size = 2
+        for i in range(5):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        self.store.add({"type": "unaccepted", "data": b"held"})
+        self.store.set_pending_offset(1)
+        self.store.commit()
+
+        store = self.create_store()
+        store._directory_size = 2
+        self.assertEqual(4, store.count_pending_messages())
+        store.add(dict(type="data", data=b"5"))
+        self.assertEqual(
+            os.path.join(self.temp_dir, "3", "0"),
+            list(store._walk_messages())[-1],
+        )
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"1", b"2", b"3", b"4", b"5"])
+
+    def test_count_pending_messages_does_not_walk_directory(self):
+        """
+        Counting pending messages doesn't touch the file system, as the
+        store keeps track of the number of messages that are neither held
+        nor broken.
+        """
+        self.store.add({"type": "empty"})
+        self.store.add({"type": "unaccepted", "data": b"held"})
+        self.store.add({"type": "empty"})
+        self.store.add_pending_offset(1)
+        with mock.patch("os.listdir") as listdir_mock:
+            self.assertEqual(1, self.store.count_pending_messages())
+            self.assertEqual(1, len(self.store.get_pending_messages()))
+        listdir_mock.assert_not_called()
+
     def test_commit(self):
         """
         The Message Store can be told to save its persistent data to disk on
@@ -600,6 +1062,129 @@ class MessageStoreTest(LandscapeTest):
 
         self.assertFalse(self.store.is_pending(id))
 
+    def test_is_pending_does_not_walk_directory(self):
+        """
+        Looking up a message doesn't touch the file system, as the store
+        keeps a map from message identifiers to their position.
+        """
+        message_id = self.store.add({"type": "empty"})
+        with mock.patch("os.listdir") as listdir_mock:
+            with mock.patch("os.stat") as stat_mock:
+                self.assertTrue(self.store.is_pending(message_id))
+        listdir_mock.assert_not_called()
+        stat_mock.assert_not_called()
+
+    def test_is_pending_keeps_boundary_when_adding(self):
+        """
+        Adding messages doesn't make the store look for the first pending
+        message again, as new messages can't come before it.
+        """
+        message_id = self.store.add({"type": "empty"})
+        self.assertTrue(self.store.is_pending(message_id))
+        boundary = self.store._pending_boundary
+        other_id = self.store.add({"type": "empty"})
+        self.store.add({"type": "unaccepted", "data": b"x"})
+        self.assertIs(boundary, self.store._pending_boundary)
+        self.assertTrue(self.store.is_pending(other_id))
+
+    def test_is_pending_with_new_first_pending_message(self):
+        """
+        A message added when all the previous ones were delivered is the
+        first pending one.
+        """
+        old_id = self.store.add({"type": "empty"})
+        self.store.add_pending_offset(1)
+        self.assertFalse(self.store.is_pending(old_id))
+        message_id = self.store.add({"type": "empty"})
+        self.assertTrue(self.store.is_pending(message_id))
+        self.assertFalse(self.store.is_pending(old_id))
+
+    def test_is_pending_after_restart(self):
+        """Message identifiers are still valid after the store is reloaded."""
+        message_id = self.store.add({"type": "empty"})
+        held_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.store.commit()
+        store = self.create_store()
+        self.assertTrue(store.is_pending(message_id))
+        self.assertTrue(store.is_pending(held_id))
+
+    def test_message_ids_increase(self):
+        """
+        Message identifiers are handed out in increasing order, and aren't
+        reused after the store is reloaded, even if messages were deleted.
+        """
+        id1 = self.store.add({"type": "empty"})
+        id2 = self.store.add({"type": "empty"})
+        self.assertEqual(id1 + 1, id2)
+        self.store.delete_all_messages()
+        self.store.commit()
+        store = self.create_store()
+        self.assertEqual(id2 + 1, store.add({"type": "empty"}))
+
+    def test_message_id_kept_when_unheld(self):
+        """A held message keeps its identifier when it's unheld."""
+        self.store.add({"type": "empty"})
+        message_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.store.set_accepted_types(["empty", "unaccepted"])
+        self.assertEqual(
+            ["0/0", "0/2"],
+            [
+                os.path.relpath(filename, self.temp_dir)
+                for filename in self.store._walk_messages()
+            ],
+        )
+        self.store.add_pending_offset(1)
+        self.assertTrue(self.store.is_pending(message_id))
+        self.store.add_pending_offset(1)
+        self.assertFalse(self.store.is_pending(message_id))
+
+    def test_message_id_not_inode(self):
+        """
+        Message identifiers don't depend on the files holding the messages,
+        so they survive the store being copied elsewhere.
+        """
+        message_id = self.store.add({"type": "empty"})
+        self.store.commit()
+        temp_dir = self.makeDir()
+        os.rmdir(temp_dir)
+        shutil.copytree(self.temp_dir, temp_dir)
+        shutil.rmtree(self.temp_dir)
+        self.temp_dir = temp_dir
+        store = self.create_store()
+        self.assertTrue(store.is_pending(message_id))
+        store.add_pending_offset(1)
+        self.assertFalse(store.is_pending(message_id))
+
+    def test_message_ids_of_legacy_store(self):
+        """
+        The messages of a store which predates saved identifiers keep their
+        inode number as identifier, and new ones are numbered after them.
+        """
+        self.store.add({"type": "empty"})
+        [filename] = self.store._walk_messages()
+        persist = Persist(filename=self.persist_filename)
+        persist.remove("message-store.message-ids")
+        persist.remove("message-store.next-message-id")
+        persist.save()
+        inode = os.stat(filename).st_ino
+        store = self.create_store()
+        self.assertTrue(store.is_pending(inode))
+        self.assertEqual(inode + 1, store.add({"type": "empty"}))
+
+    def test_are_pending(self):
+        """
+        The L{MessageStore.are_pending} method tells which of the given
+        messages are pending, in the given order.
+        """
+        id1 = self.store.add({"type": "empty"})
+        id2 = self.store.add({"type": "empty"})
+        held_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.store.add_pending_offset(1)
+        self.assertEqual(
+            [False, True, True, False],
+            self.store.are_pending([id1, id2, held_id, 123456789]),
+        )
+
     def test_get_session_id_returns_the_same_id_for_the_same_scope(self):
         """We get the same id returned from get_session_id when we used the
         same scope.
@@ -751,6 +1336,8 @@ class MessageStoreTest(LandscapeTest):
             fh.write(
                 dumps({b"type": b"data", b"data": b"A thing", b"api": b"3.2"}),
             )
+        # Legacy messages are indexed when the broker starts.
+        self.store._build_index()
         [message] = self.store.get_pending_messages()
         # message keys are decoded
         self.assertIn("type", message)
@@ -761,17 +1348,8 @@ class MessageStoreTest(LandscapeTest):
 
     @mock.patch("landscape.client.broker.store.FILE_MODE", 0o666)
     def test_add_sets_correct_file_permissions(self):
-        # store.add returns the inode for the file with the message
-        message_id = self.store.add({"type": "empty"})
-
-        message_file_path = ""
-        for file_name in self.store._walk_messages():
-            if os.stat(file_name).st_ino == message_id:
-                message_file_path = file_name
-                break
-
-        self.assertTrue(message_file_path)
-        self.assertEqual(message_id, os.stat(message_file_path).st_ino)
+        self.store.add({"type": "empty"})
+        [message_file_path] = self.store._walk_messages()
         self.assertEqual(0o666, os.stat(message_file_path).st_mode & 0o777)
 
     @mock.patch("landscape.client.broker.store.DIRECTORY_MODE", 0o700)
@@ -787,3 +1365,564 @@ class MessageStoreTest(LandscapeTest):
         message_directory = os.path.dirname(file_name)
 
         self.assertEqual(0o700, os.stat(message_directory).st_mode & 0o777)
+
+
+class SQLiteMessageStoreTest(LandscapeTest):
+    def setUp(self):
+        super().setUp()
+        self.filename = self.makeFile()
+        self.persist_filename = self.makeFile()
+        self.store = self.create_store()
+
+    def create_store(self, directory=None):
+        persist = Persist(filename=self.persist_filename)
+        store = SQLiteMessageStore(persist, self.filename, directory=directory)
+        store.set_accepted_types(["empty", "data"])
+        store.add_schema(Message("empty", {}))
+        store.add_schema(Message("data", {"data": Bytes()}))
+        store.add_schema(Message("unaccepted", {"data": Bytes()}))
+        return store
+
+    def test_one_message(self):
+        self.store.add(dict(type="data", data=b"A thing"))
+        self.assertMessages(
+            self.store.get_pending_messages(200),
+            [{"type": "data", "data": b"A thing", "api": b"3.2"}],
+        )
+
+    def test_max_pending_and_offset(self):
+        self.store.set_pending_offset(5)
+        for i in range(15):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        il = [m["data"] for m in self.store.get_pending_messages(5)]
+        self.assertEqual(il, [intToBytes(i) for i in [5, 6, 7, 8, 9]])
+        self.assertEqual(10, self.store.count_pending_messages())
+
+    def test_max_bytes_pending(self):
+        """
+        The messages returned by L{SQLiteMessageStore.get_pending_messages}
+        are limited by their total serialized size, but the first one is
+        always returned.
+        """
+        self.store.add(dict(type="data", data=b"x" * 1000))
+        for i in range(3):
+            self.store.add(dict(type="data", data=b"y" * 100))
+        messages = self.store.get_pending_messages(max_bytes=10)
+        self.assertEqual([b"x" * 1000], [m["data"] for m in messages])
+        self.store.add_pending_offset(1)
+        messages = self.store.get_pending_messages(max_bytes=300)
+        self.assertEqual(2, len(messages))
+
+    def test_max_bytes_pending_skips_decompressing(self):
+        """
+        The message which doesn't fit C{max_bytes} anymore is not
+        decompressed, as its size is stored along with it.
+        """
+        for i in range(3):
+            self.store.add(dict(type="data", data=b"x" * 1000))
+        with mock.patch(
+            "landscape.client.broker.store.decompress_message_data",
+            wraps=decompress_message_data,
+        ) as decompress_mock:
+            messages = self.store.get_pending_messages(max_bytes=2500)
+        self.assertEqual(2, len(messages))
+        self.assertEqual(2, decompress_mock.call_count)
+
+    def test_messages_survive_reopening(self):
+        self.store.add(dict(type="data", data=b"A thing"))
+        self.store.commit()
+        store = self.create_store()
+        self.assertMessages(
+            store.get_pending_messages(),
+            [{"type": "data", "data": b"A thing"}],
+        )
+
+    def test_unaccepted_reaccepted(self):
+        for i in range(10):
+            self.store.add(
+                dict(type=["data", "unaccepted"][i % 2], data=intToBytes(i)),
+            )
+        self.store.set_pending_offset(2)
+        il = [m["data"] for m in self.store.get_pending_messages(20)]
+        self.assertEqual(il, [intToBytes(i) for i in [4, 6, 8]])
+        self.store.set_accepted_types(["data", "unaccepted"])
+        il = [m["data"] for m in self.store.get_pending_messages(20)]
+        self.assertEqual(il, [intToBytes(i) for i in [4, 6, 8, 1, 3, 5, 7, 9]])
+
+    def test_accepted_unaccepted_old(self):
+        for i in range(10):
+            self.store.add(
+                dict(type=["data", "unaccepted"][i % 2], data=intToBytes(i)),
+            )
+        self.store.set_pending_offset(2)
+        self.store.set_accepted_types(["unaccepted"])
+        il = [m["data"] for m in self.store.get_pending_messages(20)]
+        self.assertEqual(il, [intToBytes(i) for i in [1, 3, 5, 7, 9]])
+        self.store.set_pending_offset(0)
+        il = [m["data"] for m in self.store.get_pending_messages(20)]
+        self.assertEqual(il, [intToBytes(i) for i in [1, 3, 5, 7, 9]])
+        self.store.set_accepted_types(["data", "unaccepted"])
+        il = [m["data"] for m in self.store.get_pending_messages(20)]
+        self.assertEqual(
+            il,
+            [intToBytes(i) for i in [1, 3, 5, 7, 9, 0, 2, 4, 6, 8]],
+        )
+
+    def test_delete_old_messages(self):
+        for i in range(5):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        self.store.set_pending_offset(3)
+        self.store.delete_old_messages()
+        self.store.set_pending_offset(0)
+        il = [m["data"] for m in self.store.get_pending_messages()]
+        self.assertEqual(il, [b"3", b"4"])
+
+    def test_delete_all_messages(self):
+        self.store.add({"type": "unaccepted", "data": b"blah"})
+        self.store.add({"type": "empty"})
+        self.store.set_pending_offset(1)
+        self.store.delete_all_messages()
+        self.store.set_accepted_types(["empty", "unaccepted"])
+        self.assertEqual(self.store.get_pending_offset(), 0)
+        self.assertEqual(self.store.get_pending_messages(), [])
+
+    def test_messages_under_limit_not_queried(self):
+        """
+        The oldest messages aren't looked up while there are no more than
+        C{max_messages}, as the stored messages are counted.
+        """
+        self.store._max_messages = 3
+        statements = []
+        self.store.add({"type": "data", "data": b"0"})
+        self.store._db.set_trace_callback(statements.append)
+        for num in range(1, 4):
+            self.store.add({"type": "data", "data": intToBytes(num)})
+        self.assertFalse([sql for sql in statements if "OFFSET" in sql])
+        self.store.add({"type": "data", "data": b"4"})
+        self.assertTrue([sql for sql in statements if "OFFSET" in sql])
+        self.assertEqual(4, self.store._message_count)
+        self.assertEqual(4, self.store._sum_messages()[1])
+
+    def test_messages_over_limit(self):
+        self.store._max_messages = 2
+        for num in range(6):
+            self.store.add({"type": "data", "data": intToBytes(num)})
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [
+                {"type": "data", "data": b"3"},
+                {"type": "data", "data": b"4"},
+                {"type": "data", "data": b"5"},
+            ],
+        )
+
+    def test_messages_over_mb(self):
+        self.store._max_size_mb = 0.01
+        self.store.add({"type": "data", "data": b"a"})
+        self.store.add({"type": "data", "data": b"b" * 15000})
+        self.store.add({"type": "data", "data": b"c"})
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [{"type": "data", "data": b"c"}],
+        )
+
+    def test_messages_over_mb_evicts_delivered_first(self):
+        """
+        When the size limit is exceeded, delivered messages are evicted
+        first and the pending offset is adjusted accordingly.
+        """
+        self.store._max_size_mb = 0.01
+        self.store.add({"type": "data", "data": b"a" * 4000})
+        self.store.add({"type": "data", "data": b"b" * 4000})
+        self.store.add({"type": "data", "data": b"c" * 4000})
+        self.store.set_pending_offset(1)
+        self.store.add({"type": "data", "data": b"d"})
+        self.assertEqual(0, self.store.get_pending_offset())
+        self.assertEqual(
+            [b"b" * 4000, b"c" * 4000, b"d"],
+            [m["data"] for m in self.store.get_pending_messages()],
+        )
+
+    def test_get_messages_total_size(self):
+        """
+        The total size of the messages is accounted for as messages are
+        added and deleted.
+        """
+        for i in range(5):
+            self.store.add(dict(type="data", data=intToBytes(i) * 100))
+        total, count = self.store._sum_messages()
+        self.assertEqual(total, self.store.get_messages_total_size())
+        self.assertEqual(5, count)
+        self.store.set_pending_offset(2)
+        self.store.delete_old_messages()
+        total, count = self.store._sum_messages()
+        self.assertEqual(total, self.store.get_messages_total_size())
+        self.assertEqual(3, count)
+        self.assertEqual(count, self.store._message_count)
+        self.assertEqual(total, self.create_store().get_messages_total_size())
+
+    def test_get_pending_messages_size(self):
+        """
+        The size of the pending messages doesn't include the delivered and
+        the held messages.
+        """
+        sizes = []
+        for i in range(3):
+            size = self.store.get_messages_total_size()
+            self.store.add(dict(type="data", data=intToBytes(i) * (i + 1) * 100))
+            sizes.append(self.store.get_messages_total_size() - size)
+        self.store.add({"type": "unaccepted", "data": b"held"})
+        self.assertEqual(sum(sizes), self.store.get_pending_messages_size())
+        self.store.set_pending_offset(1)
+        self.assertEqual(sum(sizes[1:]), self.store.get_pending_messages_size())
+        self.store.add(dict(type="data", data=b"x"))
+        self.store.set_pending_offset(4)
+        self.assertEqual(0, self.store.get_pending_messages_size())
+        self.store.set_pending_offset(1)
+        self.store.set_accepted_types([])
+        self.assertEqual(0, self.store.get_pending_messages_size())
+
+    def test_get_pending_messages_size_with_new_messages(self):
+        """
+        The size of the new messages is added to the size of the pending
+        messages, which isn't summed up again.
+        """
+        self.store.add({"type": "data", "data": b"a" * 100})
+        size = self.store.get_pending_messages_size()
+        with mock.patch.object(self.store, "_sum_pending_sizes") as sum_sizes:
+            self.store.add({"type": "data", "data": b"b" * 100})
+            self.store.add({"type": "unaccepted", "data": b"held"})
+            self.assertEqual(2 * size, self.store.get_pending_messages_size())
+        sum_sizes.assert_not_called()
+
+    def test_get_pending_messages_size_with_offset_past_messages(self):
+        """
+        New messages don't count as pending if the pending offset is past
+        them.
+        """
+        self.store.add({"type": "data", "data": b"a"})
+        self.store.set_pending_offset(1)
+        self.store.delete_old_messages()
+        self.assertEqual(0, self.store.get_pending_messages_size())
+        self.store.add({"type": "data", "data": b"b"})
+        self.assertEqual(0, self.store.get_pending_messages_size())
+        self.store.add({"type": "data", "data": b"c"})
+        self.assertEqual(
+            self.store.get_messages_total_size() // 2,
+            self.store.get_pending_messages_size(),
+        )
+
+    def test_is_pending(self):
+        message_id = self.store.add({"type": "empty"})
+        held_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.assertTrue(self.store.is_pending(message_id))
+        self.store.add_pending_offset(1)
+        self.assertFalse(self.store.is_pending(message_id))
+        self.assertTrue(self.store.is_pending(held_id))
+        self.assertFalse(self.store.is_pending(12345))
+
+    def test_are_pending(self):
+        """
+        The L{SQLiteMessageStore.are_pending} method tells which of the given
+        messages are pending, in the given order.
+        """
+        id1 = self.store.add({"type": "empty"})
+        id2 = self.store.add({"type": "empty"})
+        held_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.store.add_pending_offset(1)
+        self.assertEqual(
+            [False, True, True, False],
+            self.store.are_pending([id1, id2, held_id, 12345]),
+        )
+        self.store.add_pending_offset(1)
+        self.assertEqual([False, True], self.store.are_pending([id2, held_id]))
+
+    def test_add_many(self):
+        """
+        The L{SQLiteMessageStore.add_many} method inserts all the given
+        messages in a single transaction and returns their identifiers.
+        """
+        message_ids = self.store.add_many(
+            [
+                {"type": "data", "data": b"1"},
+                {"type": "unaccepted", "data": b"2"},
+                {"type": "data", "data": b"3"},
+            ],
+        )
+        self.assertEqual(3, len(set(message_ids)))
+        self.assertEqual([True, True, True], self.store.are_pending(message_ids))
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [{"type": "data", "data": b"1"}, {"type": "data", "data": b"3"}],
+        )
+        self.assertEqual(2, self.store.count_pending_messages())
+
+    def test_compression(self):
+        """
+        With compression enabled, the message rows hold compressed data,
+        which is read back transparently.
+        """
+        self.store._compress = True
+        message = {"type": "data", "data": b"x" * 1000}
+        self.store.add(message)
+        self.assertTrue(self.store.get_messages_total_size() < 1000)
+        self.assertMessages(self.store.get_pending_messages(), [message])
+
+    def test_message_id_survives_unholding(self):
+        message_id = self.store.add({"type": "unaccepted", "data": b"x"})
+        self.store.set_accepted_types(["unaccepted"])
+        self.assertTrue(self.store.is_pending(message_id))
+        self.store.set_pending_offset(1)
+        self.assertFalse(self.store.is_pending(message_id))
+
+    def test_broken_message(self):
+        self.log_helper.ignore_errors(ValueError)
+        message_id = self.store.add({"type": "empty"})
+        self.store.add({"type": "data", "data": b"ok"})
+        self.store._db.execute(
+            "UPDATE message SET data=? WHERE id=?", (b"garbage", message_id)
+        )
+        self.store._db.commit()
+        self.assertMessages(
+            self.store.get_pending_messages(),
+            [{"type": "data", "data": b"ok"}],
+        )
+        self.assertFalse(self.store.is_pending(message_id))
+        self.assertEqual(1, self.store.count_pending_messages())
+
+    def test_migrate_directory(self):
+        """
+        Messages of a L{MessageStore} are moved into the database with
+        their order and flags preserved, and their files are removed.
+        """
+        directory = self.makeDir()
+        persist = Persist(filename=self.persist_filename)
+        old_store = MessageStore(persist, directory, 3)
+        old_store.set_accepted_types(["empty", "data"])
+        old_store.add_schema(Message("empty", {}))
+        old_store.add_schema(Message("data", {"data": Bytes()}))
+        old_store.add_schema(Message("unaccepted", {"data": Bytes()}))
+        for i in range(6):
+            old_store.add(
+                dict(type=["data", "unaccepted"][i % 3 == 2], data=intToBytes(i)),
+            )
+        old_store.set_pending_offset(1)
+        old_store.commit()
+
+        store = self.create_store(directory=directory)
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"1", b"3", b"4"])
+        self.assertFalse(os.path.exists(directory))
+        self.assertFalse(os.path.exists(directory + ".migrating"))
+        store.set_accepted_types(["data", "unaccepted"])
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"1", b"3", b"4", b"2", b"5"])
+
+    def test_switch_to_directory_backend(self):
+        """
+        Without a database to migrate, the pending offset of the SQLite
+        backend isn't applied to the messages of a L{MessageStore} created
+        afterwards.
+        """
+        for i in range(10):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        self.store.set_pending_offset(10)
+        self.store.commit()
+
+        persist = Persist(filename=self.persist_filename)
+        with mock.patch("logging.warning") as warning:
+            store = MessageStore(persist, self.makeDir())
+        warning.assert_called_once()
+        store.add_schema(Message("data", {"data": Bytes()}))
+        store.set_accepted_types(["data"])
+        for i in range(5):
+            store.add(dict(type="data", data=intToBytes(i)))
+        self.assertEqual(5, store.count_pending_messages())
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [intToBytes(i) for i in range(5)])
+
+    def create_directory_store(self, directory):
+        persist = Persist(filename=self.persist_filename)
+        store = MessageStore(persist, directory, 3, database=self.filename)
+        store.add_schema(Message("data", {"data": Bytes()}))
+        store.add_schema(Message("unaccepted", {"data": Bytes()}))
+        return store
+
+    def add_switched_messages(self):
+        """Queue messages to be migrated to the directory backend."""
+        message_ids = [
+            self.store.add(dict(type="data", data=intToBytes(i)))
+            for i in range(5)
+        ]
+        held_id = self.store.add(dict(type="unaccepted", data=b"held"))
+        self.store.add(dict(type="data", data=b"5"))
+        self.store.set_pending_offset(3)
+        self.store.commit()
+        return message_ids, held_id
+
+    def test_switch_to_directory_backend_migrates(self):
+        """
+        The messages queued in the database are migrated to the directory
+        backend in order, keeping their flags and identifiers, and the
+        database is removed.
+        """
+        message_ids, held_id = self.add_switched_messages()
+        directory = self.makeDir()
+
+        store = self.create_directory_store(directory)
+        self.assertEqual(3, store.count_pending_messages())
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"3", b"4", b"5"])
+        self.assertEqual(
+            [False, False, False, True, True, True],
+            store.are_pending(message_ids + [held_id]),
+        )
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(directory + ".unmigrating"))
+        self.assertNotEqual(held_id, store.add(dict(type="data", data=b"6")))
+
+        store.set_accepted_types(["data", "unaccepted"])
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"3", b"4", b"5", b"6", b"held"])
+
+    def test_switch_to_directory_backend_interrupted(self):
+        """
+        If the migration to the directory backend is interrupted before or
+        after the database is renamed aside, it's resumed on the next run.
+        """
+        for calls in (1, 2):
+            self.store.delete_all_messages()
+            self.add_switched_messages()
+            directory = self.makeDir()
+            rename = os.rename
+            renames = []
+
+            def interrupted_rename(src, dst, calls=calls):
+                renames.append(src)
+                if len(renames) == calls:
+                    raise SystemExit()
+                return rename(src, dst)
+
+            with mock.patch("os.rename", side_effect=interrupted_rename):
+                self.assertRaises(
+                    SystemExit,
+                    self.create_directory_store,
+                    directory,
+                )
+
+            store = self.create_directory_store(directory)
+            il = [m["data"] for m in store.get_pending_messages()]
+            self.assertEqual(il, [b"3", b"4", b"5"])
+            self.assertFalse(os.path.exists(self.filename + ".migrated"))
+            store.commit()
+            self.store = self.create_store()
+
+    def test_switch_to_directory_backend_with_messages(self):
+        """
+        The messages of the database aren't migrated to a directory backend
+        which already holds some, and the database is kept.
+        """
+        self.add_switched_messages()
+        directory = self.makeDir()
+        os.makedirs(os.path.join(directory, "0"))
+        with open(os.path.join(directory, "0", "0"), "wb") as fd:
+            fd.write(dumps({"type": "data", "data": b"old", "api": b"3.2"}))
+
+        with mock.patch("logging.warning") as warning:
+            store = self.create_directory_store(directory)
+        warning.assert_called_once()
+        store.set_accepted_types(["data"])
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"old"])
+        self.assertTrue(os.path.exists(self.filename))
+
+    def test_switch_back_to_sqlite_backend(self):
+        """
+        Switching back to the SQLite backend drops the messages left in the
+        database, and the pending offset applies to the migrated messages.
+        """
+        for i in range(10):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        self.store.set_pending_offset(10)
+        self.store.commit()
+        directory = self.makeDir()
+        self.create_legacy_store(directory, 5)
+        persist = Persist(filename=self.persist_filename)
+        persist.set("message-store.pending_offset", 2)
+        persist.save()
+
+        store = self.create_store(directory=directory)
+        self.assertEqual(3, store.count_pending_messages())
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [b"2", b"3", b"4"])
+
+    def test_backend_unchanged(self):
+        """The pending offset is kept when the backend doesn't change."""
+        for i in range(10):
+            self.store.add(dict(type="data", data=intToBytes(i)))
+        self.store.set_pending_offset(4)
+        self.store.commit()
+
+        store = self.create_store()
+        self.assertEqual(6, store.count_pending_messages())
+
+    def create_legacy_store(self, directory, count, persist_filename=None):
+        persist = Persist(filename=persist_filename or self.persist_filename)
+        old_store = MessageStore(persist, directory, 3)
+        old_store.add_schema(Message("data", {"data": Bytes()}))
+        old_store.set_accepted_types(["data"])
+        for i in range(count):
+            old_store.add(dict(type="data", data=intToBytes(i)))
+        old_store.commit()
+
+    def test_migrate_directory_interrupted_before_commit(self):
+        """
+        If the migration is interrupted before the messages are committed
+        to the database, they're all migrated on the next run.
+        """
+        directory = self.makeDir()
+        self.create_legacy_store(directory, 5)
+
+        with mock.patch.object(
+            SQLiteMessageStore,
+            "_insert_legacy_messages",
+            side_effect=SystemExit,
+        ):
+            self.assertRaises(SystemExit, self.create_store, directory)
+
+        store = self.create_store(directory=directory)
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [intToBytes(i) for i in range(5)])
+        self.assertFalse(os.path.exists(directory + ".migrating"))
+
+    def test_migrate_directory_interrupted_after_commit(self):
+        """
+        If the migration is interrupted while the migrated files are being
+        removed, the next run removes the rest of them without inserting
+        the messages again.
+        """
+        directory = self.makeDir()
+        self.create_legacy_store(directory, 5)
+        real_unlink = os.unlink
+        calls = []
+
+        def unlink(path, *args, **kwargs):
+            calls.append(path)
+            if len(calls) == 3:
+                raise SystemExit()
+            return real_unlink(path, *args, **kwargs)
+
+        with mock.patch("os.unlink", side_effect=unlink):
+            self.assertRaises(SystemExit, self.create_store, directory)
+        self.assertEqual(3, len(calls))
+
+        store = self.create_store(directory=directory)
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [intToBytes(i) for i in range(5)])
+        self.assertFalse(os.path.exists(directory + ".migrating"))
+
+        # New messages in the directory are migrated again later on.
+        self.create_legacy_store(directory, 2, self.makeFile())
+        store = self.create_store(directory=directory)
+        il = [m["data"] for m in store.get_pending_messages()]
+        self.assertEqual(il, [intToBytes(i) for i in range(5)] + [b"0", b"1"])
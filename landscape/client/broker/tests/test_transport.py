@@ -1,3 +1,4 @@
+import gzip
 import os
 
 from twisted.internet import reactor
@@ -35,6 +36,53 @@ class DataCollectingResource(resource.Resource):
         return bpickle.dumps("Great.")
 
 
+class CompressionCapableResource(resource.Resource):
+    """Stand-in for a server able to decode gzip-compressed requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.encodings = []
+        self.payloads = []
+
+    def getChild(self, request, name):  # noqa: N802
+        return self
+
+    def render(self, request):
+        content = request.content.read()
+        encoding = request.getHeader("content-encoding")
+        if encoding == "gzip":
+            content = gzip.decompress(content)
+        self.encodings.append(encoding)
+        self.payloads.append(bpickle.loads(content))
+        request.setHeader("accept-encoding", "gzip")
+        return bpickle.dumps(
+            {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+        )
+
+
+class LengthRequiringResource(resource.Resource):
+    """Stand-in for a server which doesn't accept chunked requests."""
+
+    def __init__(self):
+        super().__init__()
+        self.transfer_encodings = []
+        self.payloads = []
+
+    def getChild(self, request, name):  # noqa: N802
+        return self
+
+    def render(self, request):
+        transfer_encoding = request.getHeader("transfer-encoding")
+        self.transfer_encodings.append(transfer_encoding)
+        if transfer_encoding is not None:
+            request.setResponseCode(411)
+            return b""
+        self.payloads.append(bpickle.loads(request.content.read()))
+        return bpickle.dumps(
+            {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+        )
+
+
 class HTTPTransportTest(LandscapeTest):
     helpers = [LogKeeperHelper]
 
@@ -114,6 +162,154 @@ class HTTPTransportTest(LandscapeTest):
         """
         return self.request_with_payload(payload="проба")
 
+    def test_request_compression(self):
+        """
+        Once the server advertises that it accepts gzip-compressed requests,
+        the following payloads are sent compressed.
+        """
+        resource = CompressionCapableResource()
+        port = reactor.listenTCP(
+            0,
+            server.Site(resource),
+            interface="127.0.0.1",
+        )
+        self.ports.append(port)
+        transport = HTTPTransport(
+            None,
+            f"http://localhost:{port.getHost().port:d}/",
+        )
+        payload = {"messages": [{"type": "test", "data": "x" * 1000}]}
+
+        def exchange_twice():
+            transport.exchange(payload, computer_id="34")
+            return transport.exchange(payload, computer_id="34")
+
+        result = deferToThread(exchange_twice)
+
+        def got_result(response):
+            self.assertEqual("3.2", response["server-api"])
+            self.assertEqual([None, "gzip"], resource.encodings)
+            self.assertEqual([payload, payload], resource.payloads)
+
+        result.addCallback(got_result)
+        return result
+
+    def test_request_streaming(self):
+        """
+        Payloads can be sent with chunked transfer encoding. If the server
+        requires the length of the request instead, the following payloads
+        are sent as a whole right away.
+        """
+        resource = LengthRequiringResource()
+        port = reactor.listenTCP(
+            0,
+            server.Site(resource),
+            interface="127.0.0.1",
+        )
+        self.ports.append(port)
+        transport = HTTPTransport(
+            None,
+            f"http://localhost:{port.getHost().port:d}/",
+            stream_requests=True,
+        )
+        payload = {"messages": [{"type": "test", "data": "x" * 1000}]}
+
+        def exchange_twice():
+            transport.exchange(payload, computer_id="34")
+            return transport.exchange(payload, computer_id="34")
+
+        result = deferToThread(exchange_twice)
+
+        def got_result(response):
+            self.assertEqual("3.2", response["server-api"])
+            self.assertEqual(["chunked", None, None], resource.transfer_encodings)
+            self.assertEqual([payload, payload], resource.payloads)
+            self.assertIn(
+                "Server failed chunked request with HTTP 411, sending it whole.",
+                self.logfile.getvalue(),
+            )
+
+        result.addCallback(got_result)
+        return result
+
+    def test_set_url_resets_request_streaming(self):
+        """
+        Requests are streamed again when the server URL changes.
+        """
+        transport = HTTPTransport(
+            None,
+            "http://example/ooga",
+            stream_requests=True,
+        )
+        transport._stream_requests = False
+        transport.set_url("http://example/message-system")
+        self.assertTrue(transport._stream_requests)
+
+    def test_requests_not_streamed_by_default(self):
+        """
+        Requests are sent as a whole, with their length, by default.
+        """
+        resource = LengthRequiringResource()
+        port = reactor.listenTCP(
+            0,
+            server.Site(resource),
+            interface="127.0.0.1",
+        )
+        self.ports.append(port)
+        transport = HTTPTransport(
+            None,
+            f"http://localhost:{port.getHost().port:d}/",
+        )
+        payload = {"messages": [{"type": "test", "data": "x" * 1000}]}
+
+        result = deferToThread(transport.exchange, payload, computer_id="34")
+
+        def got_result(response):
+            self.assertEqual("3.2", response["server-api"])
+            self.assertEqual([None], resource.transfer_encodings)
+
+        result.addCallback(got_result)
+        return result
+
+    def test_connection_reuse(self):
+        """
+        Subsequent exchanges reuse the connection opened by the first one.
+        """
+        resource = CompressionCapableResource()
+        port = reactor.listenTCP(
+            0,
+            server.Site(resource),
+            interface="127.0.0.1",
+        )
+        self.ports.append(port)
+        transport = HTTPTransport(
+            None,
+            f"http://localhost:{port.getHost().port:d}/",
+        )
+        self.addCleanup(transport.session.close)
+
+        def exchange_twice():
+            transport.exchange({"messages": []}, computer_id="34")
+            return transport.exchange({"messages": []}, computer_id="34")
+
+        result = deferToThread(exchange_twice)
+
+        def got_result(response):
+            self.assertEqual(2, transport.session.requests)
+            self.assertEqual(1, transport.session.connections)
+
+        result.addCallback(got_result)
+        return result
+
+    def test_set_url_resets_request_compression(self):
+        """
+        Compression is negotiated again when the server URL changes.
+        """
+        transport = HTTPTransport(None, "http://example/ooga")
+        transport._request_encoding = "gzip"
+        transport.set_url("http://example/message-system")
+        self.assertIsNone(transport._request_encoding)
+
     def test_ssl_verification_positive(self):
         """
         The client transport should complete an upload of messages to
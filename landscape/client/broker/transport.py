@@ -5,19 +5,45 @@ from dataclasses import asdict
 
 from landscape import SERVER_API
 from landscape.client.exchange import exchange_messages
+from landscape.lib.fetch import CurlSession
 
 
 class HTTPTransport:
     """Transport makes a request to exchange message data over HTTP.
 
+    Request bodies are sent uncompressed until the server advertises, with
+    an C{Accept-Encoding} header in its responses, that it can decode
+    compressed ones. With C{stream_requests}, they're sent as they're
+    serialized, with chunked transfer encoding, until the server answers
+    that it doesn't support chunked requests.
+
+    Requests go through a long-lived L{CurlSession}, so that connections,
+    DNS lookups and TLS sessions are reused across exchanges.
+
     @param url: URL of the remote Landscape server message system.
     @param pubkey: SSH public key used for secure communication.
+    @param session: The L{CurlSession} to use, by default a new one.
+    @param stream_requests: Whether to try sending requests with chunked
+        transfer encoding.
     """
 
-    def __init__(self, reactor, url, pubkey=None):
+    def __init__(
+        self,
+        reactor,
+        url,
+        pubkey=None,
+        session=None,
+        stream_requests=False,
+    ):
         self._reactor = reactor
         self._url = url
         self._pubkey = pubkey
+        self._request_encoding = None
+        self._try_stream_requests = stream_requests
+        self._stream_requests = stream_requests
+        if session is None:
+            session = CurlSession()
+        self.session = session
 
     def get_url(self):
         """Get the URL of the remote message system."""
@@ -26,6 +52,9 @@ class HTTPTransport:
     def set_url(self, url):
         """Set the URL of the remote message system."""
         self._url = url
+        # We don't know what the new server supports yet.
+        self._request_encoding = None
+        self._stream_requests = self._try_stream_requests
 
     def exchange(
         self,
@@ -53,10 +82,16 @@ class HTTPTransport:
                 computer_id=computer_id,
                 exchange_token=exchange_token,
                 server_api=message_api.decode(),
+                request_encoding=self._request_encoding,
+                stream_request=self._stream_requests,
+                session=self.session,
             )
         except Exception:
             return None
 
+        self._request_encoding = response.request_encoding
+        self._stream_requests = response.stream_requests
+
         # Return `ServerResponse` as a dictionary
         #  converting the field names back to kebab case
         #  which (imo) is better than mixing snake_case & kebab-case
@@ -70,8 +105,16 @@ class HTTPTransport:
 class FakeTransport:
     """Fake transport for testing purposes."""
 
-    def __init__(self, reactor=None, url=None, pubkey=None):
+    def __init__(
+        self,
+        reactor=None,
+        url=None,
+        pubkey=None,
+        session=None,
+        stream_requests=False,
+    ):
         self._pubkey = pubkey
+        self.session = session
         self.payloads = []
         self.responses = []
         self._current_response = 0
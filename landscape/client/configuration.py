@@ -18,6 +18,7 @@ import textwrap
 from argparse import SUPPRESS
 from urllib.parse import urlparse
 
+from landscape.client.broker.amp import RemoteBrokerConnector
 from landscape.client.broker.config import BrokerConfiguration
 from landscape.client.broker.registration import Identity
 from landscape.client.broker.service import BrokerService
@@ -28,6 +29,7 @@ from landscape.client.environment import (
     IS_SNAP,
     USER,
 )
+from landscape.client.reactor import LandscapeReactor
 from landscape.client.registration import (
     ClientRegistrationInfo,
     RegistrationException,
@@ -123,6 +125,7 @@ class LandscapeSetupConfiguration(BrokerConfiguration):
         "registration_sent",
         "show",
         "show_json",
+        "exchange_stats",
     )
 
     # Whether or not config option will be shown in config dumps
@@ -146,6 +149,7 @@ class LandscapeSetupConfiguration(BrokerConfiguration):
         "registration_sent",
         "show",
         "show_json",
+        "exchange_stats",
     )
 
     encoding = "utf-8"
@@ -327,6 +331,12 @@ class LandscapeSetupConfiguration(BrokerConfiguration):
             action="store_true",
             help="Outputs all configuration data as JSON.",
         )
+        parser.add_argument(
+            "--exchange-stats",
+            action="store_true",
+            help="Outputs statistics about the last message exchanges of "
+            "the running client.",
+        )
         return parser
 
 
@@ -917,6 +927,70 @@ def configuration_dump_json(config):
     return json.dumps(conf_dump)
 
 
+# The exchange statistics measuring durations, in the order of the phases.
+EXCHANGE_STATS_DURATIONS = (
+    "build",
+    "dump",
+    "network",
+    "decode",
+    "dispatch",
+    "exchange",
+)
+
+
+def get_exchange_stats(config, reactor=None):
+    """
+    Return the message exchange statistics of the running broker, or C{None}
+    if it can't be reached.
+    """
+    if reactor is None:
+        reactor = LandscapeReactor()
+    connector = RemoteBrokerConnector(reactor, config)
+    results = []
+
+    def got_remote(remote):
+        result = remote.get_exchange_stats()
+        result.addCallback(results.append)
+        result.addBoth(lambda ignored: connector.disconnect())
+        return result
+
+    def get_stats():
+        result = connector.connect(max_retries=0, quiet=True)
+        result.addCallback(got_remote)
+        result.addErrback(lambda failure: None)
+        result.addCallback(lambda ignored: reactor.call_later(0, reactor.stop))
+
+    reactor.call_when_running(get_stats)
+    reactor.run()
+    return results[0] if results else None
+
+
+def exchange_stats_text(stats):
+    """
+    Return the statistics returned by L{get_exchange_stats} as a plain text
+    table, durations first.
+    """
+    columns = ("count", "mean", "p50", "p90", "p99", "max")
+    lines = ["{:<18}".format("") + "".join(f"{c:>10}" for c in columns)]
+    names = [name for name in EXCHANGE_STATS_DURATIONS if name in stats]
+    names += sorted(set(stats) - set(EXCHANGE_STATS_DURATIONS))
+    for name in names:
+        summary = stats[name]
+        cells = []
+        for column in columns:
+            value = summary.get(column)
+            if value is None:
+                cells.append("-")
+            elif column == "count":
+                cells.append(f"{value:d}")
+            elif name in EXCHANGE_STATS_DURATIONS:
+                cells.append(f"{value:.3f}s")
+            else:
+                cells.append(f"{value:.0f}")
+        lines.append(f"{name:<18}" + "".join(f"{c:>10}" for c in cells))
+    return "\n".join(lines)
+
+
 def set_secure_id(config, new_id, insecure_id=None):
     """Persists a secure id in the identity data file. This is used to indicate
     whether we are currently in the process of registering.
@@ -982,6 +1056,13 @@ def main(args, print=print):  # noqa: C901
         print(conf_dump)
         sys.exit(0)
 
+    if config.exchange_stats:
+        stats = get_exchange_stats(config)
+        if stats is None:
+            sys.exit("Couldn't connect to the running client.")
+        print(exchange_stats_text(stats))
+        sys.exit(0)
+
     already_registered = registration_sent(config)
 
     if config.is_registered or config.registration_sent:
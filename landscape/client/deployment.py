@@ -248,13 +248,17 @@ class Configuration(BaseConfiguration):
             delay *= 2
 
 
-def get_versioned_persist(service):
+def get_versioned_persist(service, backend=None):
     """Get a L{Persist} database with upgrade rules applied.
 
     Load a L{Persist} database for the given C{service} and upgrade or
     mark as current, as necessary.
+
+    @param backend: The L{Persist} backend to use, the default one if
+        C{None}.
     """
     persist = Persist(
+        backend=backend,
         filename=service.persist_filename,
         user=USER,
         group=GROUP,
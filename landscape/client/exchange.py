@@ -4,7 +4,10 @@ Server instance.
 
 import logging
 import time
+import zlib
+from collections.abc import Iterator
 from dataclasses import dataclass
+from functools import partial
 from pprint import pformat
 from typing import Any
 
@@ -12,9 +15,20 @@ import pycurl
 
 from landscape import SERVER_API, VERSION
 from landscape.lib import bpickle
-from landscape.lib.fetch import fetch
+from landscape.lib.fetch import CurlSession, HTTPCodeError, fetch
 from landscape.lib.format import format_delta
 
+# Request body encodings we can produce, in order of preference, mapped to
+# factories of the compressors producing them.
+REQUEST_ENCODINGS = {
+    "gzip": partial(zlib.compressobj, wbits=zlib.MAX_WBITS | 16),
+    "deflate": zlib.compressobj,
+}
+
+# HTTP status codes with which servers and proxies fail chunked requests when
+# they don't support them: Bad Request, Length Required and Not Implemented.
+CHUNKED_REQUEST_ERRORS = (400, 411, 501)
+
 
 @dataclass
 class ServerResponse:
@@ -26,6 +40,85 @@ class ServerResponse:
     client_accepted_types_hash: bytes | None = None
     next_exchange_token: bytes | None = None
     next_expected_sequence: int | None = None
+    request_encoding: str | None = None
+    stats: dict[str, float] | None = None
+    stream_requests: bool = False
+
+
+def negotiate_request_encoding(accept_encoding: str | None) -> str | None:
+    """Pick the encoding to use for request bodies.
+
+    :param accept_encoding: The `Accept-Encoding` header sent by the server
+        in its responses, advertising the encodings it can decode in
+        requests (see RFC 7694).
+    :return: The preferred encoding among the ones supported by both sides,
+        or `None` if requests must be sent unencoded.
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = set()
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        _, _, quality = params.partition("q=")
+        try:
+            if quality and float(quality) == 0:
+                continue  # Explicitly refused.
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+
+    for encoding in REQUEST_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class PayloadEncoder:
+    """Serialize a payload as a request body, in chunks, as it's being sent.
+
+    Iterating over the encoder serializes the payload incrementally, and
+    compresses each chunk as soon as it's produced if a `request_encoding` is
+    given, so that neither the serialized nor the compressed payload is ever
+    held in memory as a whole.
+
+    :param payload: The object to send. It must be `bpickle`-compatible.
+    :param request_encoding: One of `REQUEST_ENCODINGS`, if any.
+    :ivar size: The size of the uncompressed payload serialized so far.
+    :ivar encoded_size: The size of the body produced so far.
+    :ivar dump_time: The seconds spent serializing and compressing so far.
+    """
+
+    def __init__(self, payload: dict, request_encoding: str | None = None):
+        self.payload = payload
+        self.request_encoding = request_encoding
+        self.size = 0
+        self.encoded_size = 0
+        self.dump_time = 0.0
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.size = self.encoded_size = 0
+        self.dump_time = 0.0
+        compressor = None
+        if self.request_encoding is not None:
+            compressor = REQUEST_ENCODINGS[self.request_encoding]()
+        start_time = time.time()
+        for chunk in bpickle.iter_dumps(self.payload):
+            self.size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                self.encoded_size += len(chunk)
+                self.dump_time += time.time() - start_time
+                yield chunk
+                start_time = time.time()
+        if compressor is not None:
+            chunk = compressor.flush()
+            self.encoded_size += len(chunk)
+            self.dump_time += time.time() - start_time
+            yield chunk
+        else:
+            self.dump_time += time.time() - start_time
 
 
 def exchange_messages(
@@ -36,6 +129,9 @@ def exchange_messages(
     computer_id: str | None = None,
     exchange_token: bytes | None = None,
     server_api: str = SERVER_API.decode(),
+    request_encoding: str | None = None,
+    stream_request: bool = False,
+    session: CurlSession | None = None,
 ) -> ServerResponse:
     """Sends `payload` via HTTP(S) to `server_url`, parsing and returning the
     response.
@@ -47,11 +143,24 @@ def exchange_messages(
     :param computer_id: The computer ID to send the message as.
     :param exchange_token: Token included in the exchange to prove client
         identity.
+    :param request_encoding: One of `REQUEST_ENCODINGS` to compress the
+        request body with, as previously negotiated with the server. If the
+        server rejects it, the request is sent again unencoded.
+    :param stream_request: Whether to send the body as it's serialized, with
+        chunked transfer encoding. If the server fails the request with one
+        of `CHUNKED_REQUEST_ERRORS`, e.g. as it requires a `Content-Length`,
+        it's sent again with the whole body.
+    :param session: A `CurlSession` to send the request with, reusing its
+        connections. By default a new connection is opened.
+    :return: The server response, whose `request_encoding` and
+        `stream_requests` tell how to send the next requests. Its `stats`
+        hold the time in seconds spent serializing the payload (`dump`),
+        talking to the server (`network`) and deserializing the response
+        (`decode`), and the number of `bytes-sent` and `bytes-received`.
     """
     start_time = time.time()
     logging.debug(f"Sending payload:\n{pformat(payload)}")
 
-    data = bpickle.dumps(payload)
     headers = {
         "X-Message-API": server_api,
         "User-Agent": f"landscape-client/{VERSION}",
@@ -64,31 +173,86 @@ def exchange_messages(
     if exchange_token:
         headers["X-Exchange-Token"] = exchange_token.decode()
 
-    curl = pycurl.Curl()
+    response_headers = {}
 
-    try:
-        response_bytes = fetch(
+    def post(encoder):
+        if encoder.request_encoding is None:
+            headers.pop("Content-Encoding", None)
+        else:
+            headers["Content-Encoding"] = encoder.request_encoding
+        body = encoder if stream_request else b"".join(encoder)
+        response_headers.clear()
+        if session is not None:
+            return session.fetch(
+                server_url,
+                post=True,
+                data=body,
+                headers=headers,
+                cainfo=cainfo,
+                response_headers=response_headers,
+            )
+        return fetch(
             server_url,
             post=True,
-            data=data,
+            data=body,
             headers=headers,
             cainfo=cainfo,
-            curl=curl,
+            curl=pycurl.Curl(),
+            response_headers=response_headers,
         )
+
+    encoder = PayloadEncoder(payload, request_encoding)
+    try:
+        while True:
+            try:
+                response_bytes = post(encoder)
+                break
+            except HTTPCodeError as error:
+                if error.http_code == 415 and encoder.request_encoding:
+                    # The server doesn't accept encoded requests anymore, e.g.
+                    # it was downgraded or we're now talking to a proxy.
+                    logging.warning(
+                        f"Server rejected {encoder.request_encoding} request, "
+                        "sending it unencoded."
+                    )
+                    encoder = PayloadEncoder(payload)
+                elif (
+                    error.http_code in CHUNKED_REQUEST_ERRORS and stream_request
+                ):
+                    # Not all servers and proxies support chunked requests.
+                    # Other errors, e.g. when the server is overloaded, are
+                    # left to the exchange backoff.
+                    logging.warning(
+                        f"Server failed chunked request with HTTP "
+                        f"{error.http_code}, sending it whole."
+                    )
+                    stream_request = False
+                else:
+                    raise
     except Exception:
         logging.exception(f"Error contacting the server at {server_url}.")
         raise
 
+    network_time = time.time()
+    if encoder.request_encoding is None:
+        sent = f"{encoder.size} bytes"
+    else:
+        sent = (
+            f"{encoder.encoded_size} bytes ({encoder.size} bytes before "
+            f"{encoder.request_encoding} compression)"
+        )
     logging.info(
-        f"Sent {len(data)} bytes and received {len(response_bytes)} bytes in "
-        f"{format_delta(time.time() - start_time)}"
+        f"Sent {sent} and received {len(response_bytes)} bytes in "
+        f"{format_delta(network_time - start_time)}"
     )
 
+    decode_start_time = time.time()
     try:
         response = bpickle.loads(response_bytes)
     except Exception:
         logging.exception(f"Server returned invalid data: {response_bytes!r}")
         raise
+    decode_time = time.time()
 
     logging.debug(f"Received payload:\n{pformat(response)}")
 
@@ -99,4 +263,13 @@ def exchange_messages(
         response.get("client-accepted-types-hash"),
         response.get("next-exchange-token"),
         response.get("next-expected-sequence"),
+        negotiate_request_encoding(response_headers.get("accept-encoding")),
+        {
+            "dump": encoder.dump_time,
+            "network": network_time - start_time - encoder.dump_time,
+            "decode": decode_time - decode_start_time,
+            "bytes-sent": encoder.encoded_size,
+            "bytes-received": len(response_bytes),
+        },
+        stream_request,
     )
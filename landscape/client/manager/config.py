@@ -20,6 +20,14 @@ ALL_PLUGINS = [
     "FDERecoveryKeyManager",
 ]
 
+# Plugins doing nothing useful until the server accepts the type of message
+# they send, mapped to that type. They are imported only at that point.
+LAZY_PLUGINS = {
+    "KeystoneToken": "keystone-token",
+    "LivePatch": "livepatch",
+    "UbuntuProInfo": "ubuntu-pro-info",
+}
+
 
 class ManagerConfiguration(Configuration):
     """Specialized configuration for the Landscape Manager."""
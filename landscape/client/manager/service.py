@@ -4,7 +4,8 @@ from twisted.python.reflect import namedClass
 
 from landscape.client.amp import ComponentPublisher
 from landscape.client.broker.amp import RemoteBrokerConnector
-from landscape.client.manager.config import ManagerConfiguration
+from landscape.client.broker.client import LazyPlugin
+from landscape.client.manager.config import LAZY_PLUGINS, ManagerConfiguration
 from landscape.client.manager.manager import Manager
 from landscape.client.service import LandscapeService, run_landscape_service
 
@@ -16,6 +17,9 @@ class ManagerService(LandscapeService):
     """
 
     service_name = Manager.name
+    # Build the connector to the broker, which can be replaced by one to a
+    # broker running in the same process.
+    broker_connector_factory = RemoteBrokerConnector
 
     def __init__(self, config):
         super().__init__(config)
@@ -32,10 +36,12 @@ class ManagerService(LandscapeService):
         plugins = []
 
         for plugin_name in self.config.plugin_factories:
+            class_name = f"landscape.client.manager.{plugin_name.lower()}.{plugin_name}"
+            if plugin_name in LAZY_PLUGINS:
+                plugins.append(LazyPlugin(class_name, LAZY_PLUGINS[plugin_name]))
+                continue
             try:
-                plugin = namedClass(
-                    f"landscape.client.manager.{plugin_name.lower()}.{plugin_name}",
-                )
+                plugin = namedClass(class_name)
                 plugins.append(plugin())
             except ModuleNotFoundError:
                 logging.warning(
@@ -68,7 +74,11 @@ class ManagerService(LandscapeService):
                 self.manager.add(plugin)
             return self.broker.register_client(self.service_name)
 
-        self.connector = RemoteBrokerConnector(self.reactor, self.config)
+        self.connector = self.broker_connector_factory(
+            self.reactor,
+            self.config,
+            caller=self.service_name,
+        )
         connected = self.connector.connect()
         return connected.addCallback(start_plugins)
 
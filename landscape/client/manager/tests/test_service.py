@@ -1,9 +1,20 @@
 from unittest import mock
 
-from landscape.client.manager.config import ALL_PLUGINS, ManagerConfiguration
+from twisted.python.reflect import namedClass
+
+from landscape.client.broker.client import LazyPlugin
+from landscape.client.manager.config import (
+    ALL_PLUGINS,
+    LAZY_PLUGINS,
+    ManagerConfiguration,
+)
 from landscape.client.manager.processkiller import ProcessKiller
 from landscape.client.manager.service import ManagerService
-from landscape.client.tests.helpers import FakeBrokerServiceHelper, LandscapeTest
+from landscape.client.tests.helpers import (
+    FakeBrokerServiceHelper,
+    LandscapeTest,
+    get_imported_modules,
+)
 from landscape.lib.testing import FakeReactor
 
 
@@ -45,6 +56,62 @@ class ManagerServiceTest(LandscapeTest):
         [plugin] = self.service.get_plugins()
         self.assertTrue(isinstance(plugin, ProcessKiller))
 
+    def test_lazy_plugins(self):
+        """
+        The plugins listed in C{LAZY_PLUGINS} are not imported until the
+        server accepts their message type.
+        """
+        self.service.config.load(["--manager-plugins", "ProcessKiller, LivePatch"])
+        [_, plugin] = self.service.get_plugins()
+        self.assertIsInstance(plugin, LazyPlugin)
+        self.assertEqual(
+            "landscape.client.manager.livepatch.LivePatch",
+            plugin.class_name,
+        )
+        self.assertEqual("livepatch", plugin.message_type)
+
+    def test_lazy_plugins_message_types(self):
+        """
+        C{LAZY_PLUGINS} maps the lazy plugins to the type of the messages
+        they send, which is also their C{message_type} if they have one.
+        """
+        self.assertEqual(
+            {
+                "KeystoneToken": "keystone-token",
+                "LivePatch": "livepatch",
+                "UbuntuProInfo": "ubuntu-pro-info",
+            },
+            LAZY_PLUGINS,
+        )
+        for plugin_name, message_type in LAZY_PLUGINS.items():
+            plugin = namedClass(
+                f"landscape.client.manager.{plugin_name.lower()}.{plugin_name}",
+            )
+            if hasattr(plugin, "message_type"):
+                self.assertEqual(message_type, plugin.message_type)
+
+    def test_startup_imports(self):
+        """
+        Creating the manager service doesn't import the modules of the lazy
+        plugins, to keep its startup time and memory down.
+        """
+        plugins = ",".join(["ProcessKiller", *LAZY_PLUGINS])
+        code = (
+            "from landscape.client.manager.config import ManagerConfiguration\n"
+            "from landscape.client.manager.service import ManagerService\n"
+            "config = ManagerConfiguration()\n"
+            f"config.load(['-c', {self.config_filename!r}, "
+            f"'--manager-plugins', {plugins!r}])\n"
+            "ManagerService(config)\n"
+        )
+        modules = get_imported_modules(code)
+        self.assertIn("landscape.client.manager.processkiller", modules)
+        for plugin_name in LAZY_PLUGINS:
+            self.assertNotIn(
+                f"landscape.client.manager.{plugin_name.lower()}",
+                modules,
+            )
+
     def test_get_plugins_module_not_found(self):
         """If a module is not found, a warning is logged."""
         self.service.config.load(["--manager-plugins", "TotallyDoesNotExist"])
@@ -23,6 +23,15 @@ ALL_PLUGINS = [
     "CloudInit",
 ]
 
+# Plugins doing nothing useful until the server accepts the type of message
+# they send, mapped to that type. They are imported only at that point.
+LAZY_PLUGINS = {
+    "SwiftUsage": "swift-usage",
+    "CephUsage": "ceph-usage",
+    "SnapServicesMonitor": "snap-services",
+    "CloudInit": "cloud-init",
+}
+
 
 class MonitorConfiguration(Configuration):
     """Specialized configuration for the Landscape Monitor."""
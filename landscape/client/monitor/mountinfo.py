@@ -82,14 +82,11 @@ class MountInfo(MonitorPlugin):
         return None
 
     def send_messages(self, urgent=False):
-        for message in self.create_messages():
-            d = self.registry.broker.send_message(
-                message,
-                self._session_id,
-                urgent=urgent,
-            )
-            if message["type"] == "mount-info":
-                d.addCallback(lambda x: self.persist_mount_info())
+        messages = self.create_messages()
+        d = self.send_message_batch(messages, urgent=urgent)
+        if any(message["type"] == "mount-info" for message in messages):
+            d.addCallback(lambda x: self.persist_mount_info())
+        return d
 
     def exchange(self):
         self.registry.broker.call_if_accepted("mount-info", self.send_messages)
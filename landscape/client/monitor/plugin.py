@@ -37,6 +37,23 @@ class MonitorPlugin(BrokerClientPlugin):
         """An alias for the C{client} attribute."""
         return self.client
 
+    def send_message_batch(self, messages, urgent=False):
+        """Send several messages to the broker in a single call.
+
+        @param messages: A C{list} of messages to queue for delivery.
+        @param urgent: Whether to schedule an urgent exchange.
+        @return: A L{Deferred} firing with the C{list} of identifiers of
+            the queued messages, with C{None} for the ones which were dropped,
+            for example because they don't match their schema.
+        """
+        if not messages:
+            return succeed([])
+        return self.registry.broker.send_messages(
+            messages,
+            self._session_id,
+            urgent=urgent,
+        )
+
 
 class DataWatcher(MonitorPlugin):
     """
@@ -58,7 +75,7 @@ class DataWatcher(MonitorPlugin):
         has not changed since the last call.
         """
         data = self.get_data()
-        if self._persist.get("data") != data:
+        if self._persist.get_view("data") != data:
             self._persist.set("data", data)
             return {"type": self.message_type, self.message_key: data}
 
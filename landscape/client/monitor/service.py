@@ -7,9 +7,11 @@ from twisted.python.reflect import namedClass
 
 from landscape.client.amp import ComponentPublisher
 from landscape.client.broker.amp import RemoteBrokerConnector
-from landscape.client.monitor.config import MonitorConfiguration
+from landscape.client.broker.client import LazyPlugin
+from landscape.client.monitor.config import LAZY_PLUGINS, MonitorConfiguration
 from landscape.client.monitor.monitor import Monitor
 from landscape.client.service import LandscapeService, run_landscape_service
+from landscape.lib.persist import JournalBPickleBackend
 
 
 class MonitorService(LandscapeService):
@@ -19,6 +21,12 @@ class MonitorService(LandscapeService):
     """
 
     service_name = Monitor.name
+    # Build the connector to the broker, which can be replaced by one to a
+    # broker running in the same process.
+    broker_connector_factory = RemoteBrokerConnector
+    # The monitor flushes its persist often, and plugins like
+    # active-process-info keep large snapshots in it.
+    persist_backend_factory = JournalBPickleBackend
 
     def __init__(self, config):
         self.persist_filename = os.path.join(
@@ -43,10 +51,12 @@ class MonitorService(LandscapeService):
         plugins = []
 
         for plugin_name in self.config.plugin_factories:
+            class_name = f"landscape.client.monitor.{plugin_name.lower()}.{plugin_name}"
+            if plugin_name in LAZY_PLUGINS:
+                plugins.append(LazyPlugin(class_name, LAZY_PLUGINS[plugin_name]))
+                continue
             try:
-                plugin = namedClass(
-                    f"landscape.client.monitor.{plugin_name.lower()}.{plugin_name}",
-                )
+                plugin = namedClass(class_name)
                 plugins.append(plugin())
             except ModuleNotFoundError:
                 logging.warning(
@@ -72,7 +82,11 @@ class MonitorService(LandscapeService):
                 self.monitor.add(plugin)
             return self.broker.register_client(self.service_name)
 
-        self.connector = RemoteBrokerConnector(self.reactor, self.config)
+        self.connector = self.broker_connector_factory(
+            self.reactor,
+            self.config,
+            caller=self.service_name,
+        )
         connected = self.connector.connect()
         return connected.addCallback(start_plugins)
 
@@ -72,12 +72,7 @@ class Temperature(MonitorPlugin):
         return messages
 
     def send_messages(self, urgent):
-        for message in self.create_messages():
-            self.registry.broker.send_message(
-                message,
-                self._session_id,
-                urgent=urgent,
-            )
+        return self.send_message_batch(self.create_messages(), urgent=urgent)
 
     def exchange(self, urgent=False):
         self.registry.broker.call_if_accepted(
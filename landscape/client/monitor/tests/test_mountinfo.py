@@ -696,17 +696,21 @@ addr=ennui 0 0
 
         self.reactor.advance(plugin.run_interval)
 
-        with mock.patch.object(self.remote, "send_message"):
+        with mock.patch.object(self.remote, "send_messages"):
             self.reactor.fire(
                 ("message-type-acceptance-changed", "mount-info"),
                 True,
             )
-            self.remote.send_message.assert_called_with(
+            self.remote.send_messages.assert_called_once_with(
                 mock.ANY,
                 mock.ANY,
                 urgent=True,
             )
-            self.assertEqual(self.remote.send_message.call_count, 2)
+            [messages, session_id] = self.remote.send_messages.call_args[0]
+            self.assertEqual(
+                ["mount-info", "free-space"],
+                [message["type"] for message in messages],
+            )
 
     def test_persist_timing(self):
         """Mount info are only persisted when exchange happens.
@@ -1,5 +1,7 @@
 from unittest.mock import ANY, Mock, patch
 
+from twisted.internet.defer import succeed
+
 from landscape.client.monitor.plugin import DataWatcher, MonitorPlugin
 from landscape.client.tests.helpers import LandscapeTest, MonitorHelper
 from landscape.lib.schema import Int
@@ -40,6 +42,40 @@ class MonitorPluginTest(LandscapeTest):
         plugin.register(self.monitor)
         self.reactor.advance(MonitorPlugin.run_interval)
 
+    def test_send_message_batch(self):
+        """
+        L{MonitorPlugin.send_message_batch} sends several messages to the
+        broker with a single call.
+        """
+        self.mstore.set_accepted_types(["test"])
+        plugin = MonitorPlugin()
+        plugin.register(self.monitor)
+        messages = [{"type": "test", "n": 1}, {"type": "test", "n": 2}]
+        with patch.object(
+            self.remote,
+            "send_messages",
+            return_value=succeed([1, 2]),
+        ):
+            result = plugin.send_message_batch(messages, urgent=True)
+            self.remote.send_messages.assert_called_once_with(
+                messages,
+                plugin._session_id,
+                urgent=True,
+            )
+        self.assertEqual([1, 2], self.successResultOf(result))
+
+    def test_send_message_batch_without_messages(self):
+        """
+        L{MonitorPlugin.send_message_batch} doesn't call the broker when
+        there are no messages to send.
+        """
+        plugin = MonitorPlugin()
+        plugin.register(self.monitor)
+        with patch.object(self.remote, "send_messages"):
+            result = plugin.send_message_batch([])
+            self.remote.send_messages.assert_not_called()
+        self.assertEqual([], self.successResultOf(result))
+
     def test_call_on_accepted(self):
         """
         L{MonitorPlugin}-based plugins can provide a callable to call
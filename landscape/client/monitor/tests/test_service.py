@@ -1,10 +1,22 @@
 from unittest.mock import Mock, patch
 
+from twisted.python.reflect import namedClass
+
+from landscape.client.broker.client import LazyPlugin
 from landscape.client.monitor.computerinfo import ComputerInfo
-from landscape.client.monitor.config import ALL_PLUGINS, MonitorConfiguration
+from landscape.client.monitor.config import (
+    ALL_PLUGINS,
+    LAZY_PLUGINS,
+    MonitorConfiguration,
+)
 from landscape.client.monitor.loadaverage import LoadAverage
 from landscape.client.monitor.service import MonitorService
-from landscape.client.tests.helpers import FakeBrokerServiceHelper, LandscapeTest
+from landscape.client.tests.helpers import (
+    FakeBrokerServiceHelper,
+    LandscapeTest,
+    get_imported_modules,
+)
+from landscape.lib.persist import JournalBPickleBackend
 from landscape.lib.testing import FakeReactor
 
 
@@ -29,6 +41,12 @@ class MonitorServiceTest(LandscapeTest):
         """
         self.assertEqual(len(self.service.plugins), len(ALL_PLUGINS))
 
+    def test_persist_backend(self):
+        """
+        The monitor persist journals its changes, since it's flushed often.
+        """
+        self.assertIsInstance(self.service.persist._backend, JournalBPickleBackend)
+
     def test_get_plugins(self):
         """
         If the C{--monitor-plugins} command line option is specified, only the
@@ -41,6 +59,63 @@ class MonitorServiceTest(LandscapeTest):
         self.assertTrue(isinstance(plugins[0], ComputerInfo))
         self.assertTrue(isinstance(plugins[1], LoadAverage))
 
+    def test_lazy_plugins(self):
+        """
+        The plugins listed in C{LAZY_PLUGINS} are not imported until the
+        server accepts their message type.
+        """
+        self.service.config.load(["--monitor-plugins", "ComputerInfo, CloudInit"])
+        [_, plugin] = self.service.get_plugins()
+        self.assertIsInstance(plugin, LazyPlugin)
+        self.assertEqual(
+            "landscape.client.monitor.cloudinit.CloudInit",
+            plugin.class_name,
+        )
+        self.assertEqual("cloud-init", plugin.message_type)
+
+    def test_lazy_plugins_message_types(self):
+        """
+        C{LAZY_PLUGINS} maps the lazy plugins to the type of the messages
+        they send, which is also their C{message_type} if they have one.
+        """
+        self.assertEqual(
+            {
+                "SwiftUsage": "swift-usage",
+                "CephUsage": "ceph-usage",
+                "SnapServicesMonitor": "snap-services",
+                "CloudInit": "cloud-init",
+            },
+            LAZY_PLUGINS,
+        )
+        for plugin_name, message_type in LAZY_PLUGINS.items():
+            plugin = namedClass(
+                f"landscape.client.monitor.{plugin_name.lower()}.{plugin_name}",
+            )
+            if hasattr(plugin, "message_type"):
+                self.assertEqual(message_type, plugin.message_type)
+
+    def test_startup_imports(self):
+        """
+        Creating the monitor service doesn't import the modules of the lazy
+        plugins, to keep its startup time and memory down.
+        """
+        plugins = ",".join(["ComputerInfo", *LAZY_PLUGINS])
+        code = (
+            "from landscape.client.monitor.config import MonitorConfiguration\n"
+            "from landscape.client.monitor.service import MonitorService\n"
+            "config = MonitorConfiguration()\n"
+            f"config.load(['-c', {self.config_filename!r}, "
+            f"'--monitor-plugins', {plugins!r}])\n"
+            "MonitorService(config)\n"
+        )
+        modules = get_imported_modules(code)
+        self.assertIn("landscape.client.monitor.computerinfo", modules)
+        for plugin_name in LAZY_PLUGINS:
+            self.assertNotIn(
+                f"landscape.client.monitor.{plugin_name.lower()}",
+                modules,
+            )
+
     def test_get_plugins_module_not_found(self):
         """If a module is not found, a warning is logged."""
         self.service.config.load(["--monitor-plugins", "TotallyDoesNotExist"])
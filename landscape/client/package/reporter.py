@@ -29,7 +29,7 @@ from landscape.lib.fetch import fetch_async
 from landscape.lib.fs import create_binary_file, touch_file
 from landscape.lib.os_release import parse_os_release
 from landscape.lib.sequenceranges import sequence_to_ranges
-from landscape.lib.twisted_util import gather_results, spawn_process
+from landscape.lib.twisted_util import spawn_process
 
 HASH_ID_REQUEST_TIMEOUT = 7200
 DEFAULT_UNKNOWN_HASHES_PER_REQUEST = 500
@@ -600,15 +600,16 @@ class PackageReporter(PackageTaskHandler):
         now = time.time()
         timeout = now - HASH_ID_REQUEST_TIMEOUT
 
-        def update_or_remove(is_pending, request):
-            if is_pending:
-                # Request is still in the queue.  Update the timestamp.
-                request.timestamp = now
-            elif request.timestamp < timeout:
-                # Request was delivered, and is older than the threshold.
-                request.remove()
+        def update_or_remove(pending, requests):
+            for is_pending, request in zip(pending, requests):
+                if is_pending:
+                    # Request is still in the queue.  Update the timestamp.
+                    request.timestamp = now
+                elif request.timestamp < timeout:
+                    # Request was delivered, and is older than the threshold.
+                    request.remove()
 
-        results = []
+        requests = []
         for request in self._store.iter_hash_id_requests():
             if request.message_id is None:
                 # May happen in some rare cases, when a send_message() is
@@ -616,11 +617,15 @@ class PackageReporter(PackageTaskHandler):
                 # request is removed and so we don't get here.
                 request.remove()
             else:
-                result = self._broker.is_message_pending(request.message_id)
-                result.addCallback(update_or_remove, request)
-                results.append(result)
+                requests.append(request)
+
+        if not requests:
+            return succeed(None)
 
-        return gather_results(results)
+        # Check all the requests with a single round-trip to the broker.
+        message_ids = [request.message_id for request in requests]
+        result = self._broker.are_messages_pending(message_ids)
+        return result.addCallback(update_or_remove, requests)
 
     def request_unknown_hashes(self):
         """Detect available packages for which we have no hash=>id mappings.
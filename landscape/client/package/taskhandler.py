@@ -317,7 +317,12 @@ def run_task_handler(cls, args, reactor=None):
         log_failure(failure)
         finish()
 
-    connector = RemoteBrokerConnector(reactor, config, retry_on_reconnect=True)
+    connector = RemoteBrokerConnector(
+        reactor,
+        config,
+        retry_on_reconnect=True,
+        caller=f"package-{cls.queue_name}",
+    )
     remote = LazyRemoteBroker(connector)
     handler = cls(package_store, package_facade, remote, config, reactor)
     result = Deferred()
@@ -971,6 +971,51 @@ class PackageReporterAptTest(LandscapeTest):
         result = self.reporter.remove_expired_hash_id_requests()
         return result.addCallback(got_result)
 
+    def test_remove_expired_hash_id_requests_checks_all_at_once(self):
+        """
+        The pending state of all the hash-id requests is checked with a
+        single call to the broker.
+        """
+        message_store = self.broker_service.message_store
+        message_store.set_accepted_types(["add-packages"])
+        request1 = self.store.add_hash_id_request([b"hash1"])
+        request1.message_id = message_store.add(
+            {"type": "add-packages", "packages": [], "request-id": request1.id},
+        )
+        request2 = self.store.add_hash_id_request([b"hash2"])
+        request2.message_id = 9999
+        request2.timestamp -= HASH_ID_REQUEST_TIMEOUT
+        initial_timestamp = request1.timestamp
+        are_messages_pending = self.reporter._broker.are_messages_pending
+        calls = []
+
+        def record_call(message_ids):
+            calls.append(message_ids)
+            return are_messages_pending(message_ids)
+
+        self.reporter._broker.are_messages_pending = record_call
+
+        def got_result(result):
+            self.assertEqual([[request1.message_id, 9999]], calls)
+            self.assertTrue(request1.timestamp > initial_timestamp)
+            self.assertRaises(
+                UnknownHashIDRequest,
+                self.store.get_hash_id_request,
+                request2.id,
+            )
+
+        result = self.reporter.remove_expired_hash_id_requests()
+        return result.addCallback(got_result)
+
+    def test_remove_expired_hash_id_requests_without_requests(self):
+        """
+        The broker is not called if there are no hash-id requests to check.
+        """
+        self.reporter._broker.are_messages_pending = mock.Mock()
+        result = self.reporter.remove_expired_hash_id_requests()
+        self.assertIsNone(self.successResultOf(result))
+        self.reporter._broker.are_messages_pending.assert_not_called()
+
     def test_remove_expired_hash_id_request_removes_when_no_message_id(self):
         request = self.store.add_hash_id_request([b"hash1"])
 
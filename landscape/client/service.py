@@ -18,6 +18,8 @@ class LandscapeService(Service):
         generate the bpickle and the Unix socket filenames.
     @ivar config: A L{Configuration} object.
     @ivar reactor: A L{LandscapeReactor} object.
+    @cvar persist_backend_factory: A callable returning the backend of the
+        L{Persist} object, or C{None} to use the default one.
     @ivar persist: A L{Persist} object, if C{persist_filename} is defined.
     @ivar factory: A L{LandscapeComponentProtocolFactory}, it must be provided
         by instances of sub-classes.
@@ -25,12 +27,16 @@ class LandscapeService(Service):
 
     reactor_factory = LandscapeReactor
     persist_filename = None
+    persist_backend_factory = None
 
     def __init__(self, config):
         self.config = config
         self.reactor = self.reactor_factory()
         if self.persist_filename:
-            self.persist = get_versioned_persist(self)
+            backend = None
+            if self.persist_backend_factory is not None:
+                backend = self.persist_backend_factory()
+            self.persist = get_versioned_persist(self, backend)
         if not (self.config is not None and self.config.ignore_sigusr1):
             from twisted.internet import reactor
 
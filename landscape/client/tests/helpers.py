@@ -2,6 +2,7 @@ import os
 import pprint
 import selectors
 import subprocess
+import sys
 import unittest.mock
 from contextlib import contextmanager
 
@@ -312,3 +313,30 @@ sys.stdin.read(1)
     finally:
         sel.close()
         call.kill()
+
+
+def get_imported_modules(code):
+    """
+    Run the given Python code in a new interpreter, and return a C{dict}
+    mapping the names of the modules it imported to their cumulative import
+    time in microseconds, as profiled by C{python -X importtime}.
+    """
+    import landscape
+
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(landscape.__file__))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
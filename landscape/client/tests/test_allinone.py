@@ -0,0 +1,212 @@
+import os
+from functools import partial
+from unittest import mock
+
+from twisted.internet.error import ReactorNotRunning
+from twisted.python.fakepwd import UserDatabase
+
+from landscape.client.allinone import (
+    AllInOneConfiguration,
+    AllInOneService,
+    SharedReactor,
+)
+from landscape.client.broker.service import BrokerService
+from landscape.client.broker.tests.helpers import BrokerConfigurationHelper
+from landscape.client.environment import USER
+from landscape.client.manager.config import ManagerConfiguration
+from landscape.client.manager.service import ManagerService
+from landscape.client.monitor.config import MonitorConfiguration
+from landscape.client.monitor.service import MonitorService
+from landscape.client.tests.helpers import LandscapeTest
+from landscape.lib.testing import FakeReactor
+
+
+class FakeBrokerService(BrokerService):
+    reactor_factory = FakeReactor
+
+
+class FakeMonitorService(MonitorService):
+    reactor_factory = FakeReactor
+
+
+class FakeManagerService(ManagerService):
+    reactor_factory = FakeReactor
+
+
+class FakeAllInOneService(AllInOneService):
+    broker_service_factory = FakeBrokerService
+    monitor_service_factory = FakeMonitorService
+    manager_service_factory = FakeManagerService
+
+
+class FakeTwistedReactor:
+    stopped = 0
+
+    def stop(self):
+        if self.stopped:
+            raise ReactorNotRunning()
+        self.stopped += 1
+
+
+class AllInOneServiceTest(LandscapeTest):
+    helpers = [BrokerConfigurationHelper]
+
+    def setUp(self):
+        super().setUp()
+        with open(self.config_filename, "a") as fh:
+            fh.write(
+                "monitor_plugins = ComputerUptime\nmanager_plugins = ProcessKiller\n",
+            )
+        args = ["-c", self.config_filename]
+        self.config = AllInOneConfiguration()
+        self.config.load(args)
+        self.monitor_config = MonitorConfiguration()
+        self.monitor_config.load(args)
+        self.manager_config = ManagerConfiguration()
+        self.manager_config.load(args)
+        self.service = FakeAllInOneService(
+            self.config,
+            self.monitor_config,
+            self.manager_config,
+        )
+        self.broker = self.service.broker_service.broker
+        [self.monitor_service, self.manager_service] = self.service.client_services
+
+    def test_services(self):
+        """
+        The L{AllInOneService} runs the broker, monitor and manager services,
+        the broker one first.
+        """
+        self.assertEqual(
+            [self.service.broker_service, self.monitor_service, self.manager_service],
+            list(self.service),
+        )
+        self.assertIs(self.service.reactor, self.service.broker_service.reactor)
+
+    def test_monitor_only(self):
+        """The manager service is not run in monitor-only mode."""
+        service = FakeAllInOneService(self.config, self.monitor_config)
+        self.assertEqual(
+            [service.broker_service, service.client_services[0]],
+            list(service),
+        )
+        self.assertIsInstance(service.client_services[0], MonitorService)
+
+    def test_start_service(self):
+        """
+        When started, the monitor and manager register with the broker, which
+        calls them without going through AMP.
+        """
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.monitor_service.reactor.advance(0)
+        self.manager_service.reactor.advance(0)
+
+        self.assertEqual(2, len(self.broker.get_clients()))
+        self.assertEqual(
+            ["manager", "monitor"],
+            sorted(self.broker.received_calls.get_summary()),
+        )
+
+        result = self.broker.get_client("monitor").ping()
+        self.service.reactor.advance(0)
+        self.assertTrue(self.successResultOf(result))
+        summary = self.broker.sent_calls.get_summary()
+        self.assertEqual(1, summary["monitor"]["ping"]["calls"])
+
+    def test_restore_ownership(self):
+        """
+        When running as root, the files of the broker and the monitor are
+        given back to the C{landscape} user and group, but not the ones of
+        the manager.
+        """
+        self.service.startService()
+        self.service.broker_service.message_store.add({"type": "test"})
+        self.service.broker_service.persist.save()
+        self.monitor_service.persist.save()
+        self.service.stopService()
+        manager_file = self.makeFile(
+            "",
+            dirname=self.config.data_path,
+            basename="manager.database",
+        )
+
+        fake_pwd = UserDatabase()
+        fake_pwd.addUser(USER, None, 1234, None, None, None, None)
+        with (
+            mock.patch("os.getuid", return_value=0),
+            mock.patch("landscape.client.allinone.pwd", new=fake_pwd),
+            mock.patch("landscape.client.allinone.grp.getgrnam") as getgrnam,
+            mock.patch("os.lchown") as lchown,
+        ):
+            getgrnam.return_value.gr_gid = 5678
+            self.service.restore_ownership()
+
+        calls = [args for args, kwargs in lchown.call_args_list]
+        self.assertEqual({(1234, 5678)}, {args[1:] for args in calls})
+        owned = {args[0] for args in calls}
+        data_path = self.config.data_path
+        self.assertIn(os.path.join(data_path, "broker.bpickle"), owned)
+        self.assertIn(os.path.join(data_path, "monitor.bpickle"), owned)
+        self.assertNotIn(manager_file, owned)
+        message_store_path = self.config.message_store_path
+        self.assertIn(message_store_path, owned)
+        self.assertIn(os.path.join(message_store_path, "0", "0_h"), owned)
+
+    def test_restore_ownership_not_root(self):
+        """Nothing is changed when not running as root."""
+        with (
+            mock.patch("os.getuid", return_value=1000),
+            mock.patch("os.lchown") as lchown,
+        ):
+            self.service.restore_ownership()
+        lchown.assert_not_called()
+
+    def test_start_service_restores_ownership(self):
+        """
+        The ownership of the files left behind by a previous run is restored
+        before starting the services.
+        """
+        with mock.patch.object(self.service, "restore_ownership") as restore:
+            self.service.startService()
+        self.addCleanup(self.service.stopService)
+        restore.assert_called_once_with()
+
+    def test_events(self):
+        """
+        The C{run} and C{stop} events of the reactor of the broker are fired
+        in the reactors of the other services too.
+        """
+        events = []
+        for service in self.service.client_services:
+            reactor = service.reactor
+            for event_type in ("run", "stop"):
+                reactor.call_on(
+                    event_type,
+                    partial(events.append, service.service_name),
+                )
+        self.service.reactor.fire("run")
+        self.assertEqual(["monitor", "manager"], events)
+        self.service.reactor.fire("stop")
+        self.assertEqual(["monitor", "manager", "monitor", "manager"], events)
+
+
+class SharedReactorTest(LandscapeTest):
+    def test_keep_delayed_calls(self):
+        """
+        Creating a L{SharedReactor} doesn't cancel the calls scheduled in
+        other reactors.
+        """
+        reactor = SharedReactor()
+        call = reactor.call_later(10, lambda: None)
+        self.addCleanup(reactor.cancel_call, call)
+        SharedReactor()
+        self.assertTrue(call.active())
+
+    def test_stop_twice(self):
+        """A L{SharedReactor} can be stopped by several services."""
+        reactor = SharedReactor()
+        reactor._reactor = FakeTwistedReactor()
+        reactor.stop()
+        reactor.stop()
+        self.assertEqual(1, reactor._reactor.stopped)
@@ -5,11 +5,16 @@ from unittest import mock
 from twisted.internet.error import CannotListenError, ConnectError
 from twisted.internet.task import Clock
 
-from landscape.client.amp import ComponentConnector, ComponentPublisher, remote
+from landscape.client.amp import (
+    ComponentConnector,
+    ComponentPublisher,
+    LocalComponentConnector,
+    remote,
+)
 from landscape.client.deployment import Configuration
 from landscape.client.reactor import LandscapeReactor
 from landscape.client.tests.helpers import LandscapeTest, ready_subprocess
-from landscape.lib.amp import MethodCallError
+from landscape.lib.amp import MethodCallError, MethodCallStats
 from landscape.lib.testing import FakeReactor
 
 
@@ -20,6 +25,15 @@ class MockComponent:
     def ping(self):
         return True
 
+    @remote
+    def store(self, value):
+        self.value = value
+        return value
+
+    @remote
+    def fail(self):
+        raise RuntimeError("failed")
+
     def non_remote(self):
         return False
 
@@ -41,10 +55,22 @@ class ComponentPublisherTest(LandscapeTest):
         config.data_path = self.makeDir()
         self.makeDir(path=config.sockets_path)
         self.component = MockComponent()
-        self.publisher = ComponentPublisher(self.component, reactor, config)
+        self.received = MethodCallStats()
+        self.publisher = ComponentPublisher(
+            self.component,
+            reactor,
+            config,
+            stats=self.received,
+        )
         self.publisher.start()
 
-        self.connector = MockComponentConnector(reactor, config)
+        self.sent = MethodCallStats()
+        self.connector = MockComponentConnector(
+            reactor,
+            config,
+            caller="caller",
+            stats=self.sent,
+        )
         connected = self.connector.connect()
         connected.addCallback(lambda remote: setattr(self, "remote", remote))
         return connected
@@ -65,6 +91,18 @@ class ComponentPublisherTest(LandscapeTest):
         failure = self.failureResultOf(result)
         self.assertTrue(failure.check(MethodCallError))
 
+    def test_stats(self):
+        """
+        The calls are accounted for by the connecting side under the name of
+        the component, and by the publishing side under the caller name.
+        """
+        self.assertTrue(self.successResultOf(self.remote.ping()))
+        self.assertEqual(1, self.sent.get_summary()["test"]["ping"]["calls"])
+        self.assertEqual(
+            1,
+            self.received.get_summary()["caller"]["ping"]["calls"],
+        )
+
 
 class ComponentConnectorTest(LandscapeTest):
     def setUp(self):
@@ -142,6 +180,21 @@ class ComponentConnectorTest(LandscapeTest):
         remote = self.successResultOf(deferred)
         self.assertEqual(1.0, remote._factory.factor)
 
+    def test_connect_with_batch_calls(self):
+        """
+        The remote object built by the connector batches its calls if
+        C{batch_calls} is set on the connector.
+        """
+        component = MockComponent()
+        publisher = ComponentPublisher(component, self.reactor, self.config)
+        publisher.start()
+        remote = self.successResultOf(self.connector.connect())
+        self.assertFalse(remote._factory.batchCalls)
+        self.connector.disconnect()
+        self.connector.batch_calls = True
+        remote = self.successResultOf(self.connector.connect())
+        self.assertTrue(remote._factory.batchCalls)
+
     def test_disconnect(self):
         """
         It is possible to call L{ComponentConnector.disconnect} multiple times,
@@ -234,3 +287,76 @@ class ComponentConnectorTest(LandscapeTest):
             self.assertEqual(str(call.pid), os.readlink(lock_path))
             mock_kill.assert_called_with(call.pid, 0)
             reactor._cleanup()
+
+
+class LocalComponentConnectorTest(LandscapeTest):
+    def setUp(self):
+        super().setUp()
+        self.reactor = FakeReactor()
+        self.component = MockComponent()
+        self.sent = MethodCallStats()
+        self.connector = LocalComponentConnector(
+            self.component,
+            self.reactor,
+            Configuration(),
+            caller="caller",
+            stats=self.sent,
+        )
+        self.remote = self.successResultOf(self.connector.connect())
+
+    def test_remote_methods(self):
+        """
+        Methods decorated with @remote are called directly, in a later
+        reactor iteration.
+        """
+        results = []
+        self.remote.ping().addCallback(results.append)
+        self.assertEqual([], results)
+        self.reactor.advance(0)
+        self.assertEqual([True], results)
+
+    def test_protect_non_remote(self):
+        """Methods not decorated with @remote can't be called."""
+        result = self.remote.non_remote()
+        failure = self.failureResultOf(result)
+        self.assertTrue(failure.check(MethodCallError))
+
+    def test_copy_arguments_and_result(self):
+        """
+        The component gets a copy of the arguments and the caller gets a copy
+        of the result, as if they had been serialized.
+        """
+        value = {"key": ["value"]}
+        result = self.remote.store(value)
+        value["key"].append("changed")
+        self.reactor.advance(0)
+        self.assertEqual({"key": ["value"]}, self.component.value)
+        result = self.successResultOf(result)
+        self.assertEqual({"key": ["value"]}, result)
+        self.assertIsNot(self.component.value, result)
+
+    def test_failure(self):
+        """Errors raised by the method result in a L{MethodCallError}."""
+        result = self.remote.fail()
+        self.reactor.advance(0)
+        failure = self.failureResultOf(result)
+        self.assertTrue(failure.check(MethodCallError))
+        self.assertEqual("failed", str(failure.value))
+
+    def test_stats(self):
+        """The calls are accounted for under the name of the component."""
+        self.remote.ping()
+        result = self.remote.fail()
+        self.reactor.advance(0)
+        self.failureResultOf(result)
+        summary = self.sent.get_summary()["test"]
+        self.assertEqual(1, summary["ping"]["calls"])
+        self.assertEqual(0, summary["ping"]["failures"])
+        self.assertEqual(1, summary["fail"]["failures"])
+
+    def test_disconnect(self):
+        """Disconnecting from a local component does nothing."""
+        self.connector.disconnect()
+        result = self.remote.ping()
+        self.reactor.advance(0)
+        self.assertTrue(self.successResultOf(result))
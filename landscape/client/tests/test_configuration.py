@@ -8,8 +8,12 @@ from unittest import mock
 
 from twisted.internet.defer import succeed
 
+from landscape.client.amp import ComponentPublisher
 from landscape.client.broker.registration import Identity
-from landscape.client.broker.tests.helpers import BrokerConfigurationHelper
+from landscape.client.broker.tests.helpers import (
+    BrokerConfigurationHelper,
+    BrokerServerHelper,
+)
 from landscape.client.configuration import (
     EXIT_NOT_REGISTERED,
     ConfigurationError,
@@ -20,7 +24,9 @@ from landscape.client.configuration import (
     bootstrap_tree,
     configuration_dump_json,
     configuration_dump_text,
+    exchange_stats_text,
     get_configuration_dump,
+    get_exchange_stats,
     get_secure_id,
     main,
     print_text,
@@ -2539,6 +2545,97 @@ class ConfigurationDumpTest(LandscapeTest):
         self.assertEqual(0, exception.code)
 
 
+class ExchangeStatsTest(LandscapeTest):
+    """Tests for the C{--exchange-stats} option of C{landscape-config}."""
+
+    helpers = [BrokerServerHelper]
+
+    def test_get_exchange_stats(self):
+        """
+        L{get_exchange_stats} returns the statistics of the running broker.
+        """
+        self.exchanger.exchange()
+        publisher = ComponentPublisher(self.broker, self.reactor, self.config)
+        publisher.start()
+        self.addCleanup(publisher.stop)
+
+        stats = get_exchange_stats(self.config, reactor=self.reactor)
+        self.assertEqual(1, stats["exchange"]["count"])
+
+    def test_get_exchange_stats_not_running(self):
+        """
+        L{get_exchange_stats} returns C{None} if the broker isn't running.
+        """
+        self.assertIsNone(get_exchange_stats(self.config, reactor=self.reactor))
+
+    def test_exchange_stats_text(self):
+        """
+        The statistics are shown as a table, durations first and in seconds.
+        """
+        stats = {
+            "messages-sent": {
+                "count": 2,
+                "total-count": 2,
+                "min": 0,
+                "max": 10,
+                "mean": 5.0,
+                "p50": 0,
+                "p90": 10,
+                "p99": 10,
+            },
+            "network": {
+                "count": 1,
+                "total-count": 1,
+                "min": 1.5,
+                "max": 1.5,
+                "mean": 1.5,
+                "p50": 1.5,
+                "p90": 1.5,
+                "p99": 1.5,
+            },
+            "dispatch": {"count": 0, "total-count": 0},
+        }
+        self.assertEqual(
+            [
+                "                       count      mean       p50       p90"
+                "       p99       max",
+                "network                    1    1.500s    1.500s    1.500s"
+                "    1.500s    1.500s",
+                "dispatch                   0         -         -         -"
+                "         -         -",
+                "messages-sent              2         5         0        10"
+                "        10        10",
+            ],
+            exchange_stats_text(stats).split("\n"),
+        )
+
+    @mock.patch("landscape.client.configuration.get_exchange_stats")
+    def test_exchange_stats_argument(self, get_exchange_stats):
+        """The statistics are printed, and the exit code is 0."""
+        get_exchange_stats.return_value = {}
+        output = []
+        exception = self.assertRaises(
+            SystemExit,
+            main,
+            ["--exchange-stats"],
+            print=output.append,
+        )
+        self.assertEqual(0, exception.code)
+        self.assertEqual([exchange_stats_text({})], output)
+
+    @mock.patch("landscape.client.configuration.get_exchange_stats")
+    def test_exchange_stats_argument_not_running(self, get_exchange_stats):
+        """An error is reported if the broker can't be reached."""
+        get_exchange_stats.return_value = None
+        exception = self.assertRaises(
+            SystemExit,
+            main,
+            ["--exchange-stats"],
+            print=noop_print,
+        )
+        self.assertEqual("Couldn't connect to the running client.", exception.code)
+
+
 class SetSecureIdTest(LandscapeTest):
     """Tests for the `set_secure_id` function."""
 
@@ -1,10 +1,61 @@
 """Tests for the `landscape.client.exchange` utility functions."""
 
+import gzip
+import zlib
 from unittest import TestCase, mock
 
 from landscape import SERVER_API, VERSION
-from landscape.client.exchange import exchange_messages
+from landscape.client.exchange import (
+    PayloadEncoder,
+    exchange_messages,
+    negotiate_request_encoding,
+)
 from landscape.lib import bpickle
+from landscape.lib.fetch import HTTPCodeError
+
+
+class PayloadEncoderTestCase(TestCase):
+    """Tests for the `PayloadEncoder` class."""
+
+    payload = {"messages": [{"type": "data", "data": b"x" * 200000}]}
+
+    def test_unencoded(self):
+        """Without encoding, the chunks are the serialized payload."""
+        encoder = PayloadEncoder(self.payload)
+        chunks = list(encoder)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(bpickle.dumps(self.payload), b"".join(chunks))
+        self.assertEqual(len(bpickle.dumps(self.payload)), encoder.size)
+        self.assertEqual(encoder.size, encoder.encoded_size)
+
+    def test_gzip(self):
+        """The chunks can be compressed with gzip."""
+        encoder = PayloadEncoder(self.payload, "gzip")
+        body = b"".join(encoder)
+        self.assertEqual(bpickle.dumps(self.payload), gzip.decompress(body))
+        self.assertEqual(len(bpickle.dumps(self.payload)), encoder.size)
+        self.assertEqual(len(body), encoder.encoded_size)
+
+    def test_deflate(self):
+        """The chunks can be compressed with deflate."""
+        body = b"".join(PayloadEncoder(self.payload, "deflate"))
+        self.assertEqual(bpickle.dumps(self.payload), zlib.decompress(body))
+
+    def test_incremental(self):
+        """The payload is serialized as the chunks are consumed."""
+        chunks = iter(PayloadEncoder({"messages": [b"x" * 200000, object()]}))
+        self.assertEqual(b"d", next(chunks)[:1])
+        self.assertRaises(ValueError, list, chunks)
+
+    def test_dump_time(self):
+        """
+        The time spent serializing the payload doesn't include the time spent
+        by the consumer of the chunks.
+        """
+        encoder = PayloadEncoder({"messages": []})
+        with mock.patch("time.time", side_effect=[10, 10.5, 12, 12.25]):
+            list(encoder)
+        self.assertEqual(0.75, encoder.dump_time)
 
 
 class ExchangeMessagesTestCase(TestCase):
@@ -49,7 +100,7 @@ class ExchangeMessagesTestCase(TestCase):
         self.fetch_mock.assert_called_once_with(
             "https://my-server.local/message-system",
             post=True,
-            data=bpickle.dumps(payload),
+            data=mock.ANY,
             headers={
                 "X-Message-API": SERVER_API.decode(),
                 "User-Agent": f"landscape-client/{VERSION}",
@@ -59,7 +110,11 @@ class ExchangeMessagesTestCase(TestCase):
             },
             cainfo="mycainfo",
             curl=mock.ANY,
+            response_headers={},
         )
+        body = self.fetch_mock.call_args.kwargs["data"]
+        self.assertEqual(bpickle.dumps(payload), body)
+        self.assertFalse(server_response.stream_requests)
         self.assertEqual(self.logging_mock.debug.call_count, 2)
         self.logging_mock.info.assert_called_once()
         self.logging_mock.exception.assert_not_called()
@@ -99,3 +154,260 @@ class ExchangeMessagesTestCase(TestCase):
         self.logging_mock.exception.assert_called_once_with(
             "Server returned invalid data: b'thisisnotbpickled'"
         )
+
+    def test_request_encoding(self):
+        """If a request encoding is given, the request body is compressed and
+        the sizes before and after compression are logged.
+        """
+        payload = {"messages": [{"type": "my-message-type", "data": "x" * 1000}]}
+        bodies = []
+
+        def fetch(*args, data, **kwargs):
+            bodies.append(data)
+            return bpickle.dumps(
+                {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+            )
+
+        self.fetch_mock.side_effect = fetch
+
+        exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            request_encoding="gzip",
+        )
+
+        kwargs = self.fetch_mock.call_args.kwargs
+        self.assertEqual("gzip", kwargs["headers"]["Content-Encoding"])
+        [body] = bodies
+        self.assertEqual(bpickle.dumps(payload), gzip.decompress(body))
+        [message] = self.logging_mock.info.call_args.args
+        self.assertIn(
+            f"Sent {len(body)} bytes "
+            f"({len(bpickle.dumps(payload))} bytes before gzip compression)",
+            message,
+        )
+
+    def test_stats(self):
+        """The response records how long each phase of the exchange took and
+        how many bytes were sent and received.
+        """
+        payload = {"messages": []}
+        response_bytes = bpickle.dumps(
+            {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+        )
+
+        def fetch(*args, data, **kwargs):
+            list(data)
+            return response_bytes
+
+        self.fetch_mock.side_effect = fetch
+
+        # The payload is serialized from 10.5 to 11 and from 11.5 to 11.75,
+        # while being sent from 10 to 12.
+        times = [10, 10.5, 11, 11.5, 11.75, 12, 12.25, 12.5]
+        with mock.patch("time.time", side_effect=times):
+            server_response = exchange_messages(
+                payload,
+                "https://my-server.local/message-system",
+                stream_request=True,
+            )
+
+        self.assertEqual(
+            {
+                "dump": 0.75,
+                "network": 1.25,
+                "decode": 0.25,
+                "bytes-sent": len(bpickle.dumps(payload)),
+                "bytes-received": len(response_bytes),
+            },
+            server_response.stats,
+        )
+
+    def test_deflate_request_encoding(self):
+        """The request body can be compressed with deflate as well."""
+        payload = {"messages": []}
+        self.fetch_mock.return_value = bpickle.dumps(
+            {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+        )
+
+        exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            request_encoding="deflate",
+        )
+
+        kwargs = self.fetch_mock.call_args.kwargs
+        self.assertEqual("deflate", kwargs["headers"]["Content-Encoding"])
+        body = kwargs["data"]
+        self.assertEqual(bpickle.dumps(payload), zlib.decompress(body))
+
+    def test_request_encoding_rejected(self):
+        """If the server rejects the encoded request with a 415 status, the
+        request is sent again unencoded.
+        """
+        payload = {"messages": []}
+        self.fetch_mock.side_effect = [
+            HTTPCodeError(415, b""),
+            bpickle.dumps(
+                {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+            ),
+        ]
+
+        server_response = exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            request_encoding="gzip",
+        )
+
+        self.assertEqual(2, self.fetch_mock.call_count)
+        kwargs = self.fetch_mock.call_args.kwargs
+        self.assertNotIn("Content-Encoding", kwargs["headers"])
+        self.assertEqual(bpickle.dumps(payload), kwargs["data"])
+        self.assertIsNone(server_response.request_encoding)
+        self.logging_mock.warning.assert_called_once()
+
+    def test_stream_request(self):
+        """The body can be sent as it's serialized."""
+        payload = {"messages": []}
+        self.fetch_mock.return_value = bpickle.dumps(
+            {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+        )
+
+        server_response = exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            stream_request=True,
+        )
+
+        body = self.fetch_mock.call_args.kwargs["data"]
+        self.assertIsInstance(body, PayloadEncoder)
+        self.assertEqual(bpickle.dumps(payload), b"".join(body))
+        self.assertTrue(server_response.stream_requests)
+
+    def test_stream_request_rejected(self):
+        """If the server rejects the chunked request with a 411 status, the
+        request is sent again as a whole, and the following ones should be
+        too.
+        """
+        payload = {"messages": []}
+        self.fetch_mock.side_effect = [
+            HTTPCodeError(411, b""),
+            bpickle.dumps(
+                {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+            ),
+        ]
+
+        server_response = exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            request_encoding="gzip",
+            stream_request=True,
+        )
+
+        self.assertEqual(2, self.fetch_mock.call_count)
+        kwargs = self.fetch_mock.call_args.kwargs
+        self.assertEqual("gzip", kwargs["headers"]["Content-Encoding"])
+        self.assertEqual(bpickle.dumps(payload), gzip.decompress(kwargs["data"]))
+        self.assertFalse(server_response.stream_requests)
+        self.logging_mock.warning.assert_called_once_with(
+            "Server failed chunked request with HTTP 411, sending it whole."
+        )
+
+    def test_stream_request_failed(self):
+        """If the server fails the chunked request as it doesn't support it,
+        the request is sent again as a whole, and the following ones should
+        be too.
+        """
+        payload = {"messages": []}
+        self.fetch_mock.side_effect = [
+            HTTPCodeError(501, b""),
+            bpickle.dumps(
+                {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+            ),
+        ]
+
+        server_response = exchange_messages(
+            payload,
+            "https://my-server.local/message-system",
+            stream_request=True,
+        )
+
+        self.assertEqual(2, self.fetch_mock.call_count)
+        kwargs = self.fetch_mock.call_args.kwargs
+        self.assertEqual(bpickle.dumps(payload), kwargs["data"])
+        self.assertFalse(server_response.stream_requests)
+
+    def test_stream_request_server_error(self):
+        """If the server fails the chunked request with an error unrelated to
+        chunked requests, e.g. as it's overloaded, it's not sent again.
+        """
+        payload = {"messages": []}
+        self.fetch_mock.side_effect = HTTPCodeError(503, b"")
+
+        self.assertRaises(
+            HTTPCodeError,
+            exchange_messages,
+            payload,
+            "https://my-server.local/message-system",
+            stream_request=True,
+        )
+        self.assertEqual(1, self.fetch_mock.call_count)
+
+    def test_whole_request_failed(self):
+        """A failed request which wasn't streamed isn't sent again."""
+        payload = {"messages": []}
+        self.fetch_mock.side_effect = HTTPCodeError(502, b"")
+
+        self.assertRaises(
+            HTTPCodeError,
+            exchange_messages,
+            payload,
+            "https://my-server.local/message-system",
+        )
+        self.assertEqual(1, self.fetch_mock.call_count)
+
+    def test_request_encoding_from_response_headers(self):
+        """The encoding to use for the next requests is negotiated from the
+        `Accept-Encoding` header of the response.
+        """
+
+        def fetch(*args, response_headers, **kwargs):
+            response_headers["accept-encoding"] = "deflate, gzip"
+            return bpickle.dumps(
+                {"server-api": "3.2", "server-uuid": b"uuid", "messages": []},
+            )
+
+        self.fetch_mock.side_effect = fetch
+
+        server_response = exchange_messages(
+            {"messages": []},
+            "https://my-server.local/message-system",
+        )
+
+        self.assertEqual("gzip", server_response.request_encoding)
+
+
+class NegotiateRequestEncodingTestCase(TestCase):
+    """Tests for the `negotiate_request_encoding` function."""
+
+    def test_no_header(self):
+        """Without an `Accept-Encoding` header, requests aren't encoded."""
+        self.assertIsNone(negotiate_request_encoding(None))
+        self.assertIsNone(negotiate_request_encoding(""))
+
+    def test_preferred_encoding(self):
+        """gzip is preferred over deflate."""
+        self.assertEqual("gzip", negotiate_request_encoding("deflate, GZIP"))
+        self.assertEqual("deflate", negotiate_request_encoding("br, deflate"))
+
+    def test_unsupported_encodings(self):
+        """Encodings we can't produce are ignored."""
+        self.assertIsNone(negotiate_request_encoding("br, identity"))
+
+    def test_refused_encodings(self):
+        """Encodings with a zero quality value are refused."""
+        self.assertEqual(
+            "deflate",
+            negotiate_request_encoding("gzip;q=0, deflate;q=0.5"),
+        )
+        self.assertIsNone(negotiate_request_encoding("gzip; q=0.0"))
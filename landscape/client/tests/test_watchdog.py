@@ -20,11 +20,13 @@ from landscape.client.tests.helpers import FakeBrokerServiceHelper, LandscapeTes
 from landscape.client.watchdog import (
     MAXIMUM_CONSECUTIVE_RESTARTS,
     RESTART_BURST_DELAY,
+    AllInOne,
     Broker,
     Daemon,
     ExecutableNotFoundError,
     Manager,
     Monitor,
+    MonitorOnlyAllInOne,
     WatchDog,
     WatchDogConfiguration,
     WatchDogService,
@@ -116,6 +118,19 @@ class WatchDogTest(LandscapeTest):
         WatchDog(config=self.config)
         self.assert_daemons_mocks()
 
+    def test_all_in_one_daemon_construction(self):
+        """
+        In all-in-one mode, the WatchDog sets up a single daemon, which is
+        asked to exit as the broker.
+        """
+        dog = WatchDog(enabled_daemons=[AllInOne], config=self.config)
+        self.assertIsInstance(dog.broker, AllInOne)
+        self.assertEqual([dog.broker], dog.daemons)
+        self.assertEqual("landscape-all-in-one", dog.broker.program)
+        self.broker_factory.assert_not_called()
+        self.monitor_factory.assert_not_called()
+        self.manager_factory.assert_not_called()
+
     def test_limited_daemon_construction(self):
         self.setup_daemons_mocks()
         WatchDog(
@@ -1184,6 +1199,17 @@ class WatchDogOptionsTest(LandscapeTest):
             [Broker, Monitor, Manager],
         )
 
+    def test_all_in_one(self):
+        self.config.load(["--all-in-one"])
+        self.assertEqual(self.config.get_enabled_daemons(), [AllInOne])
+
+    def test_all_in_one_monitor_only(self):
+        self.config.load(["--all-in-one", "--monitor-only"])
+        self.assertEqual(
+            self.config.get_enabled_daemons(),
+            [MonitorOnlyAllInOne],
+        )
+
     def test_default_daemons(self):
         self.config.load([])
         self.assertEqual(
@@ -22,8 +22,9 @@ class UserChanges:
 
     def _refresh(self):
         """Load the previous snapshot and update current data."""
-        self._old_users = self._persist.get("users", {})
-        self._old_groups = self._persist.get("groups", {})
+        # The snapshots can be large, and are only read.
+        self._old_users = self._persist.get_view("users", {})
+        self._old_groups = self._persist.get_view("groups", {})
         self._new_users = self._create_index(
             "username",
             self._provider.get_users(),
@@ -253,6 +253,25 @@ class Manager(Daemon):
     username = "root"
 
 
+class AllInOne(Daemon):
+    """Run the broker, monitor and manager in a single process.
+
+    It has to run as root, like the manager, but it gives the files of the
+    broker and the monitor back to L{USER}. Requests for the daemon are made
+    to the broker it runs.
+    """
+
+    program = "landscape-all-in-one"
+    username = "root"
+
+
+class MonitorOnlyAllInOne(AllInOne):
+    """Run the broker and monitor in a single process."""
+
+    username = USER
+    options = ["--monitor-only"]
+
+
 class WatchedProcessProtocol(ProcessProtocol):
     """
     A process-watching protocol which sends any of its output to the log file
@@ -354,21 +373,44 @@ class WatchDog:
         landscape_reactor = LandscapeReactor()
         if enabled_daemons is None:
             enabled_daemons = [Broker, Monitor, Manager]
+        for all_in_one in [AllInOne, MonitorOnlyAllInOne]:
+            if broker is None and all_in_one in enabled_daemons:
+                broker = all_in_one(
+                    RemoteBrokerConnector(
+                        landscape_reactor,
+                        config,
+                        caller="watchdog",
+                    ),
+                    verbose=verbose,
+                    config=config.config,
+                )
         if broker is None and Broker in enabled_daemons:
             broker = Broker(
-                RemoteBrokerConnector(landscape_reactor, config),
+                RemoteBrokerConnector(
+                    landscape_reactor,
+                    config,
+                    caller="watchdog",
+                ),
                 verbose=verbose,
                 config=config.config,
             )
         if monitor is None and Monitor in enabled_daemons:
             monitor = Monitor(
-                RemoteMonitorConnector(landscape_reactor, config),
+                RemoteMonitorConnector(
+                    landscape_reactor,
+                    config,
+                    caller="watchdog",
+                ),
                 verbose=verbose,
                 config=config.config,
             )
         if manager is None and Manager in enabled_daemons:
             manager = Manager(
-                RemoteManagerConnector(landscape_reactor, config),
+                RemoteManagerConnector(
+                    landscape_reactor,
+                    config,
+                    caller="watchdog",
+                ),
                 verbose=verbose,
                 config=config.config,
             )
@@ -523,9 +565,22 @@ class WatchDogConfiguration(Configuration):
             "useful if you want to run the client as a non-root "
             "user.",
         )
+        parser.add_argument(
+            "--all-in-one",
+            type=convert_arg_to_bool,
+            nargs="?",
+            const=True,
+            default=False,
+            help="Run the broker, monitor and manager in a single process, "
+            "to use less memory.",
+        )
         return parser
 
     def get_enabled_daemons(self):
+        if self.all_in_one:
+            if self.monitor_only:
+                return [MonitorOnlyAllInOne]
+            return [AllInOne]
         daemons = [Broker, Monitor]
         if not self.monitor_only:
             daemons.append(Manager)
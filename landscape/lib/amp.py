@@ -45,9 +45,17 @@ See also::
 for more details about the Twisted AMP protocol.
 """
 
+import time
 from uuid import uuid4
 
-from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.defer import (
+    Deferred,
+    DeferredList,
+    fail,
+    maybeDeferred,
+    succeed,
+)
+from twisted.internet.error import ConnectError
 from twisted.internet.protocol import ReconnectingClientFactory, ServerFactory
 from twisted.protocols.amp import (
     AMP,
@@ -57,10 +65,12 @@ from twisted.protocols.amp import (
     CommandLocator,
     Integer,
     String,
+    UnhandledCommand,
 )
 from twisted.python.failure import Failure
 
 from landscape.lib import bpickle
+from landscape.lib.histogram import RollingHistogram
 
 
 class MethodCallArgument(Argument):
@@ -80,6 +90,45 @@ class MethodCallArgument(Argument):
         return type(inobject) in bpickle.dumps_table
 
 
+class SplitValueMixin:
+    """Split the serialized value of an argument over several AMP keys.
+
+    AMP values can't be longer than C{MAX_VALUE_LENGTH}, so longer values
+    are stored under the argument name followed by the argument name with a
+    C{.1}, C{.2}, etc. suffix.
+    """
+
+    def toBox(self, name, strings, objects, proto):  # noqa: N802
+        value = self.toStringProto(
+            self.retrieve(objects, name.decode("ascii"), proto),
+            proto,
+        )
+        if len(value) > MAX_VALUE_LENGTH:
+            value = memoryview(value)
+        strings[name] = value[:MAX_VALUE_LENGTH]
+        for index, start in enumerate(
+            range(MAX_VALUE_LENGTH, len(value), MAX_VALUE_LENGTH),
+        ):
+            strings[name + b".%d" % (index + 1)] = value[
+                start : start + MAX_VALUE_LENGTH
+            ]
+
+    def fromBox(self, name, strings, objects, proto):  # noqa: N802
+        parts = [strings[name]]
+        key = name + b".1"
+        while key in strings:
+            parts.append(strings[key])
+            key = name + b".%d" % (len(parts))
+        objects[name.decode("ascii")] = self.fromStringProto(
+            b"".join(parts),
+            proto,
+        )
+
+
+class SplitString(SplitValueMixin, String):
+    """A byte string argument which can be longer than C{MAX_VALUE_LENGTH}."""
+
+
 class MethodCallError(Exception):
     """Raised when a L{MethodCall} command fails."""
 
@@ -100,15 +149,71 @@ class MethodCall(Command):
     - C{arguments}: A BPickled binary tuple of the form C{(args, kwargs)},
       where C{args} are the positional arguments to be passed to the method
       and C{kwargs} the keyword ones.
+
+    - C{caller}: Optionally, the name of the calling component, used to
+      account the call in the receiver's L{MethodCallStats}.
+
+    The response holds the BPickled binary C{result} of the method. It's
+    handled as a plain string, so both peers know its size.
     """
 
     arguments = [
         (b"sequence", Integer()),
         (b"method", String()),
         (b"arguments", String()),
+        (b"caller", String(optional=True)),
     ]
 
-    response = [(b"result", MethodCallArgument())]
+    response = [(b"result", String())]
+
+    errors = {MethodCallError: b"METHOD_CALL_ERROR"}
+
+
+class MethodCallBatch(Command):
+    """Call several methods on the object exposed by a L{MethodCallServerFactory}.
+
+    The command arguments have the following semantics:
+
+    - C{calls}: A BPickled binary list of C{(method, arguments)} tuples,
+      one for each method to call, with the same meaning as the arguments of
+      L{MethodCall}.
+
+    - C{caller}: Optionally, the name of the calling component.
+
+    The response holds a BPickled binary C{results} list with a
+    C{(True, result)} tuple for each call that succeeded, C{result} being
+    the BPickled binary result of the method, and a C{(False, error)} one for
+    each call that failed, C{error} being the message of the
+    L{MethodCallError}. The response doesn't wait for the calls that are still
+    running when all the methods have been called, which get a
+    C{(None, sequence)} tuple instead, C{sequence} identifying the
+    L{MethodCallResult} to send to get their result.
+    """
+
+    arguments = [
+        (b"calls", SplitString()),
+        (b"caller", String(optional=True)),
+    ]
+
+    response = [(b"results", SplitString())]
+
+
+class MethodCallResult(Command):
+    """Get the result of a call of a L{MethodCallBatch} that was still running.
+
+    The command arguments have the following semantics:
+
+    - C{sequence}: The integer identifying the call, as sent back in the
+      response of the L{MethodCallBatch}.
+
+    The response holds the BPickled binary C{result} tuple of the call, which
+    is sent once the call is done, as for the other calls in the response of
+    L{MethodCallBatch}.
+    """
+
+    arguments = [(b"sequence", Integer())]
+
+    response = [(b"result", SplitString())]
 
     errors = {MethodCallError: b"METHOD_CALL_ERROR"}
 
@@ -126,31 +231,99 @@ class MethodCallChunk(Command):
 
     - C{chunk}: A portion of the big BPickle C{arguments} string which is
       being split and buffered.
+
+    - C{size}: Optionally, the length of the whole BPickle C{arguments}
+      string, so the receiver can allocate its buffer at once.
     """
 
-    arguments = [(b"sequence", Integer()), (b"chunk", String())]
+    arguments = [
+        (b"sequence", Integer()),
+        (b"chunk", String()),
+        (b"size", Integer(optional=True)),
+    ]
 
     response = [(b"result", Integer())]
 
     errors = {MethodCallError: b"METHOD_CALL_ERROR"}
 
 
+class MethodCallStats:
+    """Statistics about remote method calls, by peer component and method.
+
+    For each method called by or on a peer, this keeps the number of calls
+    and of failed ones, the total size of their serialized arguments and
+    results, and a L{RollingHistogram} of their duration in seconds.
+    """
+
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, peer, method, duration, arguments_size, result_size, failed):
+        """Account for a call.
+
+        @param peer: The name of the peer component, or C{None} if unknown.
+        @param method: The name of the method called.
+        @param duration: The time in seconds the call took.
+        @param arguments_size: The size of the serialized arguments.
+        @param result_size: The size of the serialized result.
+        @param failed: Whether the call failed.
+        """
+        key = (peer or "unknown", method)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {
+                "calls": 0,
+                "failures": 0,
+                "arguments-bytes": 0,
+                "result-bytes": 0,
+                "duration": RollingHistogram(),
+            }
+        stats["calls"] += 1
+        stats["failures"] += int(failed)
+        stats["arguments-bytes"] += arguments_size
+        stats["result-bytes"] += result_size
+        stats["duration"].add(duration)
+
+    def get_summary(self):
+        """
+        Return a C{dict} mapping peer names to C{dict}s mapping the names of
+        their methods to their statistics, with the C{duration} summarized
+        as by L{RollingHistogram.get_summary}.
+        """
+        summary = {}
+        for (peer, method), stats in self._stats.items():
+            stats = dict(stats, duration=stats["duration"].get_summary())
+            summary.setdefault(peer, {})[method] = stats
+        return summary
+
+
 class MethodCallReceiver(CommandLocator):
     """Expose methods of a local object over AMP.
 
     @param obj: The Python object to be exposed.
     @param methods: The list of the object's methods that can be called
          remotely.
+    @param stats: Optionally, the L{MethodCallStats} accounting for the
+         calls received.
+    @param clock: The clock used to forget the results of the calls of
+         L{MethodCallBatch}es that the caller doesn't ask for, by default
+         the reactor.
     """
 
-    def __init__(self, obj, methods):
+    def __init__(self, obj, methods, stats=None, clock=None):
         CommandLocator.__init__(self)
+        if clock is None:
+            from twisted.internet import reactor as clock
         self._object = obj
         self._methods = methods
+        self._stats = stats
+        self._clock = clock
         self._pending_chunks = {}
+        self._pending_results = {}
+        self._result_sequence = 0
 
     @MethodCall.responder
-    def receive_method_call(self, sequence, method, arguments):
+    def receive_method_call(self, sequence, method, arguments, caller=None):
         """Call an object's method with the given arguments.
 
         If a connected client sends a L{MethodCall} for method C{foo_bar}, then
@@ -165,12 +338,16 @@ class MethodCallReceiver(CommandLocator):
            passed to the method. In case this L{MethodCall} has been preceded
            by one or more L{MethodCallChunk}s, C{arguments} is the last chunk
            of data.
+        @param caller: The name of the calling component, if known.
         """
-        chunks = self._pending_chunks.pop(sequence, None)
-        if chunks is not None:
+        pending = self._pending_chunks.pop(sequence, None)
+        if pending is not None:
             # We got some L{MethodCallChunk}s before, this is the last.
-            chunks.append(arguments)
-            arguments = b"".join(chunks)
+            buffer, offset = pending
+            end = offset + len(arguments)
+            buffer[offset:end] = arguments
+            del buffer[end:]
+            arguments = buffer
 
         # Pass the the arguments as-is without reinterpreting strings.
         args, kwargs = bpickle.loads(arguments, as_is=True)
@@ -181,38 +358,148 @@ class MethodCallReceiver(CommandLocator):
         if method not in self._methods:
             raise MethodCallError(f"Forbidden method '{method}'")
 
+        deferred = self._call_method(method, args, kwargs, caller, len(arguments))
+        deferred.addCallback(lambda result: {"result": result})
+        return deferred
+
+    @MethodCallBatch.responder
+    def receive_method_call_batch(self, calls, caller=None):
+        """Call several of the object's methods, see L{MethodCallBatch}.
+
+        The methods are called in order, and the response is sent right
+        after, so that a slow call doesn't hold back the results of the other
+        ones: the caller gets its result with a L{MethodCallResult}.
+        """
+        results = []
+        for method, arguments in bpickle.loads(calls, as_is=True):
+            if method not in self._methods:
+                deferred = fail(MethodCallError(f"Forbidden method '{method}'"))
+            else:
+                # The calls before this one already ran, so an error only
+                # fails this call rather than the whole batch.
+                try:
+                    args, kwargs = bpickle.loads(arguments, as_is=True)
+                except (ValueError, TypeError) as error:
+                    deferred = fail(
+                        MethodCallError(f"Invalid arguments for '{method}': {error}"),
+                    )
+                else:
+                    deferred = self._call_method(
+                        method,
+                        args,
+                        kwargs,
+                        caller,
+                        len(arguments),
+                    )
+            deferred.addCallbacks(
+                lambda result: (True, result),
+                lambda failure: (False, str(failure.value)),
+            )
+            outcome = []
+            deferred.addCallback(outcome.append)
+            if outcome:
+                results.append(outcome[0])
+            else:
+                self._result_sequence += 1
+                # The caller asks for the result right after receiving the
+                # response, forget it if it gave up.
+                expiry = self._clock.callLater(
+                    MethodCallSender.timeout,
+                    self._pending_results.pop,
+                    self._result_sequence,
+                    None,
+                )
+                self._pending_results[self._result_sequence] = (
+                    deferred,
+                    outcome,
+                    expiry,
+                )
+                results.append((None, self._result_sequence))
+        return {"results": bpickle.dumps(results)}
+
+    def clear_pending_results(self):
+        """Forget the calls of L{MethodCallBatch}es still running."""
+        for _, _, expiry in self._pending_results.values():
+            expiry.cancel()
+        self._pending_results.clear()
+
+    @MethodCallResult.responder
+    def receive_method_call_result(self, sequence):
+        """Send the result of a call of a L{MethodCallBatch} once it's done.
+
+        @param sequence: The integer identifying the call, as sent in the
+            response of the L{MethodCallBatch}.
+        """
+        pending = self._pending_results.pop(sequence, None)
+        if pending is None:
+            raise MethodCallError(f"Unknown call {sequence}")
+        deferred, outcome, expiry = pending
+        expiry.cancel()
+        return deferred.addCallback(lambda _: {"result": bpickle.dumps(outcome[0])})
+
+    def _call_method(self, method, args, kwargs, caller, arguments_size):
+        """Call one of the object's methods, accounting for the call.
+
+        @param caller: The name of the calling component, if known, as sent
+            over the wire.
+        @param arguments_size: The size of the serialized arguments.
+        @return: A deferred firing with the serialized result of the
+            method, or failing with a L{MethodCallError}.
+        """
         method_func = getattr(self._object, method)
+        start = time.monotonic()
 
         def handle_result(result):
-            return {"result": self._check_result(result)}
+            record(len(result), False)
+            return result
 
         def handle_failure(failure):
+            record(0, True)
             raise MethodCallError(failure.value)
 
+        def record(result_size, failed):
+            if self._stats is not None:
+                self._stats.record(
+                    caller.decode("utf-8") if caller is not None else None,
+                    method,
+                    time.monotonic() - start,
+                    arguments_size,
+                    result_size,
+                    failed,
+                )
+
         deferred = maybeDeferred(method_func, *args, **kwargs)
-        deferred.addCallback(handle_result)
-        deferred.addErrback(handle_failure)
+        deferred.addCallback(self._dump_result)
+        deferred.addCallbacks(handle_result, handle_failure)
         return deferred
 
     @MethodCallChunk.responder
-    def receive_method_call_chunk(self, sequence, chunk):
+    def receive_method_call_chunk(self, sequence, chunk, size=None):
         """Receive a part of a multi-chunk L{MethodCall}.
 
-        Add the received C{chunk} to the buffer of the L{MethodCall} identified
-        by C{sequence}.
+        Copy the received C{chunk} into the buffer of the L{MethodCall}
+        identified by C{sequence}, which is allocated with the given C{size}
+        when the first chunk is received.
         """
-        self._pending_chunks.setdefault(sequence, []).append(chunk)
+        buffer, offset = self._pending_chunks.get(sequence, (None, 0))
+        if buffer is None:
+            buffer = bytearray(size or 0)
+        end = offset + len(chunk)
+        # This grows the buffer if the size was unknown.
+        buffer[offset:end] = chunk
+        self._pending_chunks[sequence] = (buffer, end)
         return {"result": sequence}
 
-    def _check_result(self, result):
-        """Check that the C{result} we're about to return is serializable.
+    def _dump_result(self, result):
+        """Serialize the C{result} we're about to return.
 
-        @return: The C{result} itself if valid.
+        @return: The BPickled binary C{result}.
         @raises: L{MethodCallError} if C{result} is not serializable.
         """
-        if not MethodCallArgument.check(result):
+        try:
+            return bpickle.dumps(result)
+        except ValueError:
             raise MethodCallError("Non-serializable result")
-        return result
 
 
 class MethodCallSender:
@@ -220,6 +507,12 @@ class MethodCallSender:
 
     @param protocol: A connected C{AMP} protocol.
     @param clock: An object implementing the C{IReactorTime} interface.
+    @param stats: Optionally, the L{MethodCallStats} accounting for the
+        calls sent.
+    @param peer: The name of the peer component the calls are sent to, if
+        known, used to account for them.
+    @param caller: The name of the local component, if known, sent along
+        with the calls so that the peer can account for them.
 
     @ivar timeout: A timeout for remote method class, see L{send_method_call}.
     """
@@ -228,9 +521,24 @@ class MethodCallSender:
 
     _chunk_size = MAX_VALUE_LENGTH
 
-    def __init__(self, protocol, clock):
+    def __init__(self, protocol, clock, stats=None, peer=None, caller=None):
         self._protocol = protocol
         self._clock = clock
+        self._stats = stats
+        self._peer = peer
+        self._caller = caller.encode("utf-8") if caller is not None else None
+
+    def _record(self, method, start, arguments_size, result_size, failed):
+        """Account for a call in our L{MethodCallStats}, if any."""
+        if self._stats is not None:
+            self._stats.record(
+                self._peer,
+                method,
+                self._clock.seconds() - start,
+                arguments_size,
+                result_size,
+                failed,
+            )
 
     def _call_remote_with_timeout(self, command, **kwargs):
         """Send an L{AMP} command that will errback in case of a timeout.
@@ -273,54 +581,167 @@ class MethodCallSender:
             invoked on the remote object. If the remote method itself returns
             a deferred, we fire with the callback value of such deferred.
         """
-        arguments = bpickle.dumps((args, kwargs))
+        return self._send_arguments(method, bpickle.dumps((args, kwargs)))
+
+    def _send_arguments(self, method, arguments):
+        """Send a L{MethodCall} command with the given serialized arguments.
+
+        @param method: The name of the remote method to invoke.
+        @param arguments: The BPickled binary C{(args, kwargs)} tuple.
+
+        @return: A C{Deferred} firing with the return value of the method, see
+            L{send_method_call}.
+        """
+        start = self._clock.seconds()
+        arguments = memoryview(arguments)
+        size = len(arguments)
         sequence = uuid4().int
-        # As we send the method name to remote, we need bytes.
-        method = method.encode("utf-8")
 
-        # Split the given arguments in one or more chunks
-        chunks = [
-            arguments[i : i + self._chunk_size]
-            for i in range(0, len(arguments), self._chunk_size)
+        # If the arguments don't fit in one chunk, send all but the last one
+        # as MethodCallChunks. They're sent without waiting for each other's
+        # response, as the receiver handles them in order.
+        last = (max(size - 1, 0) // self._chunk_size) * self._chunk_size
+        chunk_results = [
+            self._protocol.callRemote(
+                MethodCallChunk,
+                sequence=sequence,
+                chunk=arguments[start : start + self._chunk_size],
+                size=size,
+            )
+            for start in range(0, last, self._chunk_size)
         ]
+        # Should sending a chunk fail, so does the MethodCall.
+        DeferredList(chunk_results, consumeErrors=True)
 
-        result = Deferred()
-        if len(chunks) > 1:
-            # If we have N chunks, send the first N-1 as MethodCallChunk's
-            for chunk in chunks[:-1]:
+        def handle_response(response):
+            result = response["result"]
+            self._record(method, start, size, len(result), False)
+            return bpickle.loads(result)
 
-                def create_send_chunk(sequence, chunk):
-                    def send_chunk(x):
-                        return self._protocol.callRemote(
-                            MethodCallChunk,
-                            sequence=sequence,
-                            chunk=chunk,
-                        )
+        def handle_failure(failure):
+            self._record(method, start, size, 0, True)
+            return failure
+
+        result = self._call_remote_with_timeout(
+            MethodCall,
+            sequence=sequence,
+            # As we send the method name to remote, we need bytes.
+            method=method.encode("utf-8"),
+            arguments=arguments[last:],
+            caller=self._caller,
+        )
+        result.addCallbacks(handle_response, handle_failure)
+        return result
 
-                    return send_chunk
+    def send_method_calls(self, calls):
+        """Send L{MethodCallBatch} commands with the given calls.
 
-                result.addCallback(create_send_chunk(sequence, chunk))
+        The calls still running when the peer responds get their result with
+        a L{MethodCallResult}. If a response from the server is not received
+        within C{self.timeout} seconds, the deferreds of the calls waiting for
+        it will errback with a L{MethodCallError}.
 
-        def send_last_chunk(ignored):
-            chunk = chunks[-1]
-            return self._call_remote_with_timeout(
-                MethodCall,
-                sequence=sequence,
-                method=method,
-                arguments=chunk,
-            )
+        The calls with arguments too big to fit in a single AMP value are
+        sent as L{MethodCall}s instead, split in L{MethodCallChunk}s, and so
+        is a call left alone between them. The other calls made before and
+        after each of them are sent in separate batches, to keep the order.
 
-        result.addCallback(send_last_chunk)
-        result.addCallback(lambda response: response["result"])
-        result.callback(None)
-        return result
+        @param calls: A list of C{(method, args, kwargs)} tuples, see
+            L{send_method_call}.
+
+        @return: A list holding a C{Deferred} for each call, resulting in the
+            value returned by the method or failing with a L{MethodCallError}.
+        """
+        results = []
+        batch = []
+        for method, args, kwargs in calls:
+            arguments = bpickle.dumps((args, kwargs))
+            if len(arguments) <= self._chunk_size:
+                batch.append((method, arguments))
+                continue
+            results.extend(self._send_batch(batch))
+            batch = []
+            results.append(self._send_arguments(method, arguments))
+        results.extend(self._send_batch(batch))
+        return results
+
+    def _send_batch(self, calls):
+        """Send a L{MethodCallBatch} command with the given calls.
+
+        @param calls: A list of C{(method, arguments)} tuples, C{arguments}
+            being the BPickled binary C{(args, kwargs)} tuple of the call. A
+            single call is sent as a L{MethodCall}.
+
+        @return: A list holding a C{Deferred} for each call, see
+            L{send_method_calls}.
+        """
+        if len(calls) < 2:
+            return [
+                self._send_arguments(method, arguments) for method, arguments in calls
+            ]
+        start = self._clock.seconds()
+        results = [Deferred() for _ in calls]
+
+        def handle_response(response):
+            for (method, arguments), (success, value), result in zip(
+                calls,
+                bpickle.loads(response["results"]),
+                results,
+            ):
+                if success is None:
+                    # The call is still running, wait for its result.
+                    deferred = self._call_remote_with_timeout(
+                        MethodCallResult,
+                        sequence=value,
+                    )
+                    deferred.addCallback(
+                        lambda response: bpickle.loads(response["result"]),
+                    )
+                else:
+                    deferred = succeed((success, value))
+                deferred.addCallbacks(
+                    handle_result,
+                    handle_failure,
+                    callbackArgs=(method, arguments),
+                    errbackArgs=(method, arguments),
+                )
+                deferred.chainDeferred(result)
+
+        def handle_result(outcome, method, arguments):
+            success, value = outcome
+            if not success:
+                self._record(method, start, len(arguments), 0, True)
+                raise MethodCallError(value)
+            self._record(method, start, len(arguments), len(value), False)
+            return bpickle.loads(value)
+
+        def handle_failure(failure, method, arguments):
+            self._record(method, start, len(arguments), 0, True)
+            return failure
+
+        def handle_batch_failure(failure):
+            for (method, arguments), result in zip(calls, results):
+                result.errback(handle_failure(failure, method, arguments))
+
+        response = self._call_remote_with_timeout(
+            MethodCallBatch,
+            calls=bpickle.dumps(calls),
+            caller=self._caller,
+        )
+        response.addCallbacks(handle_response, handle_batch_failure)
+        return results
 
 
 class MethodCallServerProtocol(AMP):
     """Receive L{MethodCall} commands over the wire and send back results."""
 
-    def __init__(self, obj, methods):
-        AMP.__init__(self, locator=MethodCallReceiver(obj, methods))
+    def __init__(self, obj, methods, stats=None, clock=None):
+        AMP.__init__(self, locator=MethodCallReceiver(obj, methods, stats, clock))
+
+    def connectionLost(self, reason):  # noqa: N802
+        """Forget the results the peer can't ask for anymore."""
+        self.locator.clear_pending_results()
+        AMP.connectionLost(self, reason)
 
 
 class MethodCallClientProtocol(AMP):
@@ -350,6 +771,11 @@ class RemoteObject:
         """
         self._sender = None
         self._pending_requests = {}
+        # The calls to send in the next MethodCallBatch, and the delayed call
+        # sending it.
+        self._pending_calls = []
+        self._send_pending_calls_call = None
+        self._peer_handles_batches = True
         self._factory = factory
         self._factory.notifyOnConnect(self._handle_connect)
 
@@ -370,6 +796,78 @@ class RemoteObject:
         return send_method_call
 
     def _send_method_call(self, method, args, kwargs, deferred, call=None):
+        """Send a L{MethodCall} command, adding callbacks to handle retries.
+
+        If the factory batches calls, the call is sent right away, and the
+        other ones made in the same reactor iteration are sent together in a
+        L{MethodCallBatch} at the next one.
+        """
+        if not self._factory.batchCalls or not self._peer_handles_batches:
+            self._send_single_method_call(method, args, kwargs, deferred, call)
+            return
+        pending_call = (method, args, kwargs, deferred, call)
+        if self._send_pending_calls_call is not None:
+            # A batch is forming, join it.
+            self._pending_calls.append(pending_call)
+            return
+        if self._factory.fake_connection is None:
+            # Tests simulating a synchronous transport can't wait for the
+            # next reactor iteration, they send each call right away.
+            self._send_pending_calls_call = self._factory.clock.callLater(
+                0,
+                self._send_pending_calls,
+            )
+        self._send_calls([pending_call])
+
+    def _send_pending_calls(self):
+        """Send the calls made since the last reactor iteration."""
+        self._send_pending_calls_call = None
+        pending_calls = self._pending_calls
+        self._pending_calls = []
+        if pending_calls:
+            self._send_calls(pending_calls)
+
+    def _send_calls(self, pending_calls):
+        """Send the given calls, in a L{MethodCallBatch} if more than one."""
+        if self._sender is None:
+            failure = Failure(ConnectError("Not connected"))
+            for method, args, kwargs, deferred, call in pending_calls:
+                self._handle_failure(failure, method, args, kwargs, deferred, call)
+            return
+        results = self._sender.send_method_calls(
+            [(method, args, kwargs) for method, args, kwargs, _, _ in pending_calls],
+        )
+        for (method, args, kwargs, deferred, call), result in zip(
+            pending_calls,
+            results,
+        ):
+            result.addCallback(self._handle_result, deferred, call=call)
+            result.addErrback(
+                self._handle_batch_failure,
+                method,
+                args,
+                kwargs,
+                deferred,
+                call=call,
+            )
+
+        if self._factory.fake_connection is not None:
+            self._factory.fake_connection.flush()
+
+    def _handle_batch_failure(self, failure, method, args, kwargs, deferred, call=None):
+        """Called when a call sent in a L{MethodCallBatch} fails.
+
+        If the peer predates L{MethodCallBatch}, which it didn't run any of
+        the calls of, the call is sent again on its own, and so are further
+        ones. Otherwise the failure is handled as for a L{MethodCall}.
+        """
+        if failure.check(UnhandledCommand):
+            self._peer_handles_batches = False
+            self._send_single_method_call(method, args, kwargs, deferred, call)
+            return
+        self._handle_failure(failure, method, args, kwargs, deferred, call=call)
+
+    def _send_single_method_call(self, method, args, kwargs, deferred, call=None):
         """Send a L{MethodCall} command, adding callbacks to handle retries."""
         result = self._sender.send_method_call(
             method=method,
@@ -465,7 +963,15 @@ class RemoteObject:
 
         @param protocol: The newly connected protocol instance.
         """
-        self._sender = MethodCallSender(protocol, self._factory.clock)
+        self._sender = MethodCallSender(
+            protocol,
+            self._factory.clock,
+            stats=self._factory.stats,
+            peer=self._factory.peer,
+            caller=self._factory.caller,
+        )
+        # The peer might have been upgraded.
+        self._peer_handles_batches = True
         if self._factory.retryOnReconnect:
             self._retry()
 
@@ -489,18 +995,21 @@ class MethodCallServerFactory(ServerFactory):
 
     protocol = MethodCallServerProtocol
 
-    def __init__(self, obj, methods):
+    def __init__(self, obj, methods, stats=None):
         """
         @param object: The object exposed by the L{MethodCallProtocol}s
             instances created by this factory.
         @param methods: A list of the names of the methods that remote peers
             are allowed to call on the C{object} that we publish.
+        @param stats: Optionally, the L{MethodCallStats} accounting for the
+            calls received by the protocols.
         """
         self.object = obj
         self.methods = methods
+        self.stats = stats
 
     def buildProtocol(self, addr):  # noqa: N802
-        protocol = self.protocol(self.object, self.methods)
+        protocol = self.protocol(self.object, self.methods, self.stats)
         protocol.factory = self
         return protocol
 
@@ -524,6 +1033,17 @@ class MethodCallClientFactory(ReconnectingClientFactory):
     @param retryTimeout: A timeout for retrying requests, if the remote object
         can't perform them again successfully within this number of seconds,
         they will errback with a L{MethodCallError}.
+    @ivar batchCalls: If C{True}, the remote object returned by the
+        C{getRemoteObject} method sends the first call it gets in a reactor
+        iteration right away, and the other calls made in the same iteration
+        together in a single L{MethodCallBatch} at the next one. With fake
+        connections set by tests, each call is sent right away.
+    @ivar stats: Optionally, the L{MethodCallStats} accounting for the calls
+        made through the remote object.
+    @ivar peer: The name of the component we connect to, if known, used to
+        account for the calls made.
+    @ivar caller: The name of the local component, if known, sent along with
+        the calls made so that the peer can account for them.
     """
 
     factor = 1.6180339887498948
@@ -534,6 +1054,10 @@ class MethodCallClientFactory(ReconnectingClientFactory):
 
     retryOnReconnect = False  # noqa: N815
     retryTimeout = None  # noqa: N815
+    batchCalls = False  # noqa: N815
+    stats = None
+    peer = None
+    caller = None
 
     # XXX support exposing fake asynchronous connections created by tests, so
     # they can be flushed transparently and emulate a synchronous behavior. See
@@ -32,11 +32,21 @@ This file is modified from the original to work with python3, but should be
 wire compatible and behave the same way (bugs notwithstanding).
 """
 
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
+from functools import partial
+from itertools import chain
 
 dumps_table: dict[type, Callable] = {}
 loads_table: dict[bytes, Callable] = {}
 
+# The approximate size of the chunks yielded by iter_dumps.
+CHUNK_SIZE = 65536
+
+# Type characters as integers, which is what indexing bytes returns.
+_BOOL, _INT, _FLOAT, _LIST, _TUPLE, _DICT, _NONE, _BYTES, _UNICODE = b"bifltdnsu"
+_END = ord(";")
+_COLON = ord(":")
+
 
 def dumps(obj, _dt=dumps_table):
     try:
@@ -45,16 +55,98 @@ def dumps(obj, _dt=dumps_table):
         raise ValueError(f"Unsupported type: {e}")
 
 
+def iter_dumps(obj, chunk_size=CHUNK_SIZE, _dt=dumps_table) -> Iterator[bytes]:
+    """Serialize obj like dumps, yielding the output in chunks.
+
+    Containers are walked with an explicit stack instead of serializing
+    their items recursively, so the whole output is never held in memory.
+    Chunks are about chunk_size bytes long, except the last one and the
+    ones holding a longer byte string.
+
+    @param obj: the object to serialize
+    @param chunk_size: the size above which buffered output is yielded
+    """
+    parts = []
+    size = 0
+    # The iterators over the items left to serialize in each container
+    # being serialized, the innermost last.
+    stack = [iter((obj,))]
+    while stack:
+        for value in stack[-1]:
+            kind = type(value)
+            if kind is dict:
+                parts.append(b"d")
+                stack.append(_iter_dict_items(value))
+                break
+            if kind is list or kind is tuple:
+                parts.append(b"l" if kind is list else b"t")
+                stack.append(iter(value))
+                break
+            if kind is bytes and len(value) >= chunk_size:
+                # Yield long byte strings as they are, instead of copying
+                # them into a new chunk.
+                parts.append(f"s{len(value):d}:".encode())
+                yield b"".join(parts)
+                yield value
+                parts = []
+                size = 0
+                continue
+            try:
+                part = _dt[kind](value)
+            except KeyError as e:
+                raise ValueError(f"Unsupported type: {e}")
+            parts.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield b"".join(parts)
+                parts = []
+                size = 0
+        else:
+            stack.pop()
+            if stack:
+                parts.append(b";")
+    if parts:
+        yield b"".join(parts)
+
+
+def _iter_dict_items(obj):
+    """Iterate over the sorted keys and the values of obj, alternately."""
+    return chain.from_iterable([(key, obj[key]) for key in sorted(obj)])
+
+
+def dump(obj, write, chunk_size=CHUNK_SIZE):
+    """Serialize obj like dumps, passing the output to write in chunks.
+
+    @param obj: the object to serialize
+    @param write: a callable accepting each chunk of the output
+    @param chunk_size: see iter_dumps
+    """
+    for chunk in iter_dumps(obj, chunk_size):
+        write(chunk)
+
+
 def loads(byte_string, _lt=loads_table, as_is=False):
     """Load a serialized byte_string.
 
-    @param byte_string: the serialized data
+    The standard conversion map is handled by L{_load}, which walks the data
+    by index instead of slicing out every type character. Other bytes-like
+    objects are decoded in place through a C{memoryview}, so only the short
+    number and length fields and the decoded values are copied. Custom
+    conversion maps go through the loads_* table instead.
+
+    @param byte_string: the serialized data, as C{bytes} or any other
+        bytes-like object such as a C{bytearray} or a C{memoryview}
     @param _lt: the conversion map
     @param as_is: don't reinterpret dict keys as str
     """
     if not byte_string:
         raise ValueError("Can't load empty string")
     try:
+        if _lt is loads_table:
+            if isinstance(byte_string, (bytes, bytearray)):
+                return _load(byte_string, 0, as_is, byte_string.index)[0]
+            data = memoryview(byte_string).cast("B")
+            return _load(data, 0, as_is, partial(_index, data))[0]
         # To avoid python3 turning byte_string[0] into an int,
         # we slice the bytestring instead.
         return _lt[byte_string[0:1]](byte_string, 0, as_is=as_is)[0]
@@ -64,6 +156,77 @@ def loads(byte_string, _lt=loads_table, as_is=False):
         raise ValueError("Corrupted data")
 
 
+def _index(data, char, pos):
+    """Return the position of C{char} in C{data} from C{pos} on.
+
+    This is C{bytes.index} for a C{memoryview}, which lacks it.
+    """
+    for endpos in range(pos, len(data)):
+        if data[endpos] == char:
+            return endpos
+    raise ValueError("subsection not found")
+
+
+def _load(data, pos, as_is, index):
+    """Load the object serialized at C{pos} in C{data}.
+
+    This behaves like the loads_* functions, but dispatches on the integer
+    value of the type character, so that only the decoded values allocate.
+
+    Reading past the end of C{data} raises the same C{KeyError} as looking
+    up the empty type character in the loads_* table.
+
+    @param data: C{bytes}, a C{bytearray} or a C{memoryview} of bytes.
+    @param index: the C{index} method of C{data}, or L{_index} bound to it.
+    @return: the object and the position right after it.
+    """
+    if pos >= len(data):
+        raise KeyError(b"")
+    tag = data[pos]
+    if tag == _BYTES or tag == _UNICODE:
+        startpos = index(_COLON, pos) + 1
+        step = int(bytes(data[pos + 1 : startpos - 1]))
+        if step < 0:
+            kind = "bytestring" if tag == _BYTES else "unicode"
+            raise ValueError(f"Negative {kind} length: {step}")
+        endpos = startpos + step
+        if tag == _BYTES:
+            # This doesn't copy slices of bytes, only of the other types.
+            return bytes(data[startpos:endpos]), endpos
+        return str(data[startpos:endpos], "utf-8"), endpos
+    if tag == _INT:
+        endpos = index(_END, pos)
+        return int(bytes(data[pos + 1 : endpos])), endpos + 1
+    if tag == _DICT:
+        pos += 1
+        res = {}
+        end = len(data)
+        while pos >= end or data[pos] != _END:
+            key, pos = _load(data, pos, as_is, index)
+            val, pos = _load(data, pos, as_is, index)
+            if not as_is and isinstance(key, bytes):
+                key = key.decode("ascii")
+            res[key] = val
+        return res, pos + 1
+    if tag == _LIST or tag == _TUPLE:
+        pos += 1
+        res = []
+        append = res.append
+        end = len(data)
+        while pos >= end or data[pos] != _END:
+            obj, pos = _load(data, pos, as_is, index)
+            append(obj)
+        return (res if tag == _LIST else tuple(res)), pos + 1
+    if tag == _BOOL:
+        return bool(int(bytes(data[pos + 1 : pos + 2]))), pos + 2
+    if tag == _NONE:
+        return None, pos + 1
+    if tag == _FLOAT:
+        endpos = index(_END, pos)
+        return float(bytes(data[pos + 1 : endpos])), endpos + 1
+    raise KeyError(bytes([tag]))
+
+
 def dumps_bool(obj):
     return (f"b{int(obj):d}").encode()
 
@@ -1,8 +1,9 @@
 import io
 import os
 import sys
+import threading
 from argparse import ArgumentParser
-from logging import warning
+from logging import debug, warning
 
 from twisted.internet.defer import DeferredList
 from twisted.internet.threads import deferToThread
@@ -40,6 +41,33 @@ class PyCurlError(FetchError):
         return self._message
 
 
+class ChunksReader:
+    """Read a request body from an iterable of chunks, in order.
+
+    Chunks are only taken from the iterable once the previous ones were
+    read, so that a generator can produce them as the body is sent, and
+    each chunk is released as soon as it's sent.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = memoryview(b"")
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self._current.tobytes() + b"".join(self._chunks)
+            self._current = memoryview(b"")
+            return data
+        while not self._current:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._current = memoryview(chunk)
+        data = self._current[:size]
+        self._current = self._current[size:]
+        return data.tobytes()
+
+
 def fetch(
     url,
     post=False,
@@ -53,12 +81,16 @@ def fetch(
     follow=True,
     user_agent=None,
     proxy=None,
+    response_headers=None,
+    dns_cache_timeout=0,
 ):
     """Retrieve a URL and return the content.
 
     @param url: The url to be fetched.
     @param post: If true, the POST method will be used (defaults to GET).
-    @param data: Data to be sent to the server as the POST content.
+    @param data: Data to be sent to the server as the POST content. It can
+        be an iterable of byte strings, like a generator, which are sent one
+        after the other as they're produced, with chunked transfer encoding.
     @param headers: Dictionary of header => value entries to be used on the
         request.
     @param curl: A pycurl.Curl instance to use. If not provided, one will be
@@ -70,12 +102,15 @@ def fetch(
     @param follow: If True, follow HTTP redirects (default True).
     @param user_agent: The user-agent to set in the request.
     @param proxy: The proxy url to use for the request.
+    @param response_headers: Optionally, a C{dict} which will be filled with
+        the headers of the response, keyed by their lower-cased name.
+    @param dns_cache_timeout: How many seconds name resolutions are cached
+        by C{curl}, by default they aren't.
     """
     import pycurl
 
-    if not isinstance(data, bytes):
+    if isinstance(data, str):
         data = data.encode("utf-8")
-    output = io.BytesIO(data)
     input = io.BytesIO()
 
     if curl is None:
@@ -86,9 +121,13 @@ def fetch(
     if post:
         curl.setopt(pycurl.POST, True)
 
-        if data:
+        if not isinstance(data, bytes):
+            # The size of the body isn't known until it's all produced.
+            headers = {**headers, "Transfer-Encoding": "chunked"}
+            curl.setopt(pycurl.READFUNCTION, ChunksReader(data).read)
+        elif data:
             curl.setopt(pycurl.POSTFIELDSIZE, len(data))
-            curl.setopt(pycurl.READFUNCTION, output.read)
+            curl.setopt(pycurl.READFUNCTION, io.BytesIO(data).read)
 
     if cainfo and url.startswith("https:"):
         if not os.access(cainfo, os.R_OK):
@@ -124,9 +163,18 @@ def fetch(
     curl.setopt(pycurl.LOW_SPEED_TIME, total_timeout)
     curl.setopt(pycurl.NOSIGNAL, 1)
     curl.setopt(pycurl.WRITEFUNCTION, input.write)
-    curl.setopt(pycurl.DNS_CACHE_TIMEOUT, 0)
+    curl.setopt(pycurl.DNS_CACHE_TIMEOUT, dns_cache_timeout)
     curl.setopt(pycurl.ENCODING, b"gzip,deflate")
 
+    if response_headers is not None:
+
+        def header_function(line):
+            name, sep, value = line.decode("latin-1").partition(":")
+            if sep:
+                response_headers[name.strip().lower()] = value.strip()
+
+        curl.setopt(pycurl.HEADERFUNCTION, header_function)
+
     try:
         curl.perform()
     except pycurl.error as e:
@@ -141,6 +189,81 @@ def fetch(
     return body
 
 
+class CurlSession:
+    """Perform requests reusing connections, DNS lookups and TLS sessions.
+
+    Idle C{curl} handles are kept around, so that their connections can be
+    reused by the following requests, and they all share their DNS and TLS
+    session caches.  Each request takes an idle handle or creates a new one,
+    so a session can be used from several threads at once.
+
+    @param dns_cache_timeout: How many seconds name resolutions are cached.
+    """
+
+    def __init__(self, dns_cache_timeout=300):
+        import pycurl
+
+        self._dns_cache_timeout = dns_cache_timeout
+        self._share = pycurl.CurlShare()
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self._lock = threading.Lock()
+        self._idle_curls = []
+        self.requests = 0
+        self.connections = 0
+
+    def fetch(self, url, **kwargs):
+        """Retrieve a URL and return the content.
+
+        Accepts the same arguments as L{fetch}, except for C{curl}.
+        """
+        import pycurl
+
+        with self._lock:
+            if self._idle_curls:
+                curl = self._idle_curls.pop()
+            else:
+                curl = pycurl.Curl()
+                curl.setopt(pycurl.SHARE, self._share)
+        # Options are sticky, clear the ones set by the previous request.
+        # This keeps live connections and the caches.
+        curl.reset()
+        try:
+            return fetch(
+                url,
+                curl=curl,
+                dns_cache_timeout=self._dns_cache_timeout,
+                **kwargs,
+            )
+        finally:
+            self._record(url, curl.getinfo(pycurl.NUM_CONNECTS))
+            with self._lock:
+                self._idle_curls.append(curl)
+
+    def _record(self, url, new_connections):
+        with self._lock:
+            self.requests += 1
+            self.connections += new_connections
+            requests, connections = self.requests, self.connections
+        if new_connections:
+            state = "Opened a new connection"
+            if url.startswith("https:"):
+                state += " with a TLS handshake"
+        else:
+            state = "Reused a connection"
+        debug(
+            f"{state} to {url} ({connections} connections opened "
+            f"for {requests} requests so far).",
+        )
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            curls, self._idle_curls = self._idle_curls, []
+        for curl in curls:
+            curl.close()
+
+
 def fetch_async(*args, **kwargs):
     """Retrieve a URL asynchronously.
 
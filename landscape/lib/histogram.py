@@ -0,0 +1,52 @@
+from collections import deque
+
+
+class RollingHistogram:
+    """
+    Keeps the distribution of the last samples of a measurement, e.g. the
+    durations of the last exchanges with the server.
+
+    @param size: The number of most recent samples to keep.
+    """
+
+    def __init__(self, size=100):
+        self._samples = deque(maxlen=size)
+        self._total_count = 0
+
+    def add(self, value):
+        """Add a sample, dropping the oldest one if the window is full."""
+        self._samples.append(value)
+        self._total_count += 1
+
+    def get_percentile(self, percentile):
+        """
+        Return the sample below which C{percentile} percent of the samples in
+        the window fall, using the nearest-rank method, or C{None} if there
+        are no samples.
+        """
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        rank = -(-percentile * len(samples) // 100)  # Ceiling division
+        return samples[max(int(rank), 1) - 1]
+
+    def get_summary(self):
+        """
+        Return a C{dict} describing the samples in the window, with their
+        C{count}, C{min}, C{max}, C{mean} and C{p50}, C{p90} and C{p99}
+        percentiles. The C{total-count} is the number of samples ever added.
+        """
+        samples = sorted(self._samples)
+        summary = {"count": len(samples), "total-count": self._total_count}
+        if samples:
+            summary.update(
+                {
+                    "min": samples[0],
+                    "max": samples[-1],
+                    "mean": sum(samples) / len(samples),
+                    "p50": self.get_percentile(50),
+                    "p90": self.get_percentile(90),
+                    "p99": self.get_percentile(99),
+                },
+            )
+        return summary
@@ -23,10 +23,13 @@ import os
 import re
 import shutil
 import sys
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
 
 __all__ = [
     "Persist",
     "BPickleBackend",
+    "JournalBPickleBackend",
     "path_string_to_tuple",
     "path_tuple_to_string",
     "RootedPersist",
@@ -91,6 +94,12 @@ class Persist:
         self._config = self
         self._user = user
         self._group = group
+        # The file holding the hard map as it was before the changes made
+        # to the top-level subtrees in _dirty. With a journaling backend,
+        # _journal holds the records of those changes.
+        self._saved_filepath = None
+        self._dirty = set()
+        self._journal = [] if backend.journaled else None
         self.filename = filename
         if filename is not None and os.path.exists(filename):
             self.load(filename)
@@ -139,6 +148,9 @@ class Persist:
             return False
 
         filepath = os.path.expanduser(filepath)
+        # Unless the file itself is loaded, the next save must write the
+        # whole hard map.
+        self._mark_saved(None)
         if not os.path.isfile(filepath):
             if load_old():
                 return
@@ -152,6 +164,59 @@ class Persist:
             if load_old():
                 return
             raise PersistError(f"Broken configuration file at {filepath}")
+        if self._journal is not None:
+            self._replay_journal(filepath)
+        self._mark_saved(filepath)
+
+    def _mark_saved(self, filepath):
+        """Mark the hard map as being the one saved in C{filepath}."""
+        self._saved_filepath = filepath
+        self._dirty.clear()
+        if self._journal is not None:
+            self._journal = []
+
+    def _record(self, operation, path, *args):
+        """
+        Record a change about to be made to the hard map, marking its
+        top-level subtree as dirty and journaling it if the backend can.
+        """
+        self._dirty.add(path[0])
+        if self._journal is not None:
+            record = (operation, path) + args
+            self._journal.append(self._backend.encode_record(record))
+
+    def is_dirty(self, path=()):
+        """
+        Whether the hard map changed since it was last loaded or saved. If
+        C{path} is given, only changes to its top-level subtree count.
+        """
+        if isinstance(path, str):
+            path = path_string_to_tuple(path)
+        if not path:
+            return bool(self._dirty)
+        return path[0] in self._dirty
+
+    def _replay_journal(self, filepath):
+        """Apply the changes journaled since the hard map was last saved."""
+        records = self._backend.load_journal(filepath)
+        modified = self._modified
+        readonly = self._readonly
+        # Stop recording, the changes are already in the journal.
+        self._journal = None
+        self._readonly = False
+        operations = {"set": self.set, "add": self.add, "remove": self.remove}
+        try:
+            for operation, path, *args in records:
+                try:
+                    operations[operation](path, *args)
+                except Exception:
+                    # Changes are recorded before being made, so this one
+                    # failed in the same way when it was first made.
+                    pass
+        finally:
+            self._journal = []
+            self._modified = modified
+            self._readonly = readonly
 
     def save(self, filepath=None):
         """Save the persist to the given C{filepath}.
@@ -161,12 +226,27 @@ class Persist:
 
         If the destination file already exists, it will be renamed
         to C{<filepath>.old}.
+
+        Saving to the file the persist was last loaded from or saved to does
+        nothing if the hard map didn't change since then. With a journaling
+        backend, it only appends the changes to the journal, until the
+        backend asks for the whole hard map to be saved again.
         """
         if filepath is None:
             if self.filename is None:
                 raise PersistError("Need a filename!")
             filepath = self.filename
         filepath = os.path.expanduser(filepath)
+        if filepath == self._saved_filepath and os.path.isfile(filepath):
+            if not self._dirty:
+                return
+            if self._journal is not None and self._backend.append(
+                filepath,
+                self._journal,
+                self._file_mode,
+            ):
+                self._mark_saved(filepath)
+                return
         if os.path.isfile(filepath):
             os.rename(filepath, filepath + ".old")
         dirname = os.path.dirname(filepath)
@@ -175,12 +255,19 @@ class Persist:
         if dirname and (mode := self._directory_mode) is not None:
             os.chmod(dirname, mode=mode)
         self._backend.save(filepath, self._hardmap, mode=self._file_mode)
+        self._mark_saved(filepath)
 
         if self._user is not None or self._group is not None:
             try:
                 if dirname:
                     shutil.chown(dirname, user=self._user, group=self._group)
                 shutil.chown(filepath, user=self._user, group=self._group)
+                if self._journal is not None:
+                    shutil.chown(
+                        self._backend.get_journal_filename(filepath),
+                        user=self._user,
+                        group=self._group,
+                    )
             except PermissionError:
                 # A persist directory has been selected that can't be owned by
                 # landscape:landscape. This often happens in /tmp for tests,
@@ -190,19 +277,20 @@ class Persist:
     def _traverse(self, obj, path, default=NOTHING, setvalue=NOTHING):
         if setvalue is not NOTHING:
             setvalue = self._backend.copy(setvalue)
-        queue = list(path)
         marker = NOTHING
         newobj = obj
-        while queue:
+        length = len(path)
+        # The index of the next element of the path to traverse.
+        index = 0
+        while index < length:
             obj = newobj
-            elem = queue.pop(0)
+            elem = path[index]
+            index += 1
             newobj = self._backend.get(obj, elem)
             if newobj is NotImplemented:
-                if queue:
-                    path = path[: -len(queue)]
                 raise PersistError(
                     f"Can't traverse {type(obj)!r} "
-                    f"({path_tuple_to_string(path)!r}): {str(obj)!r}",
+                    f"({path_tuple_to_string(path[:index])!r}): {str(obj)!r}",
                 )
             if newobj is marker:
                 break
@@ -214,8 +302,8 @@ class Persist:
                 newobj = default
             else:
                 while True:
-                    if len(queue) > 0:
-                        if type(queue[0]) is int:
+                    if index < length:
+                        if type(path[index]) is int:
                             newvalue = []
                         else:
                             newvalue = {}
@@ -226,10 +314,11 @@ class Persist:
                         raise PersistError(
                             f"Can't traverse {type(obj)!r} with {type(elem)!r}",
                         )
-                    if not queue:
+                    if index == length:
                         break
                     obj = newobj
-                    elem = queue.pop(0)
+                    elem = path[index]
+                    index += 1
         return newobj
 
     def _getvalue(self, path, soft=False, hard=False, weak=False):
@@ -243,10 +332,14 @@ class Persist:
         elif weak:
             value = self._traverse(self._weakmap, path, marker)
         else:
-            value = self._traverse(self._softmap, path, marker)
+            # The soft and weak maps are usually empty, and then only hold
+            # the root path.
+            value = marker
+            if self._softmap or not path:
+                value = self._traverse(self._softmap, path, marker)
             if value is marker:
                 value = self._traverse(self._hardmap, path, marker)
-                if value is marker:
+                if value is marker and (self._weakmap or not path):
                     value = self._traverse(self._weakmap, path, marker)
         return value
 
@@ -277,6 +370,19 @@ class Persist:
             return default
         return self._backend.copy(value)
 
+    def get_view(self, path, default=None, soft=False, hard=False, weak=False):
+        """Like L{get}, but return a read-only view instead of a copy.
+
+        Dicts and lists are wrapped in L{ReadOnlyDict} and L{ReadOnlyList},
+        which give access to the stored values without copying them, so
+        this is cheap even for large snapshots. The view reflects later
+        changes made to the value through the persist.
+        """
+        value = self._getvalue(path, soft, hard, weak)
+        if value is NOTHING:
+            return default
+        return _make_view(value)
+
     def set(self, path, value, soft=False, weak=False):
         assert path
         if isinstance(path, str):
@@ -289,6 +395,7 @@ class Persist:
             self.assert_writable()
             self._modified = True
             map = self._hardmap
+            self._record("set", path, value)
         self._traverse(map, path, setvalue=value)
 
     def add(self, path, value, unique=False, soft=False, weak=False):
@@ -303,6 +410,7 @@ class Persist:
             self.assert_writable()
             self._modified = True
             map = self._hardmap
+            self._record("add", path, value, unique)
         if unique:
             current = self._traverse(map, path)
             if type(current) is list and value in current:
@@ -322,6 +430,10 @@ class Persist:
             self.assert_writable()
             self._modified = True
             map = self._hardmap
+            if value is NOTHING:
+                self._record("remove", path)
+            else:
+                self._record("remove", path, value)
         marker = NOTHING
         while path:
             if value is marker:
@@ -417,6 +529,16 @@ class RootedPersist:
             path = path_string_to_tuple(path)
         return self.parent.get(self.root + path, default, soft, hard, weak)
 
+    def get_view(self, path, default=None, soft=False, hard=False, weak=False):
+        if isinstance(path, str):
+            path = path_string_to_tuple(path)
+        return self.parent.get_view(self.root + path, default, soft, hard, weak)
+
+    def is_dirty(self, path=()):
+        if isinstance(path, str):
+            path = path_string_to_tuple(path)
+        return self.parent.is_dirty(self.root + path)
+
     def set(self, path, value, soft=False, weak=False):
         if isinstance(path, str):
             path = path_string_to_tuple(path)
@@ -450,9 +572,94 @@ class RootedPersist:
         return self.parent.root_at(self.root + path)
 
 
+class ReadOnlyDict(Mapping):
+    """A read-only view of a C{dict} stored in a L{Persist}.
+
+    Nested dicts and lists are returned as views too. Views compare equal
+    to the objects they wrap, and L{copy} returns a mutable deep copy.
+    """
+
+    __slots__ = ("_data",)
+    __hash__ = None
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return _make_view(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __eq__(self, other):
+        return self._data == _unwrap_view(other)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._data!r})"
+
+    def copy(self):
+        return copy.deepcopy(self._data)
+
+
+class ReadOnlyList(Sequence):
+    """A read-only view of a C{list} stored in a L{Persist}.
+
+    See L{ReadOnlyDict}.
+    """
+
+    __slots__ = ("_data",)
+    __hash__ = None
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return _make_view(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, value):
+        return _unwrap_view(value) in self._data
+
+    def __eq__(self, other):
+        return self._data == _unwrap_view(other)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._data!r})"
+
+    def copy(self):
+        return copy.deepcopy(self._data)
+
+
+def _make_view(value):
+    if type(value) is dict:
+        return ReadOnlyDict(value)
+    if type(value) is list:
+        return ReadOnlyList(value)
+    return value
+
+
+def _unwrap_view(value):
+    if type(value) in (ReadOnlyDict, ReadOnlyList):
+        return value._data
+    return value
+
+
 _splitpath = re.compile(r"(\[-?\d+\])|(?<!\\)\.").split
 
 
+# Callers use the same few constant paths over and over, so the parsed
+# paths are cached.
+@lru_cache(maxsize=1024)
 def path_string_to_tuple(path):
     """Convert a L{Persist} path string to a path tuple.
 
@@ -527,6 +734,10 @@ class Backend:
         {'foo': 'bar', 'egg': [10, 2, 3]}
     """
 
+    # Whether the backend can journal the changes to the hard map, see
+    # L{JournalBPickleBackend}.
+    journaled = False
+
     def new(self):
         raise NotImplementedError
 
@@ -642,3 +853,104 @@ class BPickleBackend(Backend):
             fd.write(self._bpickle.dumps(map))
         if mode is not None:
             os.chmod(filepath, mode=mode)
+
+
+class JournalBPickleBackend(BPickleBackend):
+    """
+    A L{BPickleBackend} which saves the changes made to a L{Persist} by
+    appending them to a journal, instead of writing the whole hard map.
+
+    The journal is kept next to the persist file, in C{<filepath>.journal}.
+    It starts with a header identifying the persist file it applies to,
+    followed by the C{set}, C{add} and C{remove} records, each one prefixed
+    with its length. Once the journal grows larger than the persist file
+    and C{min_compact_size}, the whole hard map is saved again and the
+    journal is started afresh, compacting it.
+
+    The persist file itself has the same format as with L{BPickleBackend}.
+
+    @param min_compact_size: The size in bytes below which the journal is
+        never compacted.
+    """
+
+    journaled = True
+
+    def __init__(self, min_compact_size=65536):
+        super().__init__()
+        self._min_compact_size = min_compact_size
+
+    def get_journal_filename(self, filepath):
+        return filepath + ".journal"
+
+    def _get_identity(self, filepath):
+        """Identify the current content of the persist file."""
+        stat = os.stat(filepath)
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def encode_record(self, record):
+        data = self._bpickle.dumps(record)
+        return f"{len(data):d}:".encode() + data
+
+    def save(self, filepath, map, mode=None):
+        super().save(filepath, map, mode=mode)
+        # Replace the journal atomically, so that a crash leaves either the
+        # old journal, which doesn't match the new persist file and is then
+        # ignored, or the new empty one.
+        journal = self.get_journal_filename(filepath)
+        header = self.encode_record(self._get_identity(filepath))
+        with open(journal + ".new", "wb") as fd:
+            fd.write(header)
+        if mode is not None:
+            os.chmod(journal + ".new", mode=mode)
+        os.rename(journal + ".new", journal)
+
+    def append(self, filepath, records, mode=None):
+        """Append C{records} to the journal of C{filepath}.
+
+        @return: C{False} if nothing was appended because the journal is
+            missing or should be compacted, in which case the whole hard map
+            must be saved instead.
+        """
+        if not records:
+            return True
+        journal = self.get_journal_filename(filepath)
+        try:
+            journal_size = os.path.getsize(journal)
+            size = os.path.getsize(filepath)
+        except OSError:
+            return False
+        journal_size += sum(len(record) for record in records)
+        if journal_size > max(size, self._min_compact_size):
+            return False
+        with open(journal, "ab") as fd:
+            fd.write(b"".join(records))
+        return True
+
+    def load_journal(self, filepath):
+        """
+        Return the records journaled for C{filepath}, or an empty list if
+        the journal doesn't apply to the current persist file. A partially
+        written record at the end of the journal is ignored.
+        """
+        try:
+            with open(self.get_journal_filename(filepath), "rb") as fd:
+                data = fd.read()
+        except OSError:
+            return []
+        records = []
+        pos = 0
+        while True:
+            separator = data.find(b":", pos)
+            if separator == -1:
+                break
+            try:
+                end = separator + 1 + int(data[pos:separator])
+                if end > len(data):
+                    break
+                records.append(self._bpickle.loads(data[separator + 1 : end]))
+            except ValueError:
+                break
+            pos = end
+        if not records or records[0] != self._get_identity(filepath):
+            return []
+        return records[1:]
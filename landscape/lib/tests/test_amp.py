@@ -1,19 +1,23 @@
 import unittest
 
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.defer import Deferred, gatherResults, inlineCallbacks
 from twisted.internet.error import ConnectError, ConnectionDone
 from twisted.internet.task import Clock
+from twisted.protocols.amp import MAX_VALUE_LENGTH, parseString
 from twisted.python.failure import Failure
 
-from landscape.lib import testing
+from landscape.lib import bpickle, testing
 from landscape.lib.amp import (
+    MethodCall,
+    MethodCallChunk,
     MethodCallClientFactory,
     MethodCallClientProtocol,
     MethodCallError,
     MethodCallSender,
     MethodCallServerFactory,
     MethodCallServerProtocol,
+    MethodCallStats,
     RemoteObject,
 )
 
@@ -109,11 +113,15 @@ class MethodCallTest(BaseTestCase):
         super().setUp()
         self.methods = ["method"]
         self.object = DummyObject()
-        server = MethodCallServerProtocol(self.object, self.methods)
+        self.clock = Clock()
+        self.server = MethodCallServerProtocol(
+            self.object,
+            self.methods,
+            clock=self.clock,
+        )
         client = MethodCallClientProtocol()
-        self.connection = FakeConnection(client, server)
+        self.connection = FakeConnection(client, self.server)
         self.connection.make()
-        self.clock = Clock()
         self.sender = MethodCallSender(client, self.clock)
 
     def test_with_forbidden_method(self):
@@ -198,6 +206,214 @@ class MethodCallTest(BaseTestCase):
         self.connection.flush()
         self.assertEqual("We rock", self.successResultOf(deferred))
 
+    def test_batch(self):
+        """
+        A connected client can issue a L{MethodCallBatch} and get back the
+        result or the error of each call, in order.
+        """
+        self.object.method = lambda word, times=1: word * times
+        self.object.failing = lambda: 1 / 0
+        self.methods.append("failing")
+        deferreds = self.sender.send_method_calls(
+            [
+                ("method", ["hi"], {"times": 2}),
+                ("failing", [], {}),
+                ("forbidden", [], {}),
+                ("method", [b"ho"], {}),
+            ],
+        )
+        self.connection.flush()
+        self.assertEqual("hihi", self.successResultOf(deferreds[0]))
+        failure = self.failureResultOf(deferreds[1])
+        self.assertEqual("division by zero", str(failure.value))
+        failure = self.failureResultOf(deferreds[2])
+        self.assertEqual("Forbidden method 'forbidden'", str(failure.value))
+        self.assertEqual(b"ho", self.successResultOf(deferreds[3]))
+
+    def test_batch_with_invalid_arguments(self):
+        """
+        A call of a L{MethodCallBatch} whose arguments can't be decoded fails
+        with a L{MethodCallError}, while the other calls still run.
+        """
+        words = []
+        self.object.method = words.append
+        deferreds = self.sender._send_batch(
+            [
+                ("method", bpickle.dumps((["hi"], {}))),
+                ("method", b"l"),
+                ("method", bpickle.dumps((["ho"], {}))),
+            ],
+        )
+        self.connection.flush()
+        self.assertIsNone(self.successResultOf(deferreds[0]))
+        failure = self.failureResultOf(deferreds[1])
+        self.assertIsInstance(failure.value, MethodCallError)
+        self.assertEqual(
+            "Invalid arguments for 'method': Unknown type character: b''",
+            str(failure.value),
+        )
+        self.assertIsNone(self.successResultOf(deferreds[2]))
+        self.assertEqual(["hi", "ho"], words)
+
+    def test_batch_with_slow_call(self):
+        """
+        A call of a L{MethodCallBatch} that doesn't return right away doesn't
+        hold back the results of the other ones, and its own result is sent
+        once it's done.
+        """
+        slow = Deferred()
+        self.object.method = lambda word: word.capitalize()
+        self.object.slow = lambda: slow
+        self.methods.append("slow")
+        deferreds = self.sender.send_method_calls(
+            [("slow", [], {}), ("method", ["john"], {})],
+        )
+        self.connection.flush()
+        self.assertFalse(deferreds[0].called)
+        self.assertEqual("John", self.successResultOf(deferreds[1]))
+
+        slow.callback("Paul")
+        self.connection.flush()
+        self.assertEqual("Paul", self.successResultOf(deferreds[0]))
+
+    def test_batch_with_slow_failing_call(self):
+        """
+        A call of a L{MethodCallBatch} that fails after the response was sent
+        gets its error.
+        """
+        slow = Deferred()
+        self.object.method = lambda word: word
+        self.object.slow = lambda: slow
+        self.methods.append("slow")
+        deferreds = self.sender.send_method_calls(
+            [("slow", [], {}), ("method", ["john"], {})],
+        )
+        self.connection.flush()
+        self.assertEqual("john", self.successResultOf(deferreds[1]))
+        slow.errback(ZeroDivisionError("division by zero"))
+        self.connection.flush()
+        failure = self.failureResultOf(deferreds[0])
+        self.assertEqual("division by zero", str(failure.value))
+
+    def test_batch_with_slow_call_timeout(self):
+        """
+        A call of a L{MethodCallBatch} fails with a L{MethodCallError} if its
+        result isn't received within the timeout.
+        """
+        self.object.method = lambda word: word
+        self.object.slow = lambda: Deferred()
+        self.methods.append("slow")
+        deferreds = self.sender.send_method_calls(
+            [("slow", [], {}), ("method", ["john"], {})],
+        )
+        self.connection.flush()
+        self.assertEqual("john", self.successResultOf(deferreds[1]))
+        self.clock.advance(self.sender.timeout)
+        failure = self.failureResultOf(deferreds[0])
+        self.assertEqual("timeout", str(failure.value))
+
+    def test_batch_with_slow_call_not_collected(self):
+        """
+        The result of a slow call of a L{MethodCallBatch} is forgotten if
+        the caller doesn't ask for it within the timeout.
+        """
+        slow = Deferred()
+        self.object.slow = lambda: slow
+        self.methods.append("slow")
+        locator = self.server.locator
+        locator.receive_method_call_batch(
+            calls=bpickle.dumps([("slow", bpickle.dumps(([], {})))]),
+        )
+        self.assertEqual(1, len(locator._pending_results))
+        self.clock.advance(self.sender.timeout)
+        self.assertEqual({}, locator._pending_results)
+        slow.callback(None)
+
+    def test_batch_with_slow_call_collected(self):
+        """
+        Once the result of a slow call of a L{MethodCallBatch} is asked for,
+        it's not forgotten after the timeout anymore.
+        """
+        slow = Deferred()
+        self.object.slow = lambda: slow
+        self.object.method = lambda: None
+        self.methods.append("slow")
+        deferreds = self.sender.send_method_calls(
+            [("slow", [], {}), ("method", [], {})],
+        )
+        self.connection.flush()
+        self.assertEqual({}, self.server.locator._pending_results)
+        slow.callback("done")
+        self.connection.flush()
+        self.assertEqual("done", self.successResultOf(deferreds[0]))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_batch_with_lone_call(self):
+        """
+        A single call is sent as a plain L{MethodCall}.
+        """
+        self.object.method = lambda word: word.capitalize()
+        deferreds = self.sender.send_method_calls([("method", ["john"], {})])
+        [box] = parseString(b"".join(self.connection.client.transport.stream))
+        self.assertEqual(b"MethodCall", box[b"_command"])
+        self.connection.flush()
+        self.assertEqual("John", self.successResultOf(deferreds[0]))
+
+    def test_batch_with_long_arguments(self):
+        """
+        A call with arguments longer than the maximum length of an AMP value
+        is sent in L{MethodCallChunk}s as a L{MethodCall}, after a batch with
+        the calls before it and before a batch with the ones after it.
+        """
+        calls = []
+        self.object.method = lambda word: calls.append(word[:1]) or len(word)
+        words = ["a", "b", "c" * MAX_VALUE_LENGTH, "d", "e"]
+        deferreds = self.sender.send_method_calls(
+            [("method", [word], {}) for word in words],
+        )
+        boxes = parseString(b"".join(self.connection.client.transport.stream))
+        commands = [box[b"_command"] for box in boxes]
+        self.assertEqual(
+            [b"MethodCallBatch", b"MethodCallChunk", b"MethodCall", b"MethodCallBatch"],
+            commands,
+        )
+        self.connection.flush()
+        self.assertEqual(["a", "b", "c", "d", "e"], calls)
+        self.assertEqual(
+            [len(word) for word in words],
+            [self.successResultOf(deferred) for deferred in deferreds],
+        )
+
+    def test_batch_connection_lost(self):
+        """
+        The results of the calls of a L{MethodCallBatch} still running are
+        forgotten when the connection is lost.
+        """
+        self.object.method = lambda: Deferred()
+        locator = self.connection.server.locator
+        locator.receive_method_call_batch(
+            bpickle.dumps([("method", bpickle.dumps(([], {})))]),
+        )
+        self.assertEqual(1, len(locator._pending_results))
+        self.connection.server.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual({}, locator._pending_results)
+
+    def test_batch_with_long_values(self):
+        """
+        The calls of a L{MethodCallBatch} and their results can be longer
+        than the maximum length of an AMP value.
+        """
+        self.object.method = lambda word: word.upper()
+        words = ["a" * (MAX_VALUE_LENGTH // 2), "b" * (MAX_VALUE_LENGTH // 2)]
+        deferreds = self.sender.send_method_calls(
+            [("method", [word], {}) for word in words],
+        )
+        self.connection.flush()
+        self.assertEqual(
+            [word.upper() for word in words],
+            [self.successResultOf(deferred) for deferred in deferreds],
+        )
+
     def test_with_default_arguments(self):
         """
         A connected client can issue a L{MethodCall} for methods having
@@ -313,6 +529,43 @@ class MethodCallTest(BaseTestCase):
         self.assertEqual(80000, self.successResultOf(deferred1))
         self.assertEqual(90000, self.successResultOf(deferred2))
 
+    def test_with_long_argument_chunks_sent_at_once(self):
+        """
+        The L{MethodCallChunk}s of a long argument are sent together with the
+        L{MethodCall}, without waiting for the responses to each of them.
+        """
+        self.object.method = lambda word: len(word)
+        deferred = self.sender.send_method_call(
+            method="method",
+            args=["!" * 200000],
+            kwargs={},
+        )
+        self.assertEqual(4, len(self.connection.client.transport.stream))
+        self.connection.flush()
+        self.assertEqual(200000, self.successResultOf(deferred))
+
+    def test_with_long_argument_without_size(self):
+        """
+        The L{MethodCallChunk}s sent by older peers, without the size of the
+        whole arguments, are still reassembled.
+        """
+        self.object.method = lambda word: len(word)
+        arguments = bpickle.dumps((["!" * 80000], {}))
+        client = self.connection.client
+        client.callRemote(
+            MethodCallChunk,
+            sequence=1,
+            chunk=arguments[:MAX_VALUE_LENGTH],
+        )
+        deferred = client.callRemote(
+            MethodCall,
+            sequence=1,
+            method=b"method",
+            arguments=arguments[MAX_VALUE_LENGTH:],
+        )
+        self.connection.flush()
+        self.assertEqual({"result": b"i80000;"}, self.successResultOf(deferred))
+
     def test_with_exception(self):
         """
         If the target object method raises an exception, the remote call fails
@@ -422,6 +675,108 @@ class MethodCallTest(BaseTestCase):
         [failure] = result
         failure.trap(MethodCallError)
 
+    def test_stats(self):
+        """
+        The calls sent and received are accounted for in the given
+        L{MethodCallStats}, by peer and method.
+        """
+        sent = MethodCallStats()
+        received = MethodCallStats()
+        server = MethodCallServerProtocol(self.object, self.methods, received)
+        client = MethodCallClientProtocol()
+        connection = FakeConnection(client, server)
+        connection.make()
+        sender = MethodCallSender(
+            client,
+            self.clock,
+            stats=sent,
+            peer="broker",
+            caller="monitor",
+        )
+        self.object.method = lambda word: word.capitalize()
+        deferred1 = sender.send_method_call(method="method", args=["john"])
+        deferred2 = sender.send_method_call(method="method", args=[None])
+        self.clock.advance(2)
+        connection.flush()
+        self.assertEqual("John", self.successResultOf(deferred1))
+        self.failureResultOf(deferred2).trap(MethodCallError)
+
+        arguments_size = len(bpickle.dumps((["john"], {}))) + len(
+            bpickle.dumps(([None], {})),
+        )
+        stats = sent.get_summary()["broker"]["method"]
+        self.assertEqual(2, stats["calls"])
+        self.assertEqual(1, stats["failures"])
+        self.assertEqual(arguments_size, stats["arguments-bytes"])
+        self.assertEqual(len(bpickle.dumps("John")), stats["result-bytes"])
+        self.assertEqual(2, stats["duration"]["max"])
+        stats = received.get_summary()["monitor"]["method"]
+        self.assertEqual(2, stats["calls"])
+        self.assertEqual(1, stats["failures"])
+        self.assertEqual(arguments_size, stats["arguments-bytes"])
+        self.assertEqual(len(bpickle.dumps("John")), stats["result-bytes"])
+        self.assertEqual(2, stats["duration"]["count"])
+
+    def test_batch_stats(self):
+        """
+        The calls in a L{MethodCallBatch} are accounted for one by one.
+        """
+        sent = MethodCallStats()
+        received = MethodCallStats()
+        server = MethodCallServerProtocol(self.object, self.methods, received)
+        client = MethodCallClientProtocol()
+        connection = FakeConnection(client, server)
+        connection.make()
+        sender = MethodCallSender(client, self.clock, stats=sent)
+        self.object.method = lambda word: word.capitalize()
+        deferreds = sender.send_method_calls(
+            [("method", ["john"], {}), ("method", [None], {})],
+        )
+        connection.flush()
+        self.failureResultOf(deferreds[1])
+        for stats in [sent.get_summary(), received.get_summary()]:
+            stats = stats["unknown"]["method"]
+            self.assertEqual(2, stats["calls"])
+            self.assertEqual(1, stats["failures"])
+            self.assertEqual(len(bpickle.dumps("John")), stats["result-bytes"])
+
+
+class MethodCallStatsTest(BaseTestCase):
+    def test_get_summary(self):
+        """
+        L{MethodCallStats.get_summary} returns the statistics of the recorded
+        calls by peer and method.
+        """
+        stats = MethodCallStats()
+        stats.record("monitor", "ping", 0.5, 10, 3, False)
+        stats.record("monitor", "ping", 1.5, 10, 0, True)
+        stats.record(None, "send_message", 1, 100, 4, False)
+        summary = stats.get_summary()
+        self.assertEqual(
+            {
+                "calls": 2,
+                "failures": 1,
+                "arguments-bytes": 20,
+                "result-bytes": 3,
+                "duration": {
+                    "count": 2,
+                    "total-count": 2,
+                    "min": 0.5,
+                    "max": 1.5,
+                    "mean": 1.0,
+                    "p50": 0.5,
+                    "p90": 1.5,
+                    "p99": 1.5,
+                },
+            },
+            summary["monitor"]["ping"],
+        )
+        self.assertEqual(["send_message"], list(summary["unknown"]))
+
+    def test_get_summary_empty(self):
+        """Without calls, the summary is empty."""
+        self.assertEqual({}, MethodCallStats().get_summary())
+
 
 class RemoteObjectTest(BaseTestCase):
     def setUp(self):
@@ -528,6 +883,169 @@ class RemoteObjectTest(BaseTestCase):
         failure = self.failureResultOf(deferred)
         self.assertEqual("Forbidden method 'method'", str(failure.value))
 
+    def test_batch(self):
+        """
+        If C{batchCalls} is set on the factory, the first call made by a
+        L{RemoteObject} in a reactor iteration is sent right away, and the
+        other ones made in the same iteration in a single L{MethodCallBatch},
+        and a L{MethodCallError} in one of them doesn't affect the others.
+        """
+        self.factory.fake_connection = None
+        self.factory.batchCalls = True
+        self.object.method = lambda word: word.capitalize()
+        stream = self.connector.connection.client.transport.stream
+        deferred1 = self.remote.method("john")
+        self.assertEqual(1, len(stream))
+        deferred2 = self.remote.method(None)
+        deferred3 = self.remote.method("paul")
+        self.assertEqual(1, len(stream))
+
+        self.clock.advance(0)
+        self.assertEqual(2, len(stream))
+        [_, box] = parseString(b"".join(stream))
+        self.assertEqual(b"MethodCallBatch", box[b"_command"])
+        self.connector.connection.flush()
+        self.assertEqual("John", self.successResultOf(deferred1))
+        self.failureResultOf(deferred2).trap(MethodCallError)
+        self.assertEqual("Paul", self.successResultOf(deferred3))
+
+    def test_batch_with_fake_connection(self):
+        """
+        With a fake connection, each call is sent right away.
+        """
+        self.factory.batchCalls = True
+        self.object.method = lambda word: word.capitalize()
+        sent = []
+        send_method_calls = self.remote._sender.send_method_calls
+
+        def record_method_calls(calls):
+            sent.append(calls)
+            return send_method_calls(calls)
+
+        self.remote._sender.send_method_calls = record_method_calls
+        deferred1 = self.remote.method("john")
+        self.assertEqual("John", self.successResultOf(deferred1))
+        deferred2 = self.remote.method(None)
+        self.failureResultOf(deferred2).trap(MethodCallError)
+        self.assertEqual(
+            [[("method", ("john",), {})], [("method", (None,), {})]],
+            sent,
+        )
+
+    def test_batch_alone(self):
+        """
+        A call isn't delayed if there's no batch to add it to, and a batch
+        is only formed by the calls made after it in the same iteration.
+        """
+        self.factory.fake_connection = None
+        self.factory.batchCalls = True
+        self.object.method = lambda word: word.capitalize()
+        deferred = self.remote.method("john")
+        self.connector.connection.flush()
+        self.assertEqual("John", self.successResultOf(deferred))
+
+        self.clock.advance(0)
+        deferred = self.remote.method("paul")
+        self.connector.connection.flush()
+        self.assertEqual("Paul", self.successResultOf(deferred))
+
+    def test_batch_with_slow_call(self):
+        """
+        A call of a L{MethodCallBatch} that doesn't return right away doesn't
+        delay the results of the other calls of the batch.
+        """
+        self.factory.fake_connection = None
+        self.factory.batchCalls = True
+        slow = Deferred()
+        self.object.method = lambda word: word.capitalize()
+        self.object.slow = lambda: slow
+        self.methods.append("slow")
+        deferred1 = self.remote.slow()
+        deferred2 = self.remote.method("john")
+        self.clock.advance(0)
+        self.connector.connection.flush()
+        self.assertFalse(deferred1.called)
+        self.assertEqual("John", self.successResultOf(deferred2))
+
+        slow.callback("Paul")
+        self.connector.connection.flush()
+        self.assertEqual("Paul", self.successResultOf(deferred1))
+
+    def test_batch_not_connected(self):
+        """
+        The calls can't be sent if the L{RemoteObject} has no connection, and
+        they're retried once it has one if C{retryOnReconnect} is C{True}.
+        """
+        self.factory.fake_connection = None
+        self.factory.batchCalls = True
+        self.factory.retryOnReconnect = True
+        self.object.method = lambda word: word.capitalize()
+        sender = self.remote._sender
+        self.remote._sender = None
+        deferred = self.remote.method("john")
+        self.clock.advance(0)
+        self.assertFalse(deferred.called)
+
+        self.remote._sender = sender
+        self.remote._retry()
+        self.clock.advance(0)
+        self.connector.connection.flush()
+        self.assertEqual("John", self.successResultOf(deferred))
+
+    def test_batch_unhandled(self):
+        """
+        If the peer doesn't know about L{MethodCallBatch}, the calls are sent
+        again one by one, and so are further ones.
+        """
+        self.factory.fake_connection = None
+        self.factory.batchCalls = True
+        locator = self.connector.connection.server.locator
+        locate_responder = locator.locateResponder
+        locator.locateResponder = lambda name: (
+            None if name == b"MethodCallBatch" else locate_responder(name)
+        )
+        self.object.method = lambda word: word.capitalize()
+        deferred1 = self.remote.method("john")
+        deferred2 = self.remote.method("paul")
+        deferred3 = self.remote.method("george")
+        self.clock.advance(0)
+        self.connector.connection.flush()
+        self.assertEqual("John", self.successResultOf(deferred1))
+        self.assertEqual("Paul", self.successResultOf(deferred2))
+        self.assertEqual("George", self.successResultOf(deferred3))
+
+        deferred4 = self.remote.method("ringo")
+        deferred5 = self.remote.method("pete")
+        self.assertEqual(
+            2,
+            len(self.connector.connection.client.transport.stream),
+        )
+        self.connector.connection.flush()
+        self.assertEqual("Ringo", self.successResultOf(deferred4))
+        self.assertEqual("Pete", self.successResultOf(deferred5))
+
+    def test_batch_retry(self):
+        """
+        If the connection is lost and C{retryOnReconnect} is C{True} on the
+        factory, the calls of a failed L{MethodCallBatch} are retried.
+        """
+        self.factory.fake_connection = None
+        self.object.method = lambda word: word.capitalize()
+        self.factory.factor = 0.19
+        self.factory.retryOnReconnect = True
+        self.connector.disconnect()
+        self.factory.batchCalls = True
+        deferred1 = self.remote.method("john")
+        deferred2 = self.remote.method("paul")
+        self.clock.advance(0)
+        self.assertFalse(deferred1.called)
+        self.assertFalse(deferred2.called)
+
+        # Time passes and the factory successfully reconnects
+        self.clock.advance(2)
+        self.assertEqual("John", self.successResultOf(deferred1))
+        self.assertEqual("Paul", self.successResultOf(deferred2))
+
 
 class MethodCallClientFactoryTest(BaseTestCase):
     def setUp(self):
@@ -652,6 +1170,20 @@ class MethodCallFunctionalTest(BaseTestCase):
         self.client.stopTrying()
         connector.disconnect()
 
+    @inlineCallbacks
+    def test_batch(self):
+        """
+        The calls batched by a L{RemoteObject} in the same reactor iteration
+        get their own results.
+        """
+        self.client.batchCalls = True
+        connector = reactor.connectUNIX(self.socket, self.client)
+        remote = yield self.client.getRemoteObject()
+        result = yield gatherResults([remote.method("john"), remote.method("paul")])
+        self.assertEqual(result, ["John", "Paul"])
+        self.client.stopTrying()
+        connector.disconnect()
+
     @inlineCallbacks
     def test_connect_with_max_retries(self):
         """
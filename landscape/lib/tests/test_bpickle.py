@@ -1,3 +1,5 @@
+import array
+import random
 import unittest
 
 from landscape.lib import bpickle
@@ -65,3 +67,184 @@ class BPickleTest(unittest.TestCase):
     def test_long(self):
         long = 99999999999999999999999999999
         self.assertEqual(bpickle.loads(bpickle.dumps(long)), long)
+
+
+class IterDumpsTest(unittest.TestCase):
+    """Tests for the streaming encoder, L{bpickle.iter_dumps}."""
+
+    sample = {
+        "messages": [
+            {"type": "packages", "data": b"x" * 1000, "ids": (1, 2.5, None)},
+            {"type": "\xc0", "flags": [True, False, [], {}], "big": 2**70},
+        ],
+        "sequence": 42,
+    }
+
+    def test_same_output(self):
+        """The chunks add up to the output of L{bpickle.dumps}."""
+        for value in [1, "foo", b"", None, [], (), {}, self.sample]:
+            self.assertEqual(
+                bpickle.dumps(value),
+                b"".join(bpickle.iter_dumps(value)),
+            )
+
+    def test_chunk_size(self):
+        """
+        The output is yielded in chunks of about the given size, while long
+        byte strings are kept whole.
+        """
+        chunks = list(bpickle.iter_dumps(self.sample, chunk_size=64))
+        self.assertEqual(bpickle.dumps(self.sample), b"".join(chunks))
+        self.assertEqual(b"x" * 1000, chunks[1])
+        for chunk in chunks[2:-1]:
+            self.assertGreaterEqual(len(chunk), 64)
+            self.assertLess(len(chunk), 128)
+
+    def test_incremental(self):
+        """Chunks are yielded before the whole object has been walked."""
+        chunks = bpickle.iter_dumps([1, object()], chunk_size=3)
+        self.assertEqual(b"li1;", next(chunks))
+        self.assertRaises(ValueError, next, chunks)
+
+    def test_unsupported_type(self):
+        """Unsupported types are reported like L{bpickle.dumps} does."""
+        self.assertRaises(ValueError, list, bpickle.iter_dumps([object()]))
+
+    def test_dump(self):
+        """L{bpickle.dump} passes the chunks to the given callable."""
+        chunks = []
+        bpickle.dump(self.sample, chunks.append, chunk_size=64)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(bpickle.dumps(self.sample), b"".join(chunks))
+
+
+class LoadsDifferentialTest(unittest.TestCase):
+    """
+    L{bpickle.loads} gives the same results and errors as the table-driven
+    loads_* decoder, which is used when a custom conversion map is passed.
+    """
+
+    sample = IterDumpsTest.sample
+
+    def reference_loads(self, data, as_is=False):
+        return bpickle.loads(data, _lt=dict(bpickle.loads_table), as_is=as_is)
+
+    def outcome(self, loads, data, as_is=False):
+        """Return the repr of the loaded object or the error."""
+        try:
+            return repr(loads(data, as_is=as_is))
+        except Exception as error:
+            return (type(error), str(error))
+
+    def assertSameOutcome(self, data):
+        for as_is in (False, True):
+            expected = self.outcome(self.reference_loads, data, as_is)
+            self.assertEqual(
+                expected,
+                self.outcome(bpickle.loads, data, as_is),
+                f"Different outcome for {data!r} (as_is={as_is})",
+            )
+            self.assertEqual(
+                expected,
+                self.outcome(bpickle.loads, memoryview(data), as_is),
+                f"Different outcome for memoryview {data!r} (as_is={as_is})",
+            )
+
+    def test_valid(self):
+        """Valid data is loaded to the same objects."""
+        values = [
+            0,
+            -12,
+            2**70,
+            1.5,
+            -0.00005,
+            True,
+            False,
+            None,
+            b"",
+            b"foo",
+            "",
+            "\xc0",
+            [],
+            (1, [], ()),
+            {b"key": [b"value"], b"other": {}},
+            {"\xc0": (None,)},
+            self.sample,
+        ]
+        for value in values:
+            self.assertSameOutcome(bpickle.dumps(value))
+
+    def test_malformed(self):
+        """Hand-crafted malformed data fails the same way."""
+        for data in [
+            b"",
+            b"x",
+            b"i",
+            b"i12",
+            b"i1x;",
+            b"i+1;",
+            b"i 1 ;",
+            b"i1_0;",
+            b"f;",
+            b"fnan;",
+            b"b",
+            b"b2",
+            b"bx",
+            b"s",
+            b"s3",
+            b"s3:ab",
+            b"s-1:",
+            b"s:",
+            b"u2:\xc3",
+            b"u-4:",
+            b"l",
+            b"li1;",
+            b"lx;",
+            b"d",
+            b"ds1:a",
+            b"t",
+            b"ti1;",
+            b"di1;",
+            b"dli1;;i2;;",
+            b"ds1:\xffi1;;",
+            b"n;trailing",
+        ]:
+            self.assertSameOutcome(data)
+
+    def test_mutations(self):
+        """Truncated and randomly mutated data fails the same way."""
+        data = bpickle.dumps(self.sample)
+        for end in range(len(data)):
+            self.assertSameOutcome(data[:end])
+        rng = random.Random(42)
+        alphabet = b"bifltdnsu;:-+_ .0123456789x\xff"
+        for _ in range(2000):
+            mutated = bytearray(data)
+            for _ in range(rng.randint(1, 3)):
+                pos = rng.randrange(len(mutated))
+                action = rng.choice(["replace", "insert", "delete"])
+                if action == "replace":
+                    mutated[pos] = rng.choice(alphabet)
+                elif action == "insert":
+                    mutated.insert(pos, rng.choice(alphabet))
+                else:
+                    del mutated[pos]
+            self.assertSameOutcome(bytes(mutated))
+
+    def test_bytes_like(self):
+        """Bytes-like objects are loaded, with byte strings as C{bytes}."""
+        data = bpickle.dumps(self.sample)
+        self.assertEqual(self.sample, bpickle.loads(memoryview(data)))
+        result = bpickle.loads(bytearray(bpickle.dumps([b"foo"])))
+        self.assertEqual([b"foo"], result)
+        self.assertIs(bytes, type(result[0]))
+        result = bpickle.loads(memoryview(bpickle.dumps([b"foo", "bar"])))
+        self.assertEqual([b"foo", "bar"], result)
+        self.assertIs(bytes, type(result[0]))
+
+    def test_other_buffer_formats(self):
+        """Buffers of items wider than a byte are loaded byte by byte."""
+        data = array.array("H")
+        data.frombytes(bpickle.dumps([1, b"foo"]) + b"n")
+        self.assertEqual([1, b"foo"], bpickle.loads(data))
+        self.assertEqual([1, b"foo"], bpickle.loads(memoryview(data)))
@@ -8,6 +8,7 @@ from twisted.internet.defer import FirstError
 
 from landscape.lib import testing
 from landscape.lib.fetch import (
+    CurlSession,
     HTTPCodeError,
     PyCurlError,
     fetch,
@@ -19,8 +20,9 @@ from landscape.lib.fetch import (
 
 
 class CurlStub:
-    def __init__(self, result=None, infos=None, error=None):
+    def __init__(self, result=None, infos=None, error=None, headers=()):
         self.result = result
+        self.headers = headers
         self.infos = infos
         if self.infos is None:
             self.infos = {pycurl.HTTP_CODE: 200}
@@ -40,11 +42,22 @@ class CurlStub:
             raise AssertionError("setopt() can't be called after perform()")
         self.options[option] = value
 
+    def reset(self):
+        share = self.options.get(pycurl.SHARE)
+        self.options = {}
+        if share is not None:
+            # Like libcurl, keep the share when resetting.
+            self.options[pycurl.SHARE] = share
+        self.performed = False
+
     def perform(self):
         if self.error:
             raise self.error
         if self.performed:
             raise AssertionError("Can't perform twice")
+        if pycurl.HEADERFUNCTION in self.options:
+            for header in self.headers:
+                self.options[pycurl.HEADERFUNCTION](header)
         self.options[pycurl.WRITEFUNCTION](self.result)
         self.performed = True
 
@@ -166,6 +179,40 @@ class FetchTest(
             },
         )
 
+    def test_post_data_chunks(self):
+        """
+        The data can be given as an iterable of chunks, which are sent with
+        chunked transfer encoding and only produced as they're read.
+        """
+        curl = CurlStub(b"result")
+        produced = []
+
+        def generate():
+            for chunk in [b"da", b"", b"ta"]:
+                produced.append(chunk)
+                yield chunk
+
+        result = fetch(
+            "http://example.com",
+            post=True,
+            data=generate(),
+            headers={"a": "1"},
+            curl=curl,
+        )
+        self.assertEqual(result, b"result")
+        self.assertNotIn(pycurl.POSTFIELDSIZE, curl.options)
+        self.assertEqual(
+            ["Transfer-Encoding: chunked", "a: 1"],
+            curl.options[pycurl.HTTPHEADER],
+        )
+        read = curl.options[pycurl.READFUNCTION]
+        self.assertEqual([], produced)
+        self.assertEqual(b"d", read(1))
+        self.assertEqual(b"a", read(3))
+        self.assertEqual([b"da"], produced)
+        self.assertEqual(b"ta", read(3))
+        self.assertEqual(b"", read(3))
+
     def test_cainfo(self):
         curl = CurlStub(b"result")
         result = fetch("https://example.com", cainfo="cainfo", curl=curl)
@@ -365,6 +412,35 @@ class FetchTest(
         self.assertEqual(b"result", result)
         self.assertEqual(proxy.encode("ascii"), curl.options[pycurl.PROXY])
 
+    def test_response_headers(self):
+        """
+        If a C{response_headers} dict is passed, it's filled with the headers
+        of the response.
+        """
+        curl = CurlStub(
+            b"result",
+            headers=[
+                b"HTTP/1.1 200 OK\r\n",
+                b"Content-Type: application/octet-stream\r\n",
+                b"Accept-Encoding: gzip, deflate\r\n",
+                b"\r\n",
+            ],
+        )
+        response_headers = {}
+        result = fetch(
+            "http://example.com",
+            curl=curl,
+            response_headers=response_headers,
+        )
+        self.assertEqual(b"result", result)
+        self.assertEqual(
+            {
+                "content-type": "application/octet-stream",
+                "accept-encoding": "gzip, deflate",
+            },
+            response_headers,
+        )
+
     def test_create_curl(self):
         curls = []
 
@@ -594,3 +670,101 @@ class FetchTest(
 
         result.addErrback(check_error)
         return result
+
+
+class CurlSessionTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.curls = []
+
+        def pycurl_curl():
+            curl = CurlStub(
+                b"result",
+                infos={pycurl.HTTP_CODE: 200, pycurl.NUM_CONNECTS: 1},
+            )
+            self.curls.append(curl)
+            return curl
+
+        patcher = mock.patch("pycurl.Curl", pycurl_curl)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = CurlSession(dns_cache_timeout=60)
+
+    def test_fetch(self):
+        """
+        L{CurlSession.fetch} performs the request with a handle sharing the
+        session caches, and caching DNS lookups.
+        """
+        result = self.session.fetch("http://example.com", post=True, data="a")
+        self.assertEqual(b"result", result)
+        [curl] = self.curls
+        self.assertIs(self.session._share, curl.options[pycurl.SHARE])
+        self.assertEqual(60, curl.options[pycurl.DNS_CACHE_TIMEOUT])
+        self.assertTrue(curl.options[pycurl.POST])
+
+    def test_fetch_reuses_handle(self):
+        """
+        The same handle is reused by the following requests, without the
+        options set by the previous ones.
+        """
+        self.session.fetch("http://example.com", post=True, data="a")
+        self.curls[0].infos[pycurl.NUM_CONNECTS] = 0
+        self.session.fetch("http://example.com")
+        [curl] = self.curls
+        self.assertNotIn(pycurl.POST, curl.options)
+        self.assertEqual(2, self.session.requests)
+        self.assertEqual(1, self.session.connections)
+
+    def test_fetch_concurrently(self):
+        """
+        A request performed while another one is in progress, e.g. from
+        another thread, gets its own handle.
+        """
+        results = []
+
+        def perform():
+            results.append(self.session.fetch("http://example.com/other"))
+
+        self.session.fetch("http://example.com")
+        self.curls[0].perform = perform
+        self.session.fetch("http://example.com")
+        self.assertEqual(2, len(self.curls))
+        self.assertEqual([b"result"], results)
+
+    def test_fetch_error(self):
+        """
+        The handle is released even if the request fails.
+        """
+        self.session.fetch("http://example.com")
+        self.curls[0].error = pycurl.error(7, "Connection refused")
+        self.assertRaises(PyCurlError, self.session.fetch, "http://example.com")
+        self.assertEqual([self.curls[0]], self.session._idle_curls)
+        self.assertEqual(2, self.session.requests)
+
+    @mock.patch("landscape.lib.fetch.debug")
+    def test_fetch_logs_connections(self, debug_mock):
+        """
+        Whether each request opened a new connection or reused one is logged.
+        """
+        self.session.fetch("https://example.com")
+        debug_mock.assert_called_once_with(
+            "Opened a new connection with a TLS handshake to "
+            "https://example.com (1 connections opened for 1 requests so far).",
+        )
+        self.curls[0].infos[pycurl.NUM_CONNECTS] = 0
+        self.session.fetch("https://example.com")
+        debug_mock.assert_called_with(
+            "Reused a connection to https://example.com (1 connections opened "
+            "for 2 requests so far).",
+        )
+
+    def test_close(self):
+        """
+        L{CurlSession.close} closes the idle handles.
+        """
+        self.session.fetch("http://example.com")
+        curl = self.curls[0]
+        curl.close = mock.Mock()
+        self.session.close()
+        curl.close.assert_called_once_with()
+        self.assertEqual([], self.session._idle_curls)
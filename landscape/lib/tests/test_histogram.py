@@ -0,0 +1,49 @@
+from landscape.client.tests.helpers import LandscapeTest
+from landscape.lib.histogram import RollingHistogram
+
+
+class RollingHistogramTest(LandscapeTest):
+    def test_empty(self):
+        """An empty histogram only reports its counts."""
+        histogram = RollingHistogram()
+        self.assertEqual(
+            {"count": 0, "total-count": 0},
+            histogram.get_summary(),
+        )
+        self.assertIsNone(histogram.get_percentile(50))
+
+    def test_summary(self):
+        """The summary describes the distribution of the samples."""
+        histogram = RollingHistogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertEqual(
+            {
+                "count": 100,
+                "total-count": 100,
+                "min": 1,
+                "max": 100,
+                "mean": 50.5,
+                "p50": 50,
+                "p90": 90,
+                "p99": 99,
+            },
+            histogram.get_summary(),
+        )
+
+    def test_percentile_single_sample(self):
+        """With a single sample, every percentile is that sample."""
+        histogram = RollingHistogram()
+        histogram.add(0.5)
+        self.assertEqual(0.5, histogram.get_percentile(1))
+        self.assertEqual(0.5, histogram.get_percentile(99))
+
+    def test_rolling_window(self):
+        """Only the most recent samples are kept."""
+        histogram = RollingHistogram(size=3)
+        for value in [100, 1, 2, 3]:
+            histogram.add(value)
+        summary = histogram.get_summary()
+        self.assertEqual(3, summary["count"])
+        self.assertEqual(4, summary["total-count"])
+        self.assertEqual(3, summary["max"])
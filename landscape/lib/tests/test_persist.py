@@ -4,9 +4,12 @@ import unittest
 
 from landscape.lib import testing
 from landscape.lib.persist import (
+    JournalBPickleBackend,
     Persist,
     PersistError,
     PersistReadOnlyError,
+    ReadOnlyDict,
+    ReadOnlyList,
     RootedPersist,
     path_string_to_tuple,
     path_tuple_to_string,
@@ -29,6 +32,10 @@ class PersistHelpersTest(unittest.TestCase):
         for path_string, path_tuple in self.paths:
             self.assertEqual(path_string_to_tuple(path_string), path_tuple)
 
+    def test_path_string_to_tuple_cached(self):
+        path = path_string_to_tuple("ab[0].cd")
+        self.assertIs(path, path_string_to_tuple("ab[0].cd"))
+
     def test_path_string_to_tuple_error(self):
         self.assertRaises(PersistError, path_string_to_tuple, "ab[0][c]")
 
@@ -284,6 +291,39 @@ class GeneralPersistTest(BasePersistTest):
         d["c"] = 2
         self.assertEqual(self.persist.get("a"), d_orig)
 
+    def test_get_view(self):
+        for path, value in self.set_items:
+            self.persist.set(path, value)
+        for path, value in self.get_items:
+            view = self.persist.get_view(path)
+            self.assertEqual(view, value, self.format(view, value))
+        self.assertEqual(self.persist.get_view("x", 1), 1)
+
+    def test_get_view_is_read_only(self):
+        self.persist.set("a", {"b": [1, {"c": 2}]})
+        view = self.persist.get_view("a")
+        self.assertIsInstance(view, ReadOnlyDict)
+        self.assertIsInstance(view["b"], ReadOnlyList)
+        self.assertIsInstance(view["b"][1], ReadOnlyDict)
+        with self.assertRaises(TypeError):
+            view["b"] = 1
+        self.assertRaises(AttributeError, getattr, view["b"], "append")
+        self.assertEqual(view["b"][1:], [{"c": 2}])
+        self.assertIn({"c": 2}, view["b"])
+        self.assertEqual(sorted(view.items()), [("b", [1, {"c": 2}])])
+
+    def test_get_view_copy(self):
+        self.persist.set("a", {"b": [1]})
+        d = self.persist.get_view("a").copy()
+        d["b"].append(2)
+        self.assertEqual(self.persist.get("a"), {"b": [1]})
+
+    def test_get_view_reflects_changes(self):
+        self.persist.set("a", {"b": 1})
+        view = self.persist.get_view("a")
+        self.persist.set("a.c", 2)
+        self.assertEqual(view, {"b": 1, "c": 2})
+
     def test_root_at(self):
         rooted = self.persist.root_at("my-module")
         rooted.set("option", 1)
@@ -354,6 +394,57 @@ class SaveLoadPersistTest(testing.FSTestCase, BasePersistTest):
             self.format(result, self.set_result),
         )
 
+    def test_save_unchanged(self):
+        """
+        Saving to the file the persist was last saved to or loaded from does
+        nothing if the hard map didn't change.
+        """
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        self.persist.set("b", 2, soft=True)
+        self.persist.save(filename)
+        self.assertFalse(os.path.exists(filename + ".old"))
+
+        persist = self.build_persist(filename=filename)
+        persist.save()
+        self.assertFalse(os.path.exists(filename + ".old"))
+
+        persist.set("a", 2)
+        persist.save()
+        persist = self.build_persist(filename=filename)
+        self.assertEqual(persist.get("a"), 2)
+
+    def test_save_unchanged_removed_file(self):
+        """The persist file is written again if it was removed."""
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        os.unlink(filename)
+        self.persist.save(filename)
+        persist = self.build_persist(filename=filename)
+        self.assertEqual(persist.get("a"), 1)
+
+    def test_is_dirty(self):
+        """
+        The top-level subtrees changed since the last save or load are
+        dirty.
+        """
+        filename = self.makePersistFile()
+        self.assertFalse(self.persist.is_dirty())
+        self.persist.set("a.b", 1)
+        self.persist.set("c", 1, soft=True)
+        self.assertTrue(self.persist.is_dirty())
+        self.assertTrue(self.persist.is_dirty("a.c"))
+        self.assertFalse(self.persist.is_dirty("c"))
+        self.persist.save(filename)
+        self.assertFalse(self.persist.is_dirty())
+        self.persist.root_at("a").remove("b")
+        self.assertTrue(self.persist.root_at("a").is_dirty())
+
+        self.persist.load(filename)
+        self.assertFalse(self.persist.is_dirty())
+
     def test_save_on_nonexistent_dir(self):
         dirname = self.makePersistFile()
         filename = os.path.join(dirname, "foobar")
@@ -458,6 +549,175 @@ class SaveLoadPersistTest(testing.FSTestCase, BasePersistTest):
         self.assertEqual(persist.get("a"), 1)
 
 
+class JournalPersistTest(SaveLoadPersistTest):
+    """
+    The save and load behaviour is the same with L{JournalBPickleBackend},
+    which saves the changes to a journal next to the persist file.
+    """
+
+    def build_persist(self, *args, **kwargs):
+        kwargs.setdefault("backend", JournalBPickleBackend())
+        return Persist(*args, **kwargs)
+
+    def makePersistFile(self, *args, **kwargs):  # noqa: N802
+        kwargs.setdefault("dirname", self.makeDir())
+        return super().makePersistFile(*args, **kwargs)
+
+    def test_save_appends_to_journal(self):
+        """
+        Once the whole hard map has been saved, later saves to the same file
+        only append the changes to the journal.
+        """
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        with open(filename, "rb") as fd:
+            content = fd.read()
+        journal_size = os.path.getsize(filename + ".journal")
+
+        self.persist.set("b", [1, 2])
+        self.persist.save(filename)
+
+        with open(filename, "rb") as fd:
+            self.assertEqual(content, fd.read())
+        self.assertGreater(os.path.getsize(filename + ".journal"), journal_size)
+        persist = self.build_persist(filename=filename)
+        self.assertEqual({"a": 1, "b": [1, 2]}, persist.get((), hard=True))
+
+    def test_replay_journal(self):
+        """All the changes to the hard map are replayed when loading."""
+        filename = self.makePersistFile()
+        persist = self.build_persist(filename=filename)
+        persist.save()
+        for path, value in self.set_items:
+            persist.set(path, value)
+        persist.remove("ab")
+        for path, value in self.add_items:
+            persist.add(path, value)
+        persist.add("ab", 1, unique=True)
+        persist.add("ab", 7, unique=True)
+        persist.remove("ab[5].cd", "foo")
+        persist.remove("cd.ef")
+        self.assertRaises(PersistError, persist.add, "cd.gh.ij", 1)
+        persist.move("qr", "qs")
+        persist.set("soft", 1, soft=True)
+        persist.save()
+
+        loaded = self.build_persist(filename=filename)
+        result = loaded.get((), hard=True)
+        expected = persist.get((), hard=True)
+        self.assertEqual(expected, result, self.format(result, expected))
+        self.assertFalse(loaded.modified)
+
+    def test_load_then_append(self):
+        """
+        Changes made after loading a persist are appended to the journal
+        loaded with it.
+        """
+        filename = self.makePersistFile()
+        persist = self.build_persist(filename=filename)
+        persist.set("a", 1)
+        persist.save()
+        persist.set("b", 2)
+        persist.save()
+
+        persist = self.build_persist(filename=filename)
+        persist.set("c", 3)
+        persist.save()
+
+        persist = self.build_persist(filename=filename)
+        self.assertEqual({"a": 1, "b": 2, "c": 3}, persist.get((), hard=True))
+
+    def test_compact_journal(self):
+        """
+        Once the journal is larger than the persist file, the whole hard map
+        is saved again and the journal is started afresh.
+        """
+        filename = self.makePersistFile()
+        persist = Persist(
+            backend=JournalBPickleBackend(min_compact_size=0),
+            filename=filename,
+        )
+        persist.set("a", "x" * 100)
+        persist.save()
+        journal_size = os.path.getsize(filename + ".journal")
+        persist.set("b", 1)
+        persist.save()
+        self.assertGreater(os.path.getsize(filename + ".journal"), journal_size)
+
+        persist.set("c", "y" * 100)
+        persist.save()
+
+        self.assertEqual(journal_size, os.path.getsize(filename + ".journal"))
+        persist = self.build_persist(filename=filename)
+        expected = {"a": "x" * 100, "b": 1, "c": "y" * 100}
+        self.assertEqual(expected, persist.get((), hard=True))
+
+    def test_save_to_other_file(self):
+        """Saving to another file writes the whole hard map to it."""
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        self.persist.set("b", 2)
+        self.persist.save(filename)
+
+        other_filename = self.makePersistFile()
+        self.persist.save(other_filename)
+
+        persist = Persist()
+        persist.load(other_filename)
+        self.assertEqual({"a": 1, "b": 2}, persist.get((), hard=True))
+
+    def test_ignore_partial_record(self):
+        """A partially written record at the end of the journal is ignored."""
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        self.persist.set("b", 2)
+        self.persist.save(filename)
+        with open(filename + ".journal", "ab") as fd:
+            fd.write(b"20:ltu3:setti")
+
+        persist = self.build_persist(filename=filename)
+        self.assertEqual({"a": 1, "b": 2}, persist.get((), hard=True))
+
+    def test_ignore_stale_journal(self):
+        """
+        A journal left over from a previous persist file, for example if
+        the process stopped right after writing the whole hard map, isn't
+        replayed.
+        """
+        filename = self.makePersistFile()
+        self.persist.add("a", 1)
+        self.persist.save(filename)
+        self.persist.add("a", 2)
+        self.persist.save(filename)
+        with open(filename + ".journal", "rb") as fd:
+            journal = fd.read()
+
+        self.persist.save(self.makePersistFile())
+        self.persist.save(filename)
+        with open(filename + ".journal", "wb") as fd:
+            fd.write(journal)
+
+        persist = self.build_persist(filename=filename)
+        self.assertEqual({"a": [1, 2]}, persist.get((), hard=True))
+
+    def test_readonly_load(self):
+        """The journal is replayed when loading into a read-only persist."""
+        filename = self.makePersistFile()
+        self.persist.set("a", 1)
+        self.persist.save(filename)
+        self.persist.set("a", 2)
+        self.persist.save(filename)
+
+        persist = self.build_persist()
+        persist.readonly = True
+        persist.load(filename)
+        self.assertEqual(2, persist.get("a"))
+        self.assertTrue(persist.readonly)
+
+
 class RootedPersistTest(GeneralPersistTest):
     def build_persist(self, *args, **kwargs):
         return RootedPersist(Persist(), "root.path", *args, **kwargs)
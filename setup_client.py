@@ -16,6 +16,7 @@ PACKAGES = [
 ]
 MODULES = [
     "landscape.client.accumulate",
+    "landscape.client.allinone",
     "landscape.client.amp",
     "landscape.client.configuration",
     "landscape.client.deployment",
@@ -30,6 +31,7 @@ MODULES = [
 SCRIPTS = [
     "scripts/landscape-client",
     "scripts/landscape-config",
+    "scripts/landscape-all-in-one",
     "scripts/landscape-broker",
     "scripts/landscape-manager",
     "scripts/landscape-monitor",